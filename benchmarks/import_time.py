@@ -0,0 +1,100 @@
+"""
+Import time benchmark: each module is imported in a fresh interpreter, so
+that the numbers track the cost paid at startup by short-lived worker
+processes and command line jobs.
+
+Usage, from the root of the repository:
+
+    python benchmarks/import_time.py [--repeat N] [--json]
+
+The time of the explicit SageMath warm-up utilities.utils.speed_up_sagemath
+is reported separately, as importing the package alone should not load
+SageMath.
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "utilities.order",
+    "utilities.discrete_log",
+    "utilities.supersingular",
+    "biextensions.biextension",
+    "theta_structures.dimension_two",
+    "theta_structures.torsion",
+    "theta_isogenies.product_isogeny",
+    "theta_isogenies.product_isogeny_sqrt",
+]
+
+# Run in a fresh interpreter: import the module, then optionally warm up
+# SageMath, and report both times and whether sage.all was loaded
+SNIPPET = """
+import sys, time
+t0 = time.perf_counter()
+import {module}
+t1 = time.perf_counter()
+loaded = "sage.all" in sys.modules
+warm_up = 0.0
+if {warm_up}:
+    from utilities.utils import speed_up_sagemath
+    speed_up_sagemath()
+    warm_up = time.perf_counter() - t1
+print(t1 - t0, warm_up, int(loaded))
+"""
+
+
+def time_import(module, warm_up=False):
+    """
+    Import module in a fresh interpreter, returns the import time, the
+    time of speed_up_sagemath (0 when warm_up is False) and whether
+    sage.all was loaded by the import
+    """
+    code = SNIPPET.format(module=module, warm_up=warm_up)
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    t_import, t_warm_up, loaded = out.split()[-3:]
+    return float(t_import), float(t_warm_up), bool(int(loaded))
+
+
+def run(repeat=3):
+    """
+    Time the import of all modules `repeat` times, keeping the median
+    """
+    results = {}
+    for module in MODULES:
+        times = [time_import(module) for _ in range(repeat)]
+        results[module] = {
+            "import": statistics.median(t for t, _, _ in times),
+            "loads_sage": any(loaded for _, _, loaded in times),
+        }
+
+    warm_up = [time_import("utilities.utils", warm_up=True) for _ in range(repeat)]
+    results["speed_up_sagemath"] = {
+        "import": statistics.median(t for _, t, _ in warm_up),
+        "loads_sage": True,
+    }
+    return results
+
+
+if __name__ == "__main__":
+    repeat = 3
+    if "--repeat" in sys.argv:
+        repeat = int(sys.argv[sys.argv.index("--repeat") + 1])
+
+    results = run(repeat=repeat)
+    if "--json" in sys.argv:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, res in results.items():
+            sage = "loads sage.all" if res["loads_sage"] else ""
+            print(f"{name:40} {1000 * res['import']:8.1f}ms  {sage}")
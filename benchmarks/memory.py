@@ -0,0 +1,463 @@
+"""
+Memory benchmarks: peak and retained memory of the isogeny chains, of
+batches of pairings and of batched inversions, to size the memory of
+workers and to check the effect of compact representations and of the
+streaming modes.
+
+Usage, from the root of the repository:
+
+    python benchmarks/memory.py [--levels 128 192 256] [--r-bits 64 ...]
+        [--workloads chain pairing inversion] [--chains 4]
+        [--batches 16 64] [--inversions 4096 65536] [--interval 0]
+        [--json out.json]
+
+The workloads are, for every level (size of p) and size of r, with the
+parameters of suite.py:
+
+- chain: EllipticProductIsogeny of growing length n, the object retains its
+  (2, 2)-isogenies _phis, and the kernel elements pushed along the chain
+  make up most of the peak
+- pairing: reduced Tate pairings of a batch of Biextension on the Kummer
+  surface of the fixtures, retaining the pairings
+- inversion: batched_inversion of a list of elements of GF(p^2), retaining
+  the inverses, and iter_batched_inversion_or_zero consuming the inverses
+  as they are streamed
+
+Every workload is run once to warm up the caches of SageMath, then twice:
+
+- under tracemalloc, giving the peak and retained bytes allocated by
+  Python. The elements of finite fields are pari or GMP objects whose data
+  is not allocated by Python, so this undercounts them.
+- while sampling the resident set size (RSS) in a thread, giving the peak
+  and retained RSS of the process (the allocator does not always give
+  freed memory back, so retained RSS is an upper bound). The live objects
+  are counted by type (ThetaPoint, ThetaStructure, field elements, ...)
+  at the end of the stages of utilities.tracing (at most every `interval`
+  seconds, every stage by default), and once the workload returns. The
+  bytes of a type are the shallow sizes of its objects, plus the size of
+  the pari data for field elements. Peaks per type are sampled, so a workload without stages
+  (the inversions) only reports its retained objects.
+
+Counts and sizes are relative to before the workload. The registry of
+interned theta structures is cleared before each run.
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from sage.all import GF, set_random_seed
+
+from suite import (
+    LEVELS,
+    chain_lengths,
+    instance_arguments,
+    kummer_parameters,
+    metadata,
+    setup_chain,
+)
+
+from biextensions.biextension import Biextension
+from biextensions.morphism import Morphism as BiextensionMorphism
+from theta_isogenies.morphism import Morphism
+from theta_isogenies.product_isogeny import EllipticProductIsogeny
+from theta_structures.dimension_one import ThetaLine, ThetaLinePoint
+from theta_structures.dimension_two import ThetaPoint, ThetaStructure
+from theta_structures.interning import THETA_STRUCTURES
+from utilities.batched_inversion import batched_inversion, iter_batched_inversion_or_zero
+from utilities.instances import kummer_instance
+from utilities.tracing import tracing
+
+WORKLOADS = ["chain", "pairing", "inversion"]
+
+# ============================================= #
+#   Resident set size                           #
+# ============================================= #
+
+
+def rss_bytes():
+    """
+    The current resident set size of the process, or its peak on platforms
+    without /proc
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+
+        # kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else 1024 * peak
+
+
+class RSSSampler:
+    """
+    Samples the RSS every `interval` seconds in a thread, within a with
+    block. Only reads /proc: touching Python objects from another thread
+    while SageMath is running is not safe.
+    """
+
+    def __init__(self, interval=1e-3):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def __enter__(self):
+        self.peak = rss_bytes()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+        return False
+
+
+# ============================================= #
+#   Objects by type                             #
+# ============================================= #
+
+CATEGORIES = [
+    ("ThetaPoint", (ThetaPoint, ThetaLinePoint)),
+    ("ThetaStructure", (ThetaStructure, ThetaLine)),
+    ("Biextension", (Biextension,)),
+    ("morphism", (Morphism, BiextensionMorphism)),
+]
+
+
+class Census:
+    """
+    Count the live objects (tracked by the garbage collector) and their
+    sizes by category: those of CATEGORIES, "field element" and "other"
+    """
+
+    def __init__(self):
+        from sage.rings.finite_rings.element_base import FiniteRingElement
+
+        self._categories = CATEGORIES + [("field element", (FiniteRingElement,))]
+        self.names = [name for name, _ in self._categories] + ["other"]
+        self._category_of_type = {}
+        self._pari_bytes = {}
+
+    def _category(self, cls):
+        try:
+            return self._category_of_type[cls]
+        except KeyError:
+            pass
+        name = next(
+            (name for name, classes in self._categories if issubclass(cls, classes)),
+            "other",
+        )
+        self._category_of_type[cls] = name
+        return name
+
+    def _field_element_bytes(self, x):
+        """
+        The size of the pari data of an element of the parent of x, taken
+        on an element with full size coefficients
+        """
+        parent = x.parent()
+        try:
+            return self._pari_bytes[parent]
+        except KeyError:
+            pass
+        try:
+            g = parent.gen()
+            full = -sum(g**k for k in range(parent.degree()))
+            size = int(full.__pari__().sizebyte())
+        except (AttributeError, NotImplementedError, TypeError, ValueError):
+            size = 0
+        self._pari_bytes[parent] = size
+        return size
+
+    def take(self):
+        """
+        A dictionary category -> [count, bytes]
+        """
+        result = {name: [0, 0] for name in self.names}
+        # Do not keep a reference to the list of objects: some SageMath
+        # internals check reference counts
+        for obj in gc.get_objects():
+            name = self._category(type(obj))
+            entry = result[name]
+            entry[0] += 1
+            entry[1] += sys.getsizeof(obj)
+            if name == "field element":
+                entry[1] += self._field_element_bytes(obj)
+        return result
+
+
+# ============================================= #
+#   Measure                                     #
+# ============================================= #
+
+
+def _reset():
+    """
+    Clear the interned theta structures and collect garbage
+    """
+    THETA_STRUCTURES.clear()
+    gc.collect()
+
+
+def measure_memory(workload, interval=0.0):
+    """
+    Peak and retained memory of workload(), whose return value is what it
+    retains, see the docstring of the module
+    """
+    _reset()
+    workload()
+
+    # Bytes allocated by Python
+    _reset()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    result = workload()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    # RSS and objects by type
+    census = Census()
+    _reset()
+    # The peaks are updated in place, so that the samples are not counted
+    # themselves
+    peaks = {name: [0, 0] for name in census.names}
+    last = [0.0]
+    base_census = census.take()
+    base_rss = rss_bytes()
+
+    def sample(stage, elapsed):
+        if time.perf_counter() - last[0] < interval:
+            return
+        for name, (count, size) in census.take().items():
+            entry = peaks[name]
+            entry[0], entry[1] = max(entry[0], count), max(entry[1], size)
+        last[0] = time.perf_counter()
+
+    with RSSSampler() as sampler:
+        with tracing(callback=sample):
+            result = workload()
+        gc.collect()
+        retained = census.take()
+    retained_rss = rss_bytes() - base_rss
+    del result
+
+    types = {}
+    for name in census.names:
+        count0, bytes0 = base_census[name]
+        count1, bytes1 = retained[name]
+        entry = {
+            "peak_count": max(peaks[name][0], count1) - count0,
+            "peak_bytes": max(peaks[name][1], bytes1) - bytes0,
+            "retained_count": count1 - count0,
+            "retained_bytes": bytes1 - bytes0,
+        }
+        if any(entry.values()):
+            types[name] = entry
+
+    return {
+        "traced_peak": peak - base,
+        "traced_retained": current - base,
+        "rss_peak": sampler.peak - base_rss,
+        "rss_retained": retained_rss,
+        "types": types,
+    }
+
+
+# ============================================= #
+#   Workloads                                   #
+# ============================================= #
+
+
+def spread(values, count):
+    """
+    At most count values of a sorted list, evenly spread
+    """
+    if len(values) <= count:
+        return list(values)
+    if count == 1:
+        return [values[-1]]
+    return [values[round(i * (len(values) - 1) / (count - 1))] for i in range(count)]
+
+
+def chain_workloads(p, e, chains=4):
+    """
+    EllipticProductIsogeny of growing lengths, as a dictionary
+    n -> workload
+    """
+    workloads = {}
+    for n in spread(sorted(chain_lengths(e)), chains):
+        n, kernel, _ = setup_chain(p, e, n)
+        workloads[n] = lambda kernel=kernel, n=n: EllipticProductIsogeny(kernel, n)
+    return workloads
+
+
+def pairing_workloads(e, r, batches=(16, 64), seed=0):
+    """
+    Batches of reduced Tate pairings on the Kummer surface of the fixtures,
+    as a dictionary size -> workload
+    """
+    _, Kum, phi, _, Q, R, *_ = kummer_instance(e, r, seed=seed)
+
+    def Kpoint(T):
+        return Kum(phi(T).coords())
+
+    QK = Kpoint(Q)
+    points = []
+    Ri = R
+    for _ in range(max(batches)):
+        points.append((Kpoint(Ri), Kpoint(Ri + Q)))
+        Ri = Ri + R
+
+    def workload(size):
+        return [
+            Biextension(RK, QK, RQK).tate_pairing(r, k=2) for RK, RQK in points[:size]
+        ]
+
+    return {size: lambda size=size: workload(size) for size in batches}
+
+
+def inversion_workloads(p, sizes=(4096, 65536)):
+    """
+    batched_inversion and the streamed iter_batched_inversion_or_zero, as
+    a dictionary (name, size) -> workload
+    """
+    F = GF(p**2, name="i", modulus=[1, 0, 1])
+    values = [F.random_element() for _ in range(max(sizes))]
+
+    def stream(size):
+        count = 0
+        for _ in iter_batched_inversion_or_zero(values[:size]):
+            count += 1
+        return count
+
+    workloads = {}
+    for size in sizes:
+        workloads["batched_inversion", size] = lambda size=size: batched_inversion(
+            *values[:size]
+        )
+        workloads["iter_batched_inversion_or_zero", size] = lambda size=size: stream(size)
+    return workloads
+
+
+# ============================================= #
+#   Driver                                      #
+# ============================================= #
+
+
+def run(
+    levels=LEVELS,
+    r_bits=None,
+    workloads=WORKLOADS,
+    chains=4,
+    batches=(16, 64),
+    inversions=(4096, 65536),
+    interval=0.0,
+    seed=0,
+    verbose=True,
+):
+    """
+    Run the memory benchmarks, returns a dictionary with the metadata and
+    the list of results. r_bits defaults to half the size of p.
+    """
+    results = []
+    for level in levels:
+        for bits in r_bits or [level // 2]:
+            set_random_seed(seed)
+            p, e, r, f = kummer_parameters(level, bits)
+            params = {"level": level, "p_bits": p.nbits(), "r_bits": r.nbits(), "e": e}
+
+            cases = []
+            if "chain" in workloads:
+                for n, w in chain_workloads(p, e, chains).items():
+                    cases.append(("EllipticProductIsogeny", n, w))
+            if "pairing" in workloads:
+                for size, w in pairing_workloads(e, r, batches, seed).items():
+                    cases.append(("Biextension.tate_pairing", size, w))
+            if "inversion" in workloads:
+                for (name, size), w in inversion_workloads(p, inversions).items():
+                    cases.append((name, size, w))
+
+            for name, size, workload in cases:
+                result = {"op": name, "size": size, **params, **measure_memory(workload, interval)}
+                results.append(result)
+                if verbose:
+                    print(format_result(result))
+
+    return {"metadata": metadata(), "results": results}
+
+
+def _size(n):
+    """
+    A number of bytes in human readable form
+    """
+    for unit in ("B", "KiB", "MiB"):
+        if abs(n) < 1024:
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}GiB"
+
+
+def format_result(result):
+    lines = [
+        f"p{result['p_bits']:<4} r{result['r_bits']:<4} {result['op']:32}"
+        f" size {result['size']:<6}"
+        f" traced peak {_size(result['traced_peak']):>10} retained {_size(result['traced_retained']):>10}"
+        f"   rss peak {_size(result['rss_peak']):>10} retained {_size(result['rss_retained']):>10}"
+    ]
+    for name, entry in result["types"].items():
+        lines.append(
+            f"    {name:16} peak {entry['peak_count']:8} {_size(entry['peak_bytes']):>10}"
+            f"   retained {entry['retained_count']:8} {_size(entry['retained_bytes']):>10}"
+        )
+    return "\n".join(lines)
+
+
+def parser():
+    parser = argparse.ArgumentParser(
+        prog="python benchmarks/memory.py",
+        description="Peak and retained memory of the isogeny chains, pairings and inversions",
+    )
+    instance_arguments(parser)
+    parser.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=WORKLOADS)
+    parser.add_argument("--chains", type=int, default=4, help="number of chain lengths")
+    parser.add_argument("--batches", nargs="+", type=int, default=[16, 64], help="pairing batch sizes")
+    parser.add_argument(
+        "--inversions", nargs="+", type=int, default=[4096, 65536], help="inversion batch sizes"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=0.0, help="minimal seconds between object counts"
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    args = parser().parse_args()
+
+    data = run(
+        levels=args.levels,
+        r_bits=args.r_bits,
+        workloads=args.workloads,
+        chains=args.chains,
+        batches=args.batches,
+        inversions=args.inversions,
+        interval=args.interval,
+    )
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(data, f, indent=2)
@@ -0,0 +1,414 @@
+"""
+Benchmark suite for the theta arithmetic, the biextension ladders, the
+pairings (also on elliptic curves, against pari) and the isogeny chains,
+parameterised by the size of p and of the prime r such that we compute
+r-pairings.
+
+For every level (the size of p in bits) and every size of r, we use the
+prime p = 2^e * 3^2 * r * f - 1 with e as large as possible, and as in
+tests.py a Kummer surface obtained by gluing a product of supersingular
+elliptic curves, see utilities.instances. The isogeny chains are (2^n, 2^n)-isogenies from E1 x E0,
+where E1 is 3-isogenous to E0: y^2 = x^3 + x, with n <= e - 2 such that
+2^n - 3 is a prime.
+
+Usage, from the root of the repository:
+
+    python benchmarks/suite.py [--levels 128 192 256] [--r-bits 64 ...]
+        [--repeat N] [--ops pairing ThetaPoint.double ...] [--json out.json]
+        [--compare old.json]
+
+The operations are grouped in arithmetic, ladder, pairing, elliptic and
+isogeny, --ops selects groups or single operations (e.g. ThetaPoint.double).
+Each operation is timed on `repeat` samples, each sample running it enough
+times to last at least a millisecond. The JSON output contains for every
+operation the number of operations per second (from the median) and the
+percentiles of the time per call, so that results of different versions can
+be compared with --compare.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sage.all import EllipticCurve, GF, ZZ, pari, proof, set_random_seed, two_squares
+
+from biextensions.biextension import Biextension
+from theta_isogenies.product_isogeny import EllipticProductIsogeny
+from theta_structures.couple_point import CouplePoint
+from theta_structures.dimension_one import montgomery_biextension
+from theta_structures.torsion import theta_torsion_basis_with_pairing
+from utilities.instances import kummer_instance, kummer_prime
+
+proof.all(False)
+
+LEVELS = [128, 192, 256]
+
+# ============================================= #
+#   Timing                                      #
+# ============================================= #
+
+
+def percentile(sorted_times, q):
+    """
+    Percentile q (in [0, 100]) of a sorted list, with linear interpolation
+    """
+    k = (len(sorted_times) - 1) * q / 100
+    i = int(k)
+    j = min(i + 1, len(sorted_times) - 1)
+    return sorted_times[i] + (sorted_times[j] - sorted_times[i]) * (k - i)
+
+
+def measure(function, repeat=10, min_sample=1e-3):
+    """
+    Time function() on `repeat` samples, each sample calling it `number`
+    times where `number` is calibrated for a sample to last at least
+    min_sample seconds. Returns the statistics of the time per call.
+    """
+    number = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(number):
+            function()
+        if time.perf_counter() - t0 >= min_sample or number >= 1 << 16:
+            break
+        number *= 2
+
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - t0) / number)
+
+    times.sort()
+    median = statistics.median(times)
+    return {
+        "samples": repeat,
+        "number": number,
+        "ops_per_sec": 1 / median,
+        "mean": statistics.fmean(times),
+        "min": times[0],
+        "p50": median,
+        "p90": percentile(times, 90),
+        "p99": percentile(times, 99),
+        "max": times[-1],
+    }
+
+
+# ============================================= #
+#   Parameters                                  #
+# ============================================= #
+
+
+def kummer_parameters(level, r_bits):
+    """
+    The prime p = 2^e * 3^2 * r * f - 1 of about `level` bits, with r the
+    first prime above 2^(r_bits - 1) and e as large as possible
+    """
+    r = (ZZ(2) ** (r_bits - 1)).next_prime()
+    e = level - r.nbits() - 7
+    if e < 4:
+        raise ValueError(f"r of {r_bits} bits is too large for p of {level} bits")
+
+    p, f = kummer_prime(e, r)
+    return p, e, r, f
+
+
+def chain_lengths(e):
+    """
+    The n <= e - 2 such that 2^n - 3 is a prime, in decreasing order
+    """
+    return [n for n in range(e - 2, 2, -1) if (ZZ(2) ** n - 3).is_prime()]
+
+
+def chain_length(e, n=None):
+    """
+    The largest n <= e - 2 such that 2^n - 3 is a prime (or the given n),
+    and u, v with u^2 + v^2 = 2^n - 3
+    """
+    if n is None:
+        lengths = chain_lengths(e)
+        if not lengths:
+            raise ValueError(f"No chain length found for {e = }")
+        n = lengths[0]
+    elif n > e - 2 or not (ZZ(2) ** n - 3).is_prime():
+        raise ValueError(f"{n = } is not a valid chain length for {e = }")
+    u, v = two_squares(2**n - 3)
+    return n, u, v
+
+
+def setup_kummer(e, r, seed=0):
+    """
+    The Kummer surface of the instance of utilities.instances with these
+    parameters (read from the fixtures or the cache), and torsion bases of
+    order r and 2^e on it
+    """
+    Kum_proj, Kum, *_ = kummer_instance(e, r, seed=seed)
+    return {
+        "Kum_proj": Kum_proj,
+        "Kum": Kum,
+        "odd": theta_torsion_basis_with_pairing(Kum, r),
+        "even": theta_torsion_basis_with_pairing(Kum, 2**e),
+    }
+
+
+def setup_chain(p, e, n=None):
+    """
+    The kernel of a (2^n, 2^n)-isogeny E1 x E0 -> E3 x E4 given by the
+    endomorphism u + v * i of E0 and a 3-isogeny E0 -> E1, as in the
+    isogeny tests. n defaults to the largest possible length.
+    """
+    n, u, v = chain_length(e, n)
+    F = GF(p**2, name="i", modulus=[1, 0, 1])
+    i = F.gen()
+    E0 = EllipticCurve(F, [1, 0])
+
+    P0, Q0 = E0.torsion_basis(2**e)
+    alpha = E0.isogeny(E0.torsion_basis(3)[0])
+    iso = alpha.codomain().isomorphism_to(alpha.codomain().montgomery_model())
+    E1 = iso.codomain()
+
+    def gamma(P):
+        return u * P + v * E0(-P[0], i * P[1])
+
+    P, Q = 2 ** (e - n - 2) * P0, 2 ** (e - n - 2) * Q0
+    kernel = (
+        CouplePoint(iso(alpha(P)), gamma(P)),
+        CouplePoint(iso(alpha(Q)), gamma(Q)),
+    )
+    return n, kernel, CouplePoint(E1.random_point(), E0.random_point())
+
+
+# ============================================= #
+#   Operations                                  #
+# ============================================= #
+
+
+def kummer_operations(kummer, e, r):
+    """
+    The operations on Kummer surfaces, as a dictionary
+    name -> (group, function)
+    """
+    Kum_proj, Kum = kummer["Kum_proj"], kummer["Kum"]
+    P, Q, PQ, _ = kummer["odd"]
+    Pe, Qe, PQe, _ = kummer["even"]
+
+    # Projective and affine points
+    X, Y, XY = (Kum_proj(T.coords()) for T in (P, Q, PQ))
+    XmY = X.diff_add(Y, XY)
+    # Z = 2Q, so that P + Q + Z = P + 3Q
+    Z = Q.double()
+    PZ, QZ = PQ.diff_add(Q, P), Z.diff_add(Q, Q)
+
+    g = Biextension(P, Q, PQ)
+    ge = Biextension(Pe, Qe, PQe)
+
+    return {
+        "ThetaPoint.double": ("arithmetic", lambda: X.double()),
+        "ThetaPoint.diff_add": ("arithmetic", lambda: X.diff_add(Y, XmY)),
+        "ThetaPoint.double_iter": ("arithmetic", lambda: X.double_iter(e)),
+        "ThetaPoint.mul": ("arithmetic", lambda: X * r),
+        "AffineThetaPoint.double": ("arithmetic", lambda: P.double()),
+        "AffineThetaPoint.diff_add": ("arithmetic", lambda: P.diff_add(Q, PQ)),
+        "AffineThetaPoint.three_way_add": (
+            "arithmetic",
+            lambda: P.three_way_add(Q, Z, QZ, PZ, PQ),
+        ),
+        "Biextension.ladder": ("ladder", lambda: g.ladder(r)),
+        "Biextension.full_ladder_bis": ("ladder", lambda: g.full_ladder_bis(r)),
+        "Biextension.fast_ladder": ("ladder", lambda: g.fast_ladder(r)),
+        "Biextension.fast_ladder_bis": ("ladder", lambda: g.fast_ladder_bis(r)),
+        "Biextension.non_reduced_tate_pairing": (
+            "pairing",
+            lambda: g.non_reduced_tate_pairing(r),
+        ),
+        "Biextension.tate_pairing": ("pairing", lambda: g.tate_pairing(r, k=2)),
+        "Biextension.weil_pairing": ("pairing", lambda: g.weil_pairing(r)),
+        "Biextension.even_non_reduced_tate_pairing": (
+            "pairing",
+            lambda: ge.even_non_reduced_tate_pairing(2**e),
+        ),
+        "Biextension.even_tate_pairing": (
+            "pairing",
+            lambda: ge.tate_pairing(2**e, k=2),
+        ),
+        "Biextension.even_weil_pairing": ("pairing", lambda: ge.weil_pairing(2**e)),
+    }
+
+
+def elliptic_operations(p, r):
+    """
+    Pairings on the Montgomery curve y^2 = x^3 + 6x^2 + x on its theta line,
+    compared to pari, as a dictionary name -> (group, function)
+    """
+    F = GF(p**2, name="i", modulus=[1, 0, 1])
+    E = EllipticCurve(F, [0, 6, 0, 1, 0])
+    cofactor = (p + 1) // r
+    P, Q = cofactor * E.random_point(), cofactor * E.random_point()
+
+    g = montgomery_biextension(P, Q)
+    E_pari, P_pari, Q_pari = pari(E), pari(P), pari(Q)
+    return {
+        "ThetaLine.tate_pairing": ("elliptic", lambda: g.tate_pairing(r, k=2)),
+        "ThetaLine.weil_pairing": ("elliptic", lambda: g.weil_pairing(r)),
+        "pari.elltatepairing": (
+            "elliptic",
+            lambda: pari.elltatepairing(E_pari, P_pari, Q_pari, r) ** ((p**2 - 1) // r),
+        ),
+        "pari.ellweilpairing": (
+            "elliptic",
+            lambda: pari.ellweilpairing(E_pari, P_pari, Q_pari, r),
+        ),
+    }
+
+
+def isogeny_operations(n, kernel, R):
+    """
+    Construction and evaluation of EllipticProductIsogeny, as a dictionary
+    name -> (group, function)
+    """
+    Phi = EllipticProductIsogeny(kernel, n)
+    return {
+        "EllipticProductIsogeny": ("isogeny", lambda: EllipticProductIsogeny(kernel, n)),
+        "EllipticProductIsogeny.__call__": ("isogeny", lambda: Phi(R)),
+    }
+
+
+# ============================================= #
+#   Driver                                      #
+# ============================================= #
+
+
+def metadata():
+    """
+    Information on the environment, stored with the results
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    from sage.version import version
+
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "sage": version,
+        "machine": platform.machine(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def run(levels=LEVELS, r_bits=None, repeat=10, groups=None, seed=0, verbose=True):
+    """
+    Run the benchmarks, returns a dictionary with the metadata and the list
+    of results. r_bits defaults to half the size of p. Only the operations
+    whose group or name is in `groups` are run, when given.
+    """
+    results = []
+    for level in levels:
+        for bits in r_bits or [level // 2]:
+            set_random_seed(seed)
+            p, e, r, f = kummer_parameters(level, bits)
+            params = {"level": level, "p_bits": p.nbits(), "r_bits": r.nbits(), "e": e}
+
+            operations = {}
+            if groups is None or any("isogeny" not in g.lower() for g in groups):
+                operations.update(kummer_operations(setup_kummer(e, r, seed), e, r))
+                operations.update(elliptic_operations(p, r))
+            if groups is None or any("isogeny" in g.lower() for g in groups):
+                n, kernel, R = setup_chain(p, e)
+                params["n"] = n
+                operations.update(isogeny_operations(n, kernel, R))
+
+            for name, (group, function) in operations.items():
+                if groups is not None and group not in groups and name not in groups:
+                    continue
+                # the isogeny chains are slow, we take fewer samples
+                samples = max(3, repeat // 3) if group == "isogeny" else repeat
+                result = {"op": name, "group": group, **params, **measure(function, samples)}
+                results.append(result)
+                if verbose:
+                    print(format_result(result))
+
+    return {"metadata": metadata(), "results": results}
+
+
+def format_result(result):
+    return (
+        f"p{result['p_bits']:<4} r{result['r_bits']:<4} {result['op']:45}"
+        f" {1000 * result['p50']:10.3f}ms  p90 {1000 * result['p90']:10.3f}ms"
+        f" {result['ops_per_sec']:10.1f} ops/s"
+    )
+
+
+def compare(new, old):
+    """
+    Print the ratio of the median times of the operations in new and old,
+    a ratio above 1 is a slowdown
+    """
+    key = lambda res: (res["op"], res["level"], res["r_bits"])
+    old_results = {key(res): res for res in old["results"]}
+    for res in new["results"]:
+        ref = old_results.get(key(res))
+        if ref is None:
+            continue
+        ratio = res["p50"] / ref["p50"]
+        print(f"p{res['p_bits']:<4} r{res['r_bits']:<4} {res['op']:45} {ratio:6.2f}x")
+
+
+def instance_arguments(parser):
+    """
+    Add the options selecting the instances, --levels and --r-bits, and the
+    --json output to parser, shared with benchmarks/memory.py
+    """
+    parser.add_argument("--levels", nargs="+", type=int, default=LEVELS, help="sizes of p in bits")
+    parser.add_argument(
+        "--r-bits", nargs="+", type=int, help="sizes of r in bits, half the size of p by default"
+    )
+    parser.add_argument("--json", help="write the results to this file")
+    return parser
+
+
+def parser():
+    parser = argparse.ArgumentParser(
+        prog="python benchmarks/suite.py",
+        description="Timings of the theta arithmetic, the pairings and the isogeny chains",
+    )
+    instance_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=10, help="samples per operation")
+    parser.add_argument("--ops", nargs="+", help="groups or single operations to run")
+    parser.add_argument("--compare", help="JSON output of a previous run to compare with")
+    return parser
+
+
+if __name__ == "__main__":
+    args = parser().parse_args()
+
+    data = run(
+        levels=args.levels,
+        r_bits=args.r_bits,
+        repeat=args.repeat,
+        groups=None if args.ops is None else set(args.ops),
+    )
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(data, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(data, json.load(f))
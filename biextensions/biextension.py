@@ -1,4 +1,9 @@
-from sage.all import Integer
+from sage.misc.lazy_import import lazy_import
+
+lazy_import("sage.all", "Integer")
+
+from utilities.order import theta_is_zero
+from utilities.tracing import stage
 
 class Biextension:
     @classmethod
@@ -247,42 +252,80 @@ class Biextension:
         nQ, nQP = self.P().full_ladder3_bis(n, self.Q(), self.PQ())
         return self.new_element(nQ, nQP)
 
+    # when check is True, raise an error if g = self^n does not give the
+    # neutral point: g.Q() is nQ, so checking that Q is a point of n-torsion
+    # comes for free with the pairing computation
+    def _check_torsion(self, g, n):
+        if not theta_is_zero(g.Q()):
+            raise ValueError(f"The point Q is not a point of {n}-torsion")
+
     # here self.Q() is a point of n-torsion
-    def non_reduced_tate_pairing(self, n, exp_function=None):
+    def non_reduced_tate_pairing(self, n, exp_function=None, check=False):
         if exp_function is None:
             def exp_function(g, n):
                 return g.fast_ladder_bis(n)
-        g = exp_function(self, n)
-        return self.neutral().ratio(g)
+        with stage("ladder"):
+            g = exp_function(self, n)
+        if check:
+            self._check_torsion(g, n)
+        with stage("ratio"):
+            return self.neutral().ratio(g)
 
     # special case when n is even: we can use the action of G(20E) to
     # compute the Tate pairing on (0E) rather than 2(0E)
-    def even_non_reduced_tate_pairing(self, n, exp_function=None):
+    def even_non_reduced_tate_pairing(self, n, exp_function=None, check=False):
         assert n%2==0
         m=n//2
         if exp_function is None:
             def exp_function(g, n):
                 return g.fast_ladder_bis(n)
-        g = exp_function(self, m)
+        with stage("ladder"):
+            g = exp_function(self, m)
         Q = g.Q()
-        gT = g.translate_by(Q)
-        return self.neutral().ratio(gT)
-
-    def tate_pairing(self, n, k=1, d=None, exp_function=None):
+        with stage("translation"):
+            gT = g.translate_by(Q)
+        if check:
+            # gT.Q() is mQ translated by mQ, that is nQ when mQ is a point
+            # of 2-torsion
+            self._check_torsion(gT, n)
+        with stage("ratio"):
+            return self.neutral().ratio(gT)
+
+    def tate_pairing(self, n, k=1, d=None, exp_function=None, check=False):
         if d is None:
             p=self.P().parent().base_ring().characteristic()
             d=(p**k-1)/n
         if n%2==0:
-            r=self.even_non_reduced_tate_pairing(n, exp_function=exp_function)
+            r=self.even_non_reduced_tate_pairing(n, exp_function=exp_function, check=check)
         else:
-            r=self.non_reduced_tate_pairing(n, exp_function=exp_function)
-        return r**d
+            r=self.non_reduced_tate_pairing(n, exp_function=exp_function, check=check)
+        with stage("final_exponentiation"):
+            return r**d
 
-    def weil_pairing(self, n, exp_function=None):
+    def weil_pairing(self, n, exp_function=None, check=False):
         if n%2==0:
-            r1=self.even_non_reduced_tate_pairing(n, exp_function=exp_function)
-            r2=self.swap().even_non_reduced_tate_pairing(n, exp_function=exp_function)
+            r1=self.even_non_reduced_tate_pairing(n, exp_function=exp_function, check=check)
+            r2=self.swap().even_non_reduced_tate_pairing(n, exp_function=exp_function, check=check)
         else:
-            r1=self.non_reduced_tate_pairing(n, exp_function=exp_function)
-            r2=self.swap().non_reduced_tate_pairing(n, exp_function=exp_function)
+            r1=self.non_reduced_tate_pairing(n, exp_function=exp_function, check=check)
+            r2=self.swap().non_reduced_tate_pairing(n, exp_function=exp_function, check=check)
         return r1/r2
+
+    # batch versions: elements may be any iterable of biextension elements,
+    # e.g. a PointStore of BIEXTENSIONS, and the pairings are appended to
+    # out, e.g. a PointStoreWriter of ELEMENTS, when given
+    @staticmethod
+    def tate_pairings(elements, n, k=1, d=None, exp_function=None, check=False, out=None):
+        if out is None:
+            out = []
+        for g in elements:
+            out.append(g.tate_pairing(n, k=k, d=d, exp_function=exp_function, check=check))
+        return out
+
+    @staticmethod
+    def weil_pairings(elements, n, exp_function=None, check=False, out=None):
+        if out is None:
+            out = []
+        for g in elements:
+            out.append(g.weil_pairing(n, exp_function=exp_function, check=check))
+        return out
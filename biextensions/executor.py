@@ -0,0 +1,232 @@
+"""
+Batch pairings over a pool of worker processes.
+
+The structure is sent to each worker once, by the initializer of the pool,
+in the compact format of utilities.serialization, together with its
+arithmetic precomputation so that the workers do not redo the inversions.
+The triples (P, Q, P + Q) are then sent in chunks as raw coordinates,
+without any header, and the pairings come back the same way.
+
+Chunks are encoded in the calling thread (pari elements are not safe to
+pickle from the pool's feeder thread) and at most `max_pending` chunks are
+in flight: the input is consumed as the results are, so the input and the
+output can be streams (e.g. utilities.point_store) larger than memory.
+Results are returned in the order of the input.
+
+    with PairingExecutor(Kum, processes=64) as executor:
+        pairings = executor.tate_pairings(triples, r, k=2)
+
+NOTE: exp_function cannot be given, as closures cannot be sent to the
+workers, and the stages of the workers are not recorded by
+utilities.tracing in the calling process.
+"""
+
+import gc
+import os
+from collections import deque
+
+from biextensions.biextension import Biextension
+from utilities.serialization import STRUCTURE, decode_header, encode_header
+
+# ============================================= #
+#   Workers                                     #
+# ============================================= #
+
+# The codec and the structure of the worker, set by _initialize_worker
+_WORKER = None
+
+
+def _decode_worker(header, precomputation):
+    """
+    The codec and the structure, with its arithmetic precomputation, sent
+    to the workers
+    """
+    codec, theta, _ = decode_header(header, STRUCTURE)
+    if precomputation:
+        theta._precomputation = codec.decode_elements(
+            precomputation, 0, len(precomputation) // codec.element_size
+        )
+    return codec, theta
+
+
+def _initialize_worker(header, precomputation):
+    """
+    Initializer of the pool: decode the structure and its arithmetic
+    precomputation
+    """
+    global _WORKER
+    _WORKER = _decode_worker(header, precomputation)
+
+
+def compute_pairings(codec, theta, method, args, data):
+    """
+    Compute the pairings x.method(*args) of the Biextension x = (P, Q, P + Q)
+    of a chunk of triples of points of theta, given as the bytes of their
+    coordinates, returns the bytes of the pairings
+    """
+    n = len(theta.coords())
+    coords = codec.decode_elements(data, 0, len(data) // codec.element_size)
+    point = theta._point
+
+    pairings = []
+    for i in range(0, len(coords), 3 * n):
+        P, Q, PQ = (point(theta, tuple(coords[j : j + n])) for j in range(i, i + 3 * n, n))
+        pairings.append(getattr(Biextension(P, Q, PQ), method)(*args))
+    return codec.encode_elements(pairings)
+
+
+def _pairings_worker(task):
+    method, args, data = task
+    codec, theta = _WORKER
+    return compute_pairings(codec, theta, method, args, data)
+
+
+# ============================================= #
+#   Executor                                    #
+# ============================================= #
+
+
+class PairingExecutor:
+    """
+    Compute pairings of triples (P, Q, P + Q) of points of theta (or of
+    biextension elements over it) over a pool of `processes` workers (all
+    the cores by default), in chunks of chunk_size triples with at most
+    max_pending chunks in flight (4 per worker by default).
+
+    context is a multiprocessing context or the name of a start method
+    ("fork", "spawn", ...), the default one by default.
+    """
+
+    def __init__(self, theta, processes=None, chunk_size=64, max_pending=None, context=None):
+        if chunk_size < 1:
+            raise ValueError("The chunk size must be positive")
+        self.theta = theta
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending or 4 * self.processes
+        self.context = context
+
+        self._codec, self._header = encode_header(STRUCTURE, theta)
+        self._pool = None
+
+    def __repr__(self):
+        return (
+            f"Pairing executor over {self.processes} processes "
+            f"(chunk_size={self.chunk_size}, max_pending={self.max_pending})"
+        )
+
+    def _precomputation(self):
+        """
+        The bytes of the arithmetic precomputation of theta
+        """
+        theta = self.theta
+        theta._arithmetic_precomputation()
+        if theta._precomputation is None:
+            return b""
+        return self._codec.encode_elements(theta._precomputation)
+
+    def start(self):
+        """
+        Start the pool, this is done on first use
+        """
+        if self._pool is None:
+            import multiprocessing
+
+            context = self.context
+            if context is None or isinstance(context, str):
+                context = multiprocessing.get_context(context)
+            # a worker failing in the initializer is replaced forever by
+            # the pool, so the data is checked here first
+            initargs = (self._header, self._precomputation())
+            _decode_worker(*initargs)
+            # the check leaves cycles of pari elements, collect them now
+            # rather than from one of the threads of the pool
+            gc.collect()
+            self._pool = context.Pool(
+                self.processes,
+                initializer=_initialize_worker,
+                initargs=initargs,
+            )
+        return self
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def terminate(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+        return False
+
+    def _encode(self, chunk):
+        encode = self._codec.encode_elements
+        coords = []
+        for x in chunk:
+            P, Q, PQ = (x.P(), x.Q(), x.PQ()) if isinstance(x, Biextension) else x
+            coords.extend(P.coords())
+            coords.extend(Q.coords())
+            coords.extend(PQ.coords())
+        return encode(coords)
+
+    def _decode(self, data):
+        codec = self._codec
+        return codec.decode_elements(data, 0, len(data) // codec.element_size)
+
+    def imap(self, method, triples, *args):
+        """
+        Yield the pairings x.method(*args) of the Biextension x = (P, Q, P + Q)
+        for the triples, in order
+        """
+        self.start()
+        pending = deque()
+        chunk = []
+        for x in triples:
+            chunk.append(x)
+            if len(chunk) < self.chunk_size:
+                continue
+            task = (method, args, self._encode(chunk))
+            pending.append(self._pool.apply_async(_pairings_worker, (task,)))
+            chunk = []
+            # Backpressure: wait for the oldest chunk before sending more
+            if len(pending) >= self.max_pending:
+                yield from self._decode(pending.popleft().get())
+
+        if chunk:
+            task = (method, args, self._encode(chunk))
+            pending.append(self._pool.apply_async(_pairings_worker, (task,)))
+        while pending:
+            yield from self._decode(pending.popleft().get())
+
+    def _collect(self, pairings, out):
+        if out is None:
+            return list(pairings)
+        for x in pairings:
+            out.append(x)
+        return out
+
+    def tate_pairings(self, triples, n, k=1, d=None, check=False, out=None):
+        """
+        The reduced Tate pairings, see Biextension.tate_pairing, appended
+        to out (e.g. a PointStoreWriter) when given
+        """
+        return self._collect(self.imap("tate_pairing", triples, n, k, d, None, check), out)
+
+    def weil_pairings(self, triples, n, check=False, out=None):
+        """
+        The Weil pairings, see Biextension.weil_pairing, appended to out
+        when given
+        """
+        return self._collect(self.imap("weil_pairing", triples, n, None, check), out)
@@ -1,4 +1,8 @@
-from sage.all import Matrix
+from sage.misc.lazy_import import lazy_import
+
+lazy_import("sage.all", "Matrix")
+
+from utilities.linear_map import CompiledLinearMap
 
 class Morphism:
     def __init__(self, domain = None, codomain = None, image=None, inverse_image = None):
@@ -41,6 +45,9 @@ class Morphism:
     def compose(self, f2):
         return ComposedMorphism(f1=self, f2=f2)
 
+    def fuse(self):
+        return FusedMorphism(self)
+
     def __mul__(self, psi):
         return self.compose(psi)
 
@@ -68,6 +75,7 @@ class ComposedMorphism(Morphism):
         self._codomain = f2.codomain()
         self._f1 = f1
         self._f2 = f2
+        self._fused = None
 
     def first(self):
         return self._f1
@@ -84,20 +92,154 @@ class ComposedMorphism(Morphism):
         f2dual=self._f2.dual()
         return ComposedMorphism(f2dual, f1dual)
 
+    # the chain is fused on request, when all its morphisms are linear maps
+    # of theta coordinates, and is returned as it is otherwise
+    def fuse(self):
+        if self._fused is None:
+            self._fused = FusedMorphism(self) if FusedMorphism.fusable(self) else self
+        return self._fused
+
     def image(self, P):
         P1 = self.f1(P)
         P2 = self.f2(P1)
         return P2
 
+    # points may be any iterable, e.g. a PointStore, and the images are
+    # appended to out, e.g. a PointStoreWriter, when given
+    def images(self, points, out=None):
+        images = (self(P) for P in points)
+        if out is None:
+            return list(images)
+        for Q in images:
+            out.append(Q)
+        return out
+
     def inverse_image(self, P):
         P2 = self.second().inverse_image(P)
         P1 = self.first().inverse_image(P2)
         return P1
 
+# A chain f_1, ..., f_k (applied in this order) of linear maps of theta
+# coordinates flattened into a single callable acting on coordinates:
+# - the TrivialChangeModel which only re-wrap the coordinates are dropped
+# - adjacent LinearIsomorphism are folded into one compiled matrix
+# the codomain wrapping is only done once, at the end of the chain
+class FusedMorphism(Morphism):
+    def __init__(self, *morphisms):
+        chain = []
+        for f in morphisms:
+            chain.extend(self._flatten(f))
+        if not chain:
+            raise ValueError("Cannot fuse an empty chain of morphisms")
+        for f in chain:
+            if not self._is_linear(f):
+                raise ValueError(f"Only linear maps of theta coordinates can be fused, not {f}")
+        super().__init__(domain=chain[0].domain(), codomain=chain[-1].codomain())
+        self._chain = tuple(chain)
+        self._stages = self._fold(chain)
+        self._image_coords = self._flat_callable(self._stages)
+        # computed on first use, see dual
+        self._dual = None
+
+    @staticmethod
+    def _flatten(f):
+        if isinstance(f, FusedMorphism):
+            return list(f._chain)
+        if isinstance(f, ComposedMorphism):
+            return FusedMorphism._flatten(f.first()) + FusedMorphism._flatten(f.second())
+        return [f]
+
+    @staticmethod
+    def _is_linear(f):
+        if isinstance(f, TrivialChangeModel):
+            return f.rewraps()
+        return isinstance(f, LinearIsomorphism) and f.N() is not None
+
+    @staticmethod
+    def fusable(*morphisms):
+        """
+        Whether the chain of morphisms only has linear maps of theta
+        coordinates, and can be fused
+        """
+        return all(
+            FusedMorphism._is_linear(g) for f in morphisms for g in FusedMorphism._flatten(f)
+        )
+
+    @staticmethod
+    def _fold(chain):
+        stages = []
+        for f in chain:
+            if isinstance(f, TrivialChangeModel):
+                continue
+            if stages:
+                f = stages.pop().fold_compose(f)
+            stages.append(f)
+        return stages
+
+    @staticmethod
+    def _flat_callable(stages):
+        if not stages:
+            def image_coords(coords):
+                return coords
+            return image_coords
+        return stages[0]._linear_map
+
+    def stages(self):
+        return list(self._stages)
+
+    def flat(self):
+        """
+        Return the fused chain as a single callable on coordinate tuples
+        """
+        return self._image_coords
+
+    def image(self, P):
+        coords = P if isinstance(P, tuple) else P.coords()
+        return self.codomain()(self._image_coords(coords))
+
+    # points may be any iterable, e.g. a PointStore, and the images are
+    # appended to out, e.g. a PointStoreWriter, when given
+    def images(self, points, out=None):
+        image_coords = self._image_coords
+        wrap = self.codomain()
+        images = (wrap(image_coords(P if isinstance(P, tuple) else P.coords())) for P in points)
+        if out is None:
+            return list(images)
+        for Q in images:
+            out.append(Q)
+        return out
+
+    def __call__(self, P):
+        return self.image(P)
+
+    # the dual of the folded stages (so one matrix inversion per folded
+    # linear map), computed once; the stages themselves are left untouched.
+    # The dropped changes of model at both ends of the chain are replaced by
+    # re-wrappings, so that the dual goes from our codomain to our domain
+    def dual(self):
+        if self._dual is None:
+            stages = self._stages
+            dual_chain = [TrivialChangeModel(domain=self.codomain(), codomain=stages[-1].codomain())] if stages else []
+            dual_chain += [f.dual() for f in reversed(stages)]
+            start = stages[0].domain() if stages else self.codomain()
+            dual_chain.append(TrivialChangeModel(domain=start, codomain=self.domain()))
+            self._dual = FusedMorphism(*dual_chain)
+        return self._dual
+
+    def inverse_image(self, P):
+        return self.dual()(P)
+
+    def compose(self, f2):
+        return FusedMorphism(self, f2)
+
 class LinearIsomorphism(Isomorphism):
     def __init__(self, domain = None, codomain = None, N = None, **kwds):
         super().__init__(domain=domain, codomain=codomain,**kwds)
         self._N = N
+        # signed permutations and 0/±1/±i matrices are applied without
+        # multiplications, see utilities.linear_map
+        self._linear_map = None if N is None else CompiledLinearMap(N)
+        self._dual = None
 
     def N(self):
         return self._N
@@ -115,33 +257,28 @@ class LinearIsomorphism(Isomorphism):
         return LinearIsomorphism(domain = self.codomain(), codomain = self.domain(), N = N_inverse)
 
     def inverse_image(self, P):
-        f=self.dual()
-        return f(P)
+        if self._dual is None:
+            self._dual = self.dual()
+        return self._dual(P)
 
     def apply_isomorphism(self, P):
-        if self.N() is None:
+        if self._linear_map is None:
             raise ValueError("Isomorphism matrix not specified")
-        N = self.N()
-        x, y, z, t = P.coords()
-        X = N[0, 0] * x + N[0, 1] * y + N[0, 2] * z + N[0, 3] * t
-        Y = N[1, 0] * x + N[1, 1] * y + N[1, 2] * z + N[1, 3] * t
-        Z = N[2, 0] * x + N[2, 1] * y + N[2, 2] * z + N[2, 3] * t
-        T = N[3, 0] * x + N[3, 1] * y + N[3, 2] * z + N[3, 3] * t
-
-        return (X, Y, Z, T)
+        return self._linear_map(P.coords())
 
     def image(self, P):
         #print(self)
         return self.apply_isomorphism(P)
 
+    # self followed by iso, as a single linear isomorphism
     def fold_compose(self, iso):
-        assert iso.__class__ == Isomorphism
+        assert isinstance(iso, LinearIsomorphism)
         domain = self.domain()
         codomain = iso.codomain()
         N1 = self.N()
-        N2 = self.N()
+        N2 = iso.N()
         N = N2 * N1
-        return Isomorphism(domain=domain, codomain=codomain, N=N)
+        return LinearIsomorphism(domain=domain, codomain=codomain, N=N)
 
 class LinearChangeModel(LinearIsomorphism):
     pass
@@ -165,17 +302,32 @@ class TrivialChangeModel(ChangeModel):
     def identity(K, image=None):
         if image is None:
             image = K
-        elif image == "Id":
+        elif isinstance(image, str) and image == "Id":
             def image(P):
                 return P
-        return TrivialChangeModel(domain=K, codomain=K, image=image, inverse_image=image)
-
-    def __init__(self, domain = None, codomain = None, image = None, inverse_image = None, **kwds):
+        else:
+            # a given map is kept as it is
+            return TrivialChangeModel(domain=K, codomain=K, image=image, inverse_image=image)
+        return TrivialChangeModel(domain=K, codomain=K, image=image, inverse_image=image, rewraps=True)
+
+    # rewraps tells whether the change of model only re-wraps the
+    # coordinates, in which case it can be dropped from a FusedMorphism; by
+    # default this is the case when no image is given
+    def __init__(self, domain = None, codomain = None, image = None, inverse_image = None, rewraps = None, **kwds):
         if image is None:
             image = codomain
         if inverse_image is None:
             inverse_image = domain
         super().__init__(domain=domain, codomain=codomain, image=image, inverse_image=inverse_image,**kwds)
+        if rewraps is None:
+            rewraps = image is codomain and inverse_image is domain
+        self._rewraps = rewraps
+
+    def rewraps(self):
+        return self._rewraps
+
+    def dual(self):
+        return TrivialChangeModel(domain=self.codomain(), codomain=self.domain(), image=self._inverse_image, inverse_image=self._image, rewraps=self._rewraps)
 
 class Isogeny(Morphism):
     pass
@@ -1,37 +1,52 @@
-from biextensions.biextension import Biextension
+import asyncio
+import contextlib
+import gc
+import io
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import Pool
+
 from sage.all import proof
-from sage.schemes.elliptic_curves.constructor import EllipticCurve
+from sage.arith.misc import is_prime
+from sage.groups.generic import discrete_log
+from sage.matrix.constructor import Matrix, matrix
+from sage.matrix.special import identity_matrix, random_matrix
+from sage.misc.prandom import randrange
+from sage.modules.free_module_element import vector
 from sage.rings.finite_rings.finite_field_constructor import GF
 from sage.rings.integer_ring import ZZ
-from utilities.discrete_log import discrete_log_pari
+from sage.schemes.elliptic_curves.constructor import EllipticCurve
+from sage.sets.primes import Primes
+
+from biextensions.biextension import Biextension
+from biextensions.executor import PairingExecutor
+from biextensions.morphism import ComposedMorphism, FusedMorphism, Isomorphism, Translation, TrivialChangeModel
+from theta_isogenies.product_isogeny import EllipticProductIsogeny
+from theta_isogenies.product_isogeny_sqrt import EllipticProductIsogenySqrt
+from theta_structures import interning
+from theta_structures.couple_kummer_point import CoupleKummerPoint
 from theta_structures.couple_point import CouplePoint
-from theta_isogenies.gluing_isogeny import GluingThetaIsogeny
+from theta_structures.dimension_one import ThetaLine, montgomery_biextension
+from theta_structures.interning import ThetaStructureRegistry
+from theta_structures.torsion import default_cofactor, theta_torsion_basis_with_pairing
+from utilities import cli
+from utilities.aio import AsyncWorkerPool, apair
+from utilities.batched_inversion import batched_inversion_or_zero, iter_batched_inversion_or_zero, tree_inversion_or_zero
+from utilities.daemon import PairingClient, PairingServer, ServerError, serve
+from utilities.discrete_log import PreparedDLP, PrimePowerDLP, pohlig_hellman
+from utilities.fast_sqrt import batched_sqrt_Fp2, sqrt_Fp, sqrt_Fp2, sqrt_Fp2_or_none
+from utilities.instances import kummer_field, kummer_instance
+from utilities.linear_map import CompiledLinearMap
+from utilities.order import has_order_D
+from utilities.point_store import PointStore
+from utilities.serialization import BIEXTENSIONS, ELEMENTS, decode_biextensions, decode_points, encode_biextensions, encode_points, point_size
+from utilities.tonelli_shanks import normalise_root, tonelli_shanks, tonelli_shanks_or_none, tonelli_shanks_table
+from utilities.tracing import current_tracer, tracing
 
 
 proof.all(False)
 
 
-def gen_order_r_point(E, r):
-    # E is an elliptic curve
-    # r is an integer
-    # returns: a point of order r on E
-    Q = E.random_element()
-    N = Q.order()
-    while N % r != 0:
-        Q = E.random_element()
-        N = Q.order()    
-    return Q * (N//r)
-
-def gen_torsion_basis(E, r):
-    # E is an elliptic curve
-    # r is an integer
-    # returns: a basis of the r-torsion of E
-    P = gen_order_r_point(E, r)
-    Q = gen_order_r_point(E, r)
-    while P.weil_pairing(Q, r) == 1:
-        Q = gen_order_r_point(E, r)
-    return P,Q
-
 # Q is the n-torsion point
 def compute_tate_pairings(n, P, Q, PQ, k=1, d=None, exp_function=None, zero=None, scale = False):
     # n is the order of the point Q
@@ -114,53 +129,15 @@ def generate_kummer():
     # a prime p of the form p = 2^e * 3^2 * r * f - 1, with e >= 2, r a large prime, f an integer cofactor
     # two points P, Q of order r on E x E' (so that phi(P), phi(Q) are points of order r on K), and a random point R on E x E'
     # returns: Kum_proj, Kum, phi, P, Q, R, p, e, r, f
-
-    # generate prime p
+    # The instance is generated from a seed once and then loaded from the fixtures directory, see utilities.instances
     e = 10 #e >= 2, so that p = 3 mod 4
     r = (2**100).next_prime()
-    f = 1
-    p = 2**e * 3**2 * r * f - 1
-    while not p.is_prime():
-        f = f + 1
-        p = 2**e * 3**2 * r * f - 1
-    
-    F = GF(p**2, name='i', modulus=[1,0,1])
-    E0 = EllipticCurve(F, [1,0])
-    
-    # generate E x E' from E0, for a little randomization
-    P0, Q0, = E0.torsion_basis(2**e)
-    P3, Q3 = E0.torsion_basis(3)
-    phi1 = E0.isogeny(P3)
-    phi2 = E0.isogeny(Q3)
-    E1 = phi1.codomain()
-    E2 = phi2.codomain()
-    P1, Q1 = phi1(P0), phi1(Q0)
-    P2, Q2 = phi2(P0), phi2(Q0)
-
-    # find isotropic kernel subgroup generated by K8_1, K8_2: it will be the kernel of a gluing isogeny ExE' -> K
-    # in principle, we could do in total e steps of the isogeny to get a more random Kummer variety; we only do one for now.
-    isotropic_factor = -discrete_log_pari(P2.weil_pairing(Q2, 2**e), P1.weil_pairing(Q1, 2**e), 2**e)
-    K8_1 = (2**(e-3)) * CouplePoint(isotropic_factor*P1, P2)
-    K8_2 = (2**(e-3)) * CouplePoint(Q1, Q2)
-    phi = GluingThetaIsogeny(K8_1, K8_2)
-        
-    Kum_proj = phi.codomain()
-    Kum = Kum_proj.to_affine().codomain()
-
-
-    # get a basis of the r-torsion of the Kummer variety
-    P1, Q1 = gen_torsion_basis(E1, r)
-    P2, Q2 = gen_torsion_basis(E2, r)
-    
-    P1_rand = E1.random_point()
-    P2_rand = E2.random_point()
+    Kum_proj, Kum, phi, P, Q, R, p, e, r, f = kummer_instance(e, r)
+    E1, E2 = P.curves()
 
-    P = CouplePoint(P1, P2)
-    Q = CouplePoint(Q1, Q2)
     # check P, Q are indeed of order r
     assert(Q * r == CouplePoint(E1.zero(), E2.zero()))
     assert(P * r == CouplePoint(E1.zero(), E2.zero()))
-    R = CouplePoint(P1_rand, P2_rand)
 
     # just check that phi is indeed an isogeny
     assert phi(P * 2) == phi(P) * 2
@@ -170,6 +147,25 @@ def generate_kummer():
     
     return Kum_proj, Kum, phi, P, Q, R, p, e, r, f
 
+def generate_chain(p, e, n=4):
+    # The kernel of a (2^n, 2^n)-isogeny E1 x E0 -> E3 x E4 given by the
+    # endomorphism u + v*i of E0: y^2 = x^3 + x and a 3-isogeny E0 -> E1,
+    # over the field of an instance (2^e and 3 divide p + 1), and a random point
+    # returns: kernel, n, R
+    u, v = next((u, v) for u in range(2**n) for v in range(2**n) if u**2 + v**2 == 2**n - 3)
+    F = kummer_field(p)
+    i = F.gen()
+    E0 = EllipticCurve(F, [1, 0])
+    P0, Q0 = E0.torsion_basis(2**e)
+    alpha = E0.isogeny(E0.torsion_basis(3)[0])
+    iso = alpha.codomain().isomorphism_to(alpha.codomain().montgomery_model())
+    E1 = iso.codomain()
+    def gamma(T):
+        return u * T + v * E0(-T[0], i * T[1])
+    P, Q = 2**(e - n - 2) * P0, 2**(e - n - 2) * Q0
+    kernel = (CouplePoint(iso(alpha(P)), gamma(P)), CouplePoint(iso(alpha(Q)), gamma(Q)))
+    return kernel, n, CouplePoint(E1.random_point(), E0.random_point())
+
 def test_pairings():
     # Compute a product of supersingular curves, go to an isogenous Jacobian and take its Kummer
     Kum_proj, Kum, phi, P, Q, R, p, e, r, f = generate_kummer()
@@ -241,51 +237,12 @@ def generate_kummer_even():
     # a prime p of the form p = 2^e * 3^2 * r * f - 1, with e >= 2, r a large prime, f an integer cofactor
     # two points P_4r, Q_4r of order 4r on E x E' lying above ker(phi) (so that phi(P_4r), phi(Q_4r) are points of order 2r on K), and a random point R on E x E'
     # returns: Kum_proj, Kum, phi, P_4r, Q_4r, R, p, e, r, f
-
-    # generate prime p
+    # The instance is generated from a seed once and then loaded from the fixtures directory, see utilities.instances
     e = 10 # e >= 2, so that p = 3 mod 4
     r = (2**100).next_prime()
-    f = 1
-    p = 2**e * 3**2 * r * f - 1
-    while not p.is_prime():
-        f = f + 1
-        p = 2**e * 3**2 *  r * f - 1
-
-    F = GF(p**2, name='i', modulus=[1,0,1])
-    E0 = EllipticCurve(F, [1,0])
-    
-    # generate E x E' from E0, for a little randomization
-    P0, Q0, = E0.torsion_basis(2**e)
-    P3, Q3 = E0.torsion_basis(3)
-    phi1 = E0.isogeny(P3)
-    phi2 = E0.isogeny(Q3)
-    E1 = phi1.codomain()
-    E2 = phi2.codomain()
-    P1, Q1 = phi1(P0), phi1(Q0)
-    P2, Q2 = phi2(P0), phi2(Q0)
-
-    # find isotropic kernel subgroup generated by K8_1, K8_2: it will be the kernel of a gluing isogeny ExE' -> K
-    # in principle, we could do in total e steps of the isogeny to get a more random Kummer variety; we only do one for now.
-    isotropic_factor = -discrete_log_pari(P2.weil_pairing(Q2, 2**e), P1.weil_pairing(Q1, 2**e), 2**e)
-    K8_1 = (2**(e-3)) * CouplePoint(isotropic_factor*P1, P2)
-    K8_2 = (2**(e-3)) * CouplePoint(Q1, Q2)
-    phi = GluingThetaIsogeny(K8_1, K8_2)
-    
-    Kum_proj = phi.codomain()
-    Kum = Kum_proj.to_affine().codomain()
+    Kum_proj, Kum, phi, P_4r, Q_4r, R, p, e, r, f = kummer_instance(e, r, even=True)
+    E1, E2 = P_4r.curves()
 
-
-    # get a basis of the 2r-torsion of the Kummer variety
-    P1_r, Q1_r = gen_torsion_basis(E1, r)
-    P2_r, Q2_r = gen_torsion_basis(E2, r)
-    
-    P1_rand = E1.random_point()
-    P2_rand = E2.random_point()
-
-    P_4r = CouplePoint(P1_r, P2_r) + K8_1 * 2
-    Q_4r= CouplePoint(Q1_r, Q2_r) + K8_2 * 2
-    R = CouplePoint(P1_rand, P2_rand)
-    
     # check P, Q are indeed of order 4r
     assert(Q_4r * 4* r == CouplePoint(E1.zero(), E2.zero()))
     assert(P_4r * 4 * r == CouplePoint(E1.zero(), E2.zero()))
@@ -384,5 +341,845 @@ def test_pairings_even():
     w1 = (P_4r*2).weil_pairing(Q_4r*2, 2*r)
     assert w2**(-2) == w1 or w2**2 == w1
 
+def test_theta_torsion_basis():
+    Kum_proj, Kum, phi, P, Q, R, p, e, r, f = generate_kummer()
+
+    print("- Test torsion bases in theta coordinates")
+    for D in [r, 2**e]:
+        PK, QK, PQK, w = theta_torsion_basis_with_pairing(Kum, D)
+        assert Kum_proj((PK * D).coords()) == Kum_proj.zero()
+        assert Kum_proj((QK * D).coords()) == Kum_proj.zero()
+        assert Kum.kummer_equation(PQK.coords()) == 0
+
+        # the level 2 pairing is the square of the usual pairing
+        _, w2 = compute_weil_pairings(D, PK, QK, PQK)
+        assert w2 == w
+        assert Biextension(PK, QK, PQK).weil_pairing(D, check=True) == w
+        assert has_order_D(w, D if D % 2 else D // 2, multiplicative=True)
+
+        # P + 3Q with the three way addition, compared to the ladder
+        QQ = QK.double()
+        PQQ = PQK.diff_add(QK, PK)
+        assert PK.three_way_add(QK, QQ, QQ.diff_add(QK, QK), PQQ, PQK) == PQQ.diff_add(QK, PQK)
+
+    # a D not dividing p + 1 is reported in the error, nothing is printed
+    D = next(l for l in Primes() if (p + 1) % l)
+    out = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(out):
+            default_cofactor(Kum, D)
+        assert False
+    except ValueError as e:
+        assert f"D = {D} " in str(e)
+    assert out.getvalue() == ""
+
+def test_mumford_conversion():
+    Kum_proj, Kum, phi, P, Q, R, p, e, r, f = generate_kummer()
+
+    print("- Test conversion between Mumford and theta coordinates")
+    conversion = Kum_proj.mumford_conversion()
+    H = conversion.curve()
+    F = Kum_proj.base_ring()
+    J = H.jacobian()(F)
+    f_H = H.hyperelliptic_polynomials()[0]
+
+    # Points of H with small abscissa
+    points, x = [], F(1)
+    while len(points) < 4:
+        x += 1
+        if f_H(x).is_square():
+            points.append(J(H.lift_x(x)))
+    D1, D2 = points[0] + points[1], points[2] + points[3]
+
+    X1, X2 = conversion.to_theta(D1), conversion.to_theta(D2)
+    assert Kum_proj.kummer_equation(X1.coords()) == 0
+    assert conversion.to_theta(2 * D1) == X1.double()
+    assert conversion.to_theta(5 * D1) == X1 * 5
+    assert X1.normal_add(X2) in [conversion.to_theta(D1 + D2), conversion.to_theta(D1 - D2)]
+
+    # Round trip on divisors of degree 2, 1 and 0, v is only known up to sign
+    divisors = [D1, D2, points[0], J(0), J(H.lift_x(F(0)))]
+    Xs = conversion.to_theta_batch(divisors)
+    for D, uv in zip(divisors, conversion.to_mumford_batch(Xs)):
+        assert J(uv) in [D, -D]
+
+def test_interning():
+    Kum_proj, Kum, phi, P, Q, R, p, e, r, f = generate_kummer()
+
+    print("- Test interning of theta structures")
+    assert Kum_proj.to_affine().codomain() is Kum_proj.to_affine().codomain()
+
+    registry = ThetaStructureRegistry(maxsize=2, fingerprint=True)
+    O = Kum_proj.coords()
+    theta = registry.get(type(Kum_proj), O)
+    assert registry.get(type(Kum_proj), O) is theta
+    assert registry.hits == 1 and registry.misses == 1
+
+    # Scaling the null point gives another structure with the same invariants
+    scaled = registry.get(type(Kum_proj), tuple(3 * c for c in O))
+    assert scaled is not theta
+    assert set(map(id, registry.find_isomorphic(theta))) == {id(theta), id(scaled)}
+
+    # Least recently used structures are evicted
+    registry.get(type(Kum_proj), tuple(5 * c for c in O))
+    assert len(registry) == 2
+    assert registry.get(type(Kum_proj), O) is not theta
+
+    # The fingerprints are stored with the entries, evicting does not
+    # compute them again, and the index follows the evictions
+    calls = []
+    fingerprint = interning.rosenhain_fingerprint
+    interning.rosenhain_fingerprint = lambda theta: calls.append(theta) or fingerprint(theta)
+    try:
+        registry.get(type(Kum_proj), tuple(7 * c for c in O))
+    finally:
+        interning.rosenhain_fingerprint = fingerprint
+    assert len(calls) == 1 and len(registry) == 2
+    assert len(registry.find_isomorphic(theta)) == 2
+
+    # Concurrent requests for the same null point share one structure. The
+    # threads only see plain Python objects, and the garbage collector is
+    # paused so that they never free the pari objects of the other tests:
+    # pari must not be used from several threads
+    class Coordinate(int):
+        def parent(self):
+            return int
+
+    class Slow:
+        def __init__(self, null_point):
+            time.sleep(float(0.01))
+
+    registry = ThetaStructureRegistry(maxsize=8)
+    null_points = [tuple(Coordinate(int(k * c)) for c in (1, 2, 3, 4)) for k in range(6)]
+    requests = [null_points[k % 6] for k in range(60)]
+    gc.collect()
+    gc.disable()
+    try:
+        with ThreadPoolExecutor(8) as pool:
+            got = list(pool.map(lambda O: registry.get(Slow, O), requests))
+    finally:
+        gc.enable()
+    assert len(registry) == 6 and registry.hits + registry.misses == 60
+    for k in range(6):
+        assert len({id(got[j]) for j in range(k, 60, 6)}) == 1
+
+def test_theta_line_pairings():
+    Kum_proj, Kum, phi, P, Q, R, p, e, r, f = generate_kummer()
+
+    print("- Test pairings on theta lines via the biextension ladder")
+    E = EllipticCurve(Kum_proj.base_ring(), [0, 6, 0, 1, 0])
+    theta = ThetaLine.from_montgomery(E)
+    P0, Q0 = E.gens()
+    XP, XQ = theta.montgomery_point(P0), theta.montgomery_point(Q0)
+    assert theta.montgomery_point(2 * P0) == XP.double()
+    assert theta.montgomery_point(P0 + Q0) == XP.diff_add(XQ, theta.montgomery_point(P0 - Q0))
+    assert theta.montgomery_point(12345 * P0) == XP * 12345
+
+    # points are given by their coordinates or a point of a theta line
+    assert theta(XP) == XP and theta(list(XP.coords())) == XP
+    for bad in [P0, XP.coords()[0], None]:
+        try:
+            theta(bad)
+            assert False
+        except TypeError as error:
+            assert "tuple or list" in str(error)
+
+    # The level 2 pairing is the inverse of the square of the usual
+    # pairing for odd n, and its inverse for even n
+    for n, k in [(r, -2), (2**e, -1), (2**e * r, -1)]:
+        cofactor = (p + 1) // n
+        Pn, Qn = cofactor * P0, cofactor * Q0
+        g = montgomery_biextension(Pn, Qn)
+        assert has_order_D(g.P(), n, check_torsion=True)
+        assert g.weil_pairing(n, check=True) == Pn.weil_pairing(Qn, n)**k
+        assert g.tate_pairing(n, k=2) == Pn.tate_pairing(Qn, n, 2)**k
+
+def test_tracing():
+    Kum_proj, Kum, phi, P, Q, R, p, e, r, f = generate_kummer()
+
+    print("- Test tracing of the stages of pairings")
+    def Kpoint(T):
+        return Kum(phi(T).coords())
+
+    g = Biextension(Kpoint(R), Kpoint(Q), Kpoint(R + Q))
+    t = g.tate_pairing(r, k=2)
+    seen = []
+    with tracing(callback=lambda name, elapsed: seen.append(name)) as tracer:
+        assert current_tracer() is tracer
+        assert g.tate_pairing(r, k=2) == t
+    assert current_tracer() is None
+    assert tracer.calls("ladder") == 1 and tracer.calls("ratio") == 1
+    assert tracer.calls("final_exponentiation") == 1
+    assert seen == ["ladder", "ratio", "final_exponentiation"]
+    assert set(tracer.stats()) == set(seen)
+
+    print("- Test tracing of the stages of chains of isogenies")
+    kernel, n, R = generate_chain(p, e)
+    with tracing() as tracer:
+        chain = EllipticProductIsogeny(kernel, n)
+        chain(R)
+        chain.images([R, 2 * R])
+    assert set(tracer.stats()) == {"doubling", "codomain", "push", "split", "image"}
+    assert tracer.calls("doubling") == len(chain.strategy)
+    assert tracer.calls("codomain") == n and tracer.calls("push") == n
+    # the splitting isomorphism and the split theta structure
+    assert tracer.calls("split") == 2
+    assert tracer.calls("image") == 2
+
+    # the last two steps are computed without the 2^(n+2)-torsion
+    kernel = tuple(T.double_iter(2) for T in kernel)
+    with tracing() as tracer:
+        chain = EllipticProductIsogenySqrt(kernel, n)
+    assert set(tracer.stats()) == {"doubling", "codomain", "push", "split"}
+    assert tracer.calls("doubling") == len(chain.strategy)
+    assert tracer.calls("codomain") == n and tracer.calls("push") == n - 2
+    assert tracer.calls("split") == 2
+
+def test_serialization():
+    import pickle
+    Kum_proj, Kum, phi, P, Q, R, p, e, r, f = generate_kummer()
+
+    print("- Test binary serialization of theta points and biextensions")
+    def Kpoint(T):
+        return Kum(phi(T).coords())
+
+    points = [Kpoint(R * i) for i in range(1, 9)]
+    data = encode_points(points)
+    theta, decoded = decode_points(data)
+    assert theta is Kum and decoded == points
+    # no per-point overhead after the header
+    assert len(encode_points(points * 2)) - len(data) == len(points) * point_size(Kum)
+
+    # the structure is pickled once, the points as bytes
+    assert pickle.loads(pickle.dumps(points)) == points
+    assert len(pickle.dumps(points)) < len(pickle.dumps([T.coords() for T in points])) // 2
+
+    # copies share the structure, as unpickling does, but not the points
+    import copy
+    assert copy.copy(Kum) is Kum and copy.deepcopy(Kum) is Kum
+    line = ThetaLine.interned(Kum.null_point().coords()[:2])
+    assert copy.copy(line) is line and copy.deepcopy(line) is line
+    copies = copy.deepcopy(points)
+    assert copies == points and copies[0] is not points[0] and copies[0].parent() is Kum
+
+    g = Biextension(Kpoint(R), Kpoint(Q), Kpoint(R + Q))
+    theta, (h,) = decode_biextensions(encode_biextensions([g]))
+    assert h == g and h.tate_pairing(r, k=2) == g.tate_pairing(r, k=2)
+
+def test_point_store():
+    import os, tempfile
+    Kum_proj, Kum, phi, P, Q, R, p, e, r, f = generate_kummer()
+
+    print("- Test memory mapped point stores")
+    def Kpoint(T):
+        return Kum(phi(T).coords())
+
+    points = [Kpoint(R * i) for i in range(1, 6)]
+    QK = Kpoint(Q)
+    elements = [Biextension(Kpoint(R * i), QK, Kpoint(R * i + Q)) for i in range(1, 4)]
+    with tempfile.TemporaryDirectory() as directory:
+        path = lambda name: os.path.join(directory, name)
+
+        with PointStore.create(path("points"), Kum) as out:
+            out.extend(points)
+        with PointStore(path("points")) as store:
+            assert len(store) == 5 and store.theta() is Kum
+            assert list(store) == points and store[-1] == points[-1]
+            assert [len(b) for b in store.batches(2)] == [2, 2, 1]
+            # isogeny evaluation from a store to a store
+            to_projective = Kum.to_projective().fuse()
+            with PointStore.create(path("images"), to_projective.codomain()) as out:
+                to_projective.images(store, out=out)
+        with PointStore(path("images")) as store:
+            assert [T.coords() for T in store] == [T.coords() for T in points]
+
+        # pairings from a store to a store
+        with PointStore.create(path("biextensions"), Kum, kind=BIEXTENSIONS) as out:
+            out.extend(elements)
+        field = Kum.base_ring()
+        with PointStore(path("biextensions")) as store, PointStore.create(path("pairings"), kind=ELEMENTS, field=field) as out:
+            Biextension.tate_pairings(store, r, k=2, out=out)
+        with PointStore(path("pairings")) as store:
+            assert list(store) == Biextension.tate_pairings(elements, r, k=2)
+
+def test_pairing_executor():
+    Kum_proj, Kum, phi, P, Q, R, p, e, r, f = generate_kummer()
+
+    print("- Test pairings over a process pool")
+    def Kpoint(T):
+        return Kum(phi(T).coords())
+
+    QK = Kpoint(Q)
+    triples = [(Kpoint(P * i), QK, Kpoint(P * i + Q)) for i in range(1, 8)]
+    with PairingExecutor(Kum, processes=2, chunk_size=2, max_pending=2) as executor:
+        # results come back in order, from a stream of input
+        tate = executor.tate_pairings(iter(triples), r, k=2)
+        assert tate == [Biextension(*T).tate_pairing(r, k=2) for T in triples]
+        weil = executor.weil_pairings([Biextension(*T) for T in triples[:3]], r)
+        assert weil == [Biextension(*T).weil_pairing(r) for T in triples[:3]]
+
+def test_async():
+    Kum_proj, Kum, phi, P, Q, R, p, e, r, f = generate_kummer()
+
+    print("- Test asyncio pairings")
+    def Kpoint(T):
+        return Kum(phi(T).coords())
+
+    QK = Kpoint(Q)
+    triples = [(Kpoint(P * i), QK, Kpoint(P * i + Q)) for i in range(1, 6)]
+
+    async def main():
+        async with AsyncWorkerPool(processes=2, max_concurrency=1) as pool:
+            tate = await asyncio.gather(*(apair(*T, r, k=2, pool=pool) for T in triples))
+            assert tate == [Biextension(*T).tate_pairing(r, k=2) for T in triples]
+            weil = await pool.pair(*triples[0], r, weil=True)
+            assert weil == Biextension(*triples[0]).weil_pairing(r)
+
+            # a cancelled request leaves the other ones of its batch alone
+            tasks = [asyncio.ensure_future(pool.pair(*T, r, k=2)) for T in triples[:3]]
+            await asyncio.sleep(0)
+            tasks[1].cancel()
+            done = await asyncio.gather(*tasks, return_exceptions=True)
+            assert isinstance(done[1], asyncio.CancelledError)
+            assert [done[0], done[2]] == [tate[0], tate[2]]
+
+            # errors before the task reaches a worker (here the points cannot
+            # be pickled) are raised in the requests
+            try:
+                await asyncio.wait_for(pool.isogeny((1, 2), 3, points=[lambda: 0]), 5)
+                assert False
+            except asyncio.TimeoutError:
+                assert False
+            except Exception:
+                pass
+            assert await pool.pair(*triples[0], r, k=2) == tate[0]
+
+    asyncio.run(main())
+
+def test_daemon():
+    import multiprocessing, os, tempfile
+    Kum_proj, Kum, phi, P, Q, R, p, e, r, f = generate_kummer()
+
+    print("- Test the pairing server")
+    def Kpoint(T):
+        return Kum(phi(T).coords())
+
+    QK = Kpoint(Q)
+    pairs = [(Kpoint(P * i), Kpoint(P * i + Q)) for i in range(1, 5)]
+    path = os.path.join(tempfile.mkdtemp(), "pairings.sock")
+    server = multiprocessing.get_context("fork").Process(target=serve, args=(path,))
+    server.start()
+    try:
+        with PairingClient(path) as client:
+            h = client.register_pairing(QK, r, k=2)
+            assert client.register_pairing(QK, r, k=2) == h
+            # pipelined requests are served in one batch
+            requests = [client.send_pairings(h, [pair]) for pair in pairs]
+            tate = [client.receive_pairings(h, i)[0] for i in requests]
+            assert tate == [Biextension(P1, QK, PQ).tate_pairing(r, k=2) for P1, PQ in pairs]
+            w = client.register_pairing(QK, r, weil=True)
+            assert client.pair(w, *pairs[0]) == Biextension(pairs[0][0], QK, pairs[0][1]).weil_pairing(r)
+            assert client.pairings(h, []) == []
+            try:
+                client.request(2, (99).to_bytes(4, "big"))
+                assert False
+            except ServerError:
+                pass
+            stats = client.stats()
+            assert stats["requests"]["pair"] == 7 and stats["errors"] == 1
+            assert stats["max_batch_size"] > 1
+
+            # a malformed request does not fail the ones batched with it
+            kernel, n, R = generate_chain(p, e)
+            isogeny = EllipticProductIsogeny(kernel, n)
+            h = client.register_isogeny(kernel, n)
+            points = [R, 2 * R]
+            valid = client.send_images(h, points[:1])
+            truncated = client.send(4, h.to_bytes(4, "big") + bytes(7))
+            valid_bis = client.send_images(h, points[1:])
+            images = client.receive_images(h, valid) + client.receive_images(h, valid_bis)
+            assert images == [isogeny(T) for T in points]
+            try:
+                client.receive(truncated)
+                assert False
+            except ServerError:
+                pass
+
+            # the socket is private, and other files are not replaced
+            assert os.stat(path).st_mode & 0o777 == 0o600
+            other = os.path.join(os.path.dirname(path), "other")
+            open(other, "w").close()
+            for taken in (other, path):
+                try:
+                    PairingServer(taken)._bind()
+                    assert False
+                except FileExistsError:
+                    pass
+            assert os.path.isfile(other)
+            client.shutdown()
+    finally:
+        server.join(10)
+        if server.is_alive():
+            server.terminate()
+    assert not os.path.exists(path)
+
+def test_cli():
+    import json, os, tempfile
+    from utilities.instances import (
+        FIXTURES, decode_couple_point, decode_element, encode_couple_point, encode_element, fixture_name,
+    )
+    Kum_proj, Kum, phi, P, Q, R, p, e, r, f = generate_kummer()
+
+    print("- Test the batch command line")
+    def Kpoint(T):
+        return Kum(phi(T).coords())
+
+    QK = Kpoint(Q)
+    triples = [(Kpoint(P * i), QK, Kpoint(P * i + Q)) for i in range(1, 5)]
+    tate = [Biextension(*T).tate_pairing(r, k=2) for T in triples]
+    directory = tempfile.mkdtemp()
+    path = lambda name: os.path.join(directory, name)
+    with open(path("triples.jsonl"), "w") as fh:
+        for T in triples:
+            fh.write(json.dumps([[encode_element(c) for c in X.coords()] for X in T]) + "\n")
+    with open(path("triples.bin"), "wb") as fh:
+        fh.write(encode_biextensions([Biextension(*T) for T in triples], Kum))
+
+    structure = os.path.join(FIXTURES, fixture_name(e, r))
+    cli.main(["pairings", "--structure", structure, "--input", path("triples.jsonl"),
+              "--output", path("tate.jsonl"), "-n", hex(r), "-k", "2", "--ladder", "fast_ladder"])
+    with open(path("tate.jsonl")) as fh:
+        assert [decode_element(Kum.base_ring(), json.loads(line)) for line in fh] == tate
+
+    cli.main(["pairings", "--input", path("triples.bin"), "--output", path("weil.bin"),
+              "-n", hex(r), "--pairing", "weil", "--output-format", "binary", "--batch-size", "3"])
+    with PointStore(path("weil.bin")) as store:
+        assert list(store) == [Biextension(*T).weil_pairing(r) for T in triples]
+
+    # a pool of workers, with a ladder sent to them, and the throughput line
+    stderr = io.StringIO()
+    with contextlib.redirect_stderr(stderr):
+        cli.main(["pairings", "--structure", structure, "--input", path("triples.jsonl"),
+                  "--output", path("tate2.jsonl"), "-n", hex(r), "-k", "2", "--ladder", "ladder",
+                  "--workers", "2", "--batch-size", "3"])
+    with open(path("tate2.jsonl")) as fh:
+        assert [decode_element(Kum.base_ring(), json.loads(line)) for line in fh] == tate
+    assert stderr.getvalue().startswith("4 pairings in ") and "2 workers, batch size 3" in stderr.getvalue()
+
+    # the even Tate pairing needs an even order
+    with contextlib.redirect_stderr(io.StringIO()):
+        try:
+            cli.main(["pairings", "--structure", structure, "--input", path("triples.jsonl"),
+                      "-n", hex(r), "--pairing", "even-tate"])
+            assert False
+        except SystemExit as exit:
+            assert exit.code == 2
+
+    # images by an isogeny chain, in process and over a pool
+    kernel, n, R = generate_chain(p, e)
+    chain = EllipticProductIsogeny(kernel, n)
+    E1, E2 = kernel[0].curves()
+    description = {
+        "p": hex(p), "n": int(n),
+        "E1": [encode_element(a) for a in E1.a_invariants()],
+        "E2": [encode_element(a) for a in E2.a_invariants()],
+        "K1": encode_couple_point(kernel[0]), "K2": encode_couple_point(kernel[1]),
+    }
+    with open(path("chain.json"), "w") as fh:
+        json.dump(description, fh)
+    points = [R * j for j in range(1, 6)]
+    with open(path("points.jsonl"), "w") as fh:
+        for T in points:
+            fh.write(json.dumps(encode_couple_point(T)) + "\n")
+    F1, F2 = chain.codomain()
+    expected = [chain(T) for T in points]
+    for workers in ["1", "2"]:
+        with contextlib.redirect_stderr(io.StringIO()):
+            cli.main(["images", "--isogeny", path("chain.json"), "--input", path("points.jsonl"),
+                      "--output", path("images.jsonl"), "--workers", workers, "--batch-size", "2"])
+        with open(path("images.jsonl")) as fh:
+            assert [decode_couple_point(F1, F2, json.loads(line)) for line in fh] == expected
+
+    # a description which does not give an isogeny fails at once, also
+    # with workers
+    description["n"] = int(n + 1)
+    with open(path("bad.json"), "w") as fh:
+        json.dump(description, fh)
+    for workers, sqrt in [("1", []), ("2", []), ("2", ["--sqrt"])]:
+        try:
+            cli.main(["images", "--isogeny", path("bad.json"), "--input", path("points.jsonl"),
+                      "--output", path("bad.jsonl"), "--workers", workers] + sqrt)
+            assert False
+        except SystemExit as exit:
+            assert "Cannot build the isogeny" in str(exit.code)
+
+def test_fused_morphism():
+    Kum_proj, Kum, phi, P, Q, R, p, e, r, f = generate_kummer()
+
+    print("- Test fused chains of morphisms")
+    F = Kum.base_ring()
+    i = F.gen()
+    points = [Kum(phi(R * j).coords()) for j in range(1, 4)]
+    N1 = matrix(F, [[0, 1, 0, 0], [1, 0, 0, 0], [0, 0, 0, -1], [0, 0, 1, 0]])
+    N2 = matrix(F, [[1, 2, 0, 0], [0, 1, 0, 0], [0, 0, 1, i], [3, 0, 0, 1]])
+    N3 = matrix(F, [[i, 0, 0, 0], [0, 1, 0, 0], [0, 0, -1, 0], [0, 0, 0, 1]])
+    t1, t2 = Translation(domain=Kum_proj, N=N1), Translation(domain=Kum_proj, N=N2)
+    t3 = Translation(domain=Kum_proj, N=N3)
+    identity = TrivialChangeModel.identity(Kum_proj, image="Id")
+    assert identity.rewraps() and TrivialChangeModel.identity(Kum_proj).rewraps()
+    assert identity.dual().rewraps()
+
+    def unfused(T, morphisms):
+        for g in morphisms:
+            T = g(T)
+        return T
+
+    def compose(morphisms):
+        chain = morphisms[0]
+        for g in morphisms[1:]:
+            chain = ComposedMorphism(chain, g)
+        return chain
+
+    # a chain of linear maps of theta coordinates is folded into one matrix
+    steps = [Kum.to_projective(), t1, t2, identity, t3, Kum_proj.to_affine()]
+    chain = compose(steps)
+    fused = chain.fuse()
+    assert isinstance(fused, FusedMorphism) and chain.fuse() is fused
+    assert len(fused.stages()) == 1
+    # fusing does not compute the duals of the stages
+    assert t3._dual is None
+
+    images = [unfused(T, steps) for T in points]
+    assert [chain(T) for T in points] == chain.images(points) == images
+    assert fused.images(points) == images
+    assert all(fused(T).coords() == U.coords() for T, U in zip(points, images))
+
+    dual = fused.dual()
+    assert dual.domain() is fused.codomain() and dual.codomain() is fused.domain()
+    assert t3._dual is None
+    back = [dual(U) for U in images]
+    assert all(isinstance(T, type(Kum.zero())) for T in back)
+    assert back == [unfused(U, [g.dual() for g in reversed(steps)]) for U in images]
+    assert back == points
+
+    # a change of model with a given map is not a linear map: the chain
+    # is applied morphism by morphism and is not fused
+    negate = TrivialChangeModel.identity(Kum_proj, image=lambda T: tuple(-c for c in T.coords()))
+    assert not negate.rewraps()
+    steps = [Kum.to_projective(), t1, negate, t3]
+    chain = compose(steps)
+    assert chain.fuse() is chain
+    assert chain.images(points) == [unfused(T, steps) for T in points]
+    try:
+        FusedMorphism(chain)
+        assert False
+    except ValueError:
+        pass
+
+    # chains of morphisms of elliptic curves still compose
+    E = EllipticCurve(F, [1, 0])
+    E_scaled = EllipticCurve(F, [16, 0])
+    iso = Isomorphism.isomorphism(E, E_scaled)
+    chain = ComposedMorphism(iso, iso.dual())
+    T = E.random_point()
+    assert chain(T) == T and chain.images([T, 2 * T]) == [T, 2 * T]
+    assert chain.fuse() is chain
+
+def test_gluing_images():
+    Kum_proj, Kum, phi, P, Q, R, p, e, r, f = generate_kummer()
+
+    print("- Test batched images by the gluing isogeny")
+    E1, E2 = R.curves()
+    R1, R2 = R.points()
+    T1, T2 = phi.T_shift.points()
+    points = [
+        R, R * 2, P + Q,
+        CouplePoint(E1(0), R2), CouplePoint(R1, E2(0)), CouplePoint(E1(0), E2(0)),
+        phi.T_shift, CouplePoint(T1, R2), CouplePoint(-T1, R2), CouplePoint(R1, T2),
+    ]
+    # compared with the single point formula, where P + T_shift is
+    # computed on the curves
+    assert phi.images(points) == [phi.image_by_addition(T) for T in points]
+    assert phi(R) == phi.image_by_addition(R)
+    assert phi.images([]) == []
+
+    # a vanishing normalisation is reported for its point, rather than
+    # giving an image with a zero coordinate
+    parts = phi._special_image_parts
+    calls = []
+    def vanishing(*args):
+        calls.append(None)
+        image_parts, num, den = parts(*args)
+        return image_parts, num, 0 * den if len(calls) == 2 else den
+    phi._special_image_parts = vanishing
+    try:
+        phi.images(points)
+        assert False
+    except ZeroDivisionError as error:
+        assert str(points[1]) in str(error)
+    finally:
+        del phi._special_image_parts
+
+def test_batched_inversion():
+    print("- Test zero tolerant batched inversions")
+    p = 2**127 - 1
+    F = GF(p**2, name="i", modulus=[1, 0, 1])
+    i = F.gen()
+    values = [F.random_element() for _ in range(37)]
+    for j in (0, 1, 10, 17, 36):
+        values[j] = F(0)
+    expected = [0 if v == 0 else 1 / v for v in values]
+
+    # odd lengths leave an element to carry up the product tree
+    for k in (1, 2, 3, 7, 37):
+        assert tree_inversion_or_zero(values[:k]) == expected[:k]
+    assert tree_inversion_or_zero([F(0), F(0)]) == [0, 0]
+    assert tree_inversion_or_zero([]) == []
+    assert tree_inversion_or_zero([i]) == [-i]
+
+    # chunks of several sizes, one inversion each, and a pool of workers
+    for chunk_size in (1, 2, 5, 4096):
+        assert batched_inversion_or_zero(values, chunk_size=chunk_size) == expected
+    assert batched_inversion_or_zero(iter(values), chunk_size=4, processes=2) == expected
+    assert list(iter_batched_inversion_or_zero(iter(values), chunk_size=3)) == expected
+    assert batched_inversion_or_zero([]) == []
+    assert batched_inversion_or_zero([], processes=2) == []
+
+    # a pool, or an executor, is reused by the calls and left open
+    with Pool(2) as pool:
+        for _ in range(2):
+            assert batched_inversion_or_zero(values, chunk_size=4, pool=pool) == expected
+        assert pool.apply(abs, (int(-1),)) == 1
+    with ProcessPoolExecutor(2) as executor:
+        assert batched_inversion_or_zero(iter(values), chunk_size=4, processes=3, pool=executor) == expected
+
+def test_fast_sqrt():
+    print("- Test square roots in Fp2 for p = 3 mod 4")
+    p = 2**127 - 1
+    fields = [
+        GF(p**2, name="i", modulus=[1, 0, 1]),
+        # the Conway polynomial as modulus, another basis than (1, i)
+        GF(p**2, name="g"),
+    ]
+    for F in fields:
+        squares = [F.random_element() ** 2 for _ in range(20)]
+        squares += [F(F.prime_subfield().random_element()) for _ in range(5)]
+        for x in squares:
+            r = sqrt_Fp2(x)
+            assert r**2 == x and sqrt_Fp2_or_none(x) == r
+            assert sqrt_Fp2(x, canonical=True) ** 2 == x
+
+        non_squares = [x for x in (F.random_element() for _ in range(40)) if not x.is_square()]
+        assert non_squares
+        for x in non_squares:
+            assert sqrt_Fp2_or_none(x) is None
+            try:
+                sqrt_Fp2(x)
+                assert False
+            except ValueError:
+                pass
+
+        assert sqrt_Fp2(F(0)) == 0 and sqrt_Fp2_or_none(F(0)) == 0
+
+        # the batch gives the same roots, None for the non-squares
+        batch = squares + non_squares + [F(0)]
+        assert batched_sqrt_Fp2(batch) == [sqrt_Fp2_or_none(x) for x in batch]
+        assert batched_sqrt_Fp2(batch, canonical=True) == [sqrt_Fp2_or_none(x, canonical=True) for x in batch]
+        assert batched_sqrt_Fp2([]) == []
+
+    K = GF(p)
+    for x in (K.random_element() for _ in range(20)):
+        r = sqrt_Fp(x)
+        assert r**2 == x if x.is_square() else r == 0
+
+def test_tonelli_shanks():
+    print("- Test Tonelli-Shanks square roots")
+    # p = 1 mod 4 with a small and a large 2-adic valuation of q - 1, and
+    # p = 3 mod 4 over Fp2, where q - 1 = p^2 - 1 is divisible by 8
+    p1 = next(p for p in (2**61 + 8 * k + 5 for k in range(1000)) if is_prime(p))
+    p2 = next(p for p in (2**32 * k + 1 for k in range(3, 1000, 2)) if is_prime(p))
+    fields = [
+        GF(p1), GF(p2),
+        GF(p1**2, name="a", modulus="random"), GF(p2**2, name="a", modulus="random"),
+        GF((2**127 - 1)**2, name="i", modulus=[1, 0, 1]),
+    ]
+    for F in fields:
+        table = tonelli_shanks_table(F)
+        for _ in range(20):
+            x = F.random_element()
+            r = tonelli_shanks_or_none(x, table)
+            if x.is_square():
+                assert r**2 == x and r == normalise_root(r)
+                assert tonelli_shanks(x) == r
+            else:
+                assert r is None
+                try:
+                    tonelli_shanks(x)
+                    assert False
+                except ValueError:
+                    pass
+        x = F.random_element() ** 2
+        assert tonelli_shanks(x) ** 2 == x
+        assert not F.gen().is_square() or tonelli_shanks(F.gen()) ** 2 == F.gen()
+        assert tonelli_shanks(F(0)) == 0
+
+        # the p = 1 mod 4 fields are sent to Tonelli-Shanks by sqrt_Fp2
+        x = F.random_element() ** 2
+        assert sqrt_Fp2_or_none(x) ** 2 == x
+
+    try:
+        tonelli_shanks_table(GF(2**8, name="b"))
+        assert False
+    except ValueError:
+        pass
+
+def dlp_field():
+    # p - 1 = 2^20 * 3^12 * 5 * 7
+    p = 2**20 * 3**12 * 35 + 1
+    F = GF(p)
+    return F, F.multiplicative_generator(), p
+
+def test_prime_power_dlp():
+    print("- Test discrete logarithms in groups of order l^e")
+    F, g, p = dlp_field()
+    # windows dividing e or not, and at least e for the small groups
+    for l, e, windows in [(2, 20, [None, 1, 2, 3, 7]), (3, 12, [None, 1, 2, 5]), (2, 6, [6, 9]), (3, 4, [4, 7])]:
+        base = g ** ((p - 1) // l**e)
+        xs = [0, 1, l**e - 1] + [randrange(l**e) for _ in range(5)]
+        for window in windows:
+            dlp = PrimePowerDLP(base, l, e, window=window)
+            for x in xs:
+                a = base**x
+                assert dlp(a) == discrete_log(a, base, ord=l**e) == x
+
+def test_prepared_dlp():
+    print("- Test discrete logarithms in groups of smooth order")
+    F, g, p = dlp_field()
+    D = 2**20 * 3**12
+    base = g ** ((p - 1) // D)
+    xs = [0, 1, D - 1] + [randrange(D) for _ in range(5)]
+    dlp = PreparedDLP(base, D)
+    for x in xs:
+        a = base**x
+        assert dlp(a) == pohlig_hellman(a, base, D) == x
+        assert pohlig_hellman(a, base, D, window=3) == x
+    a = base**xs[-1]
+    assert pohlig_hellman(a, base, D, processes=2) == xs[-1]
+
+    # a single prime power, and the whole group with the primes 5 and 7
+    assert PreparedDLP(base ** (3**12), 2**20)(base ** (3**12 * 12345)) == 12345
+    x = randrange(p - 1)
+    assert PreparedDLP(g, p - 1, window=4)(g**x) == pohlig_hellman(g**x, g, p - 1) == x
+
+    # g has order p - 1, so it is not a power of base
+    for solve in [dlp, lambda a: pohlig_hellman(a, base, D), lambda a: pohlig_hellman(a, base, D, processes=2)]:
+        try:
+            solve(g)
+            assert False
+        except ValueError:
+            pass
+
+def test_couple_kummer_point():
+    Kum_proj, Kum, phi, P, Q, R, p, e, r, f = generate_kummer()
+
+    print("- Test x-only arithmetic on products of Montgomery curves")
+    # two supersingular Montgomery curves, with (p + 1)-torsion points only
+    F = Kum_proj.base_ring()
+    E1, E2 = EllipticCurve(F, [0, 0, 0, 1, 0]), EllipticCurve(F, [0, 6, 0, 1, 0])
+    R = CouplePoint(E1.random_point(), E2.random_point())
+    S = CouplePoint(E1.random_point(), E2.random_point())
+    x = CoupleKummerPoint.from_couple_point
+    xR, xS = x(R), x(S)
+
+    assert xR.double() == x(R * 2)
+    for n in [1, 2, 5]:
+        assert xR.double_iter(n) == x(R * 2**n)
+    assert xR.diff_add(xS, x(R - S)) == x(R + S)
+
+    for m in [1, 2, 3, 1000, randrange(p + 1)]:
+        mR, mR1 = xR.ladder(m)
+        assert mR == x(R * m) and mR1 == x(R * (m + 1))
+        assert xR * m == xR * (-m) == m * xR == mR
+        # recover the full point [m]R from the x-only ladder
+        assert mR.lift(R, mR1) == R * m
+
+    # multiples of the order are zero on both components, and can not be
+    # lifted to an affine point
+    assert (xR * 0).is_zero()
+    zero, _ = xR.ladder(p + 1)
+    assert zero.is_zero()
+    try:
+        zero.lift(R, xR)
+        assert False
+    except ValueError:
+        pass
+
+def test_compiled_linear_map():
+    print("- Test compiled linear maps")
+    F = GF((2**127 - 1)**2, name="i", modulus=[1, 0, 1])
+    i = F.gen()
+    x = [F.random_element() for _ in range(5)]
+
+    def check(N, kind):
+        f = CompiledLinearMap(N)
+        assert f.kind() == kind and f.matrix() is N
+        coords = tuple(x[: N.ncols()])
+        assert f(coords) == tuple(N * vector(F, coords))
+
+    # signed permutations, e.g. translations by points of 2-torsion
+    check(Matrix(F, [[0, 1, 0, 0], [1, 0, 0, 0], [0, 0, 0, -1], [0, 0, -1, 0]]), "signed_permutation")
+    check(-identity_matrix(F, 4), "signed_permutation")
+
+    # entries in {0, ±1, ±i}, with a zero row and both square roots of -1
+    H = Matrix(F, [[1, 1, 1, 1], [1, -1, 1, -1], [1, 1, -1, -1], [1, -1, -1, 1]])
+    check(H, "unit")
+    check(Matrix(F, [[1, i, 0, -i], [0, 0, 0, 0], [-i, -1, 1, 0], [i, i, -i, -i]]), "unit")
+    check(Matrix(F, [[-i, 0, 0, 0], [0, i, 0, 0], [0, 0, 1, 0], [0, 0, 0, -1]]), "unit")
+    # one ±1 per row but not a permutation: a repeated column, or a selection
+    check(Matrix(F, [[0, 1, 0, 0], [0, -1, 0, 0], [0, 0, 1, 0], [1, 0, 0, 0]]), "unit")
+    check(Matrix(F, [[0, 0, -1, 0], [1, 0, 0, 0]]), "unit")
+
+    # any other entry, for square and rectangular matrices
+    check(random_matrix(F, 4, 4), "general")
+    check(Matrix(F, [[1, 0, 0, 0], [0, 2, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]]), "general")
+    check(random_matrix(F, 3, 5), "general")
+
+def test_product_images():
+    Kum_proj, Kum, phi, P, Q, R, p, e, r, f = generate_kummer()
+
+    print("- Test batched images by chains of isogenies")
+    kernel, n, R = generate_chain(p, e)
+    chain = EllipticProductIsogeny(kernel, n)
+    E1, E2 = R.curves()
+    R1, R2 = R.points()
+    # the images of points with a component at infinity are lifted with
+    # the others
+    points = [R, R * 3, CouplePoint(E1(0), R2), CouplePoint(R1, E2(0)), CouplePoint(E1(0), E2(0))]
+    assert chain.images(points) == [chain(T) for T in points]
+    assert chain.images(points, lift=False) == [chain(T, lift=False) for T in points]
+    F1, F2 = chain.codomain()
+    assert chain.images([CouplePoint(E1(0), E2(0))]) == [CouplePoint(F1(0), F2(0))]
+
 test_pairings()
-test_pairings_even()
\ No newline at end of file
+test_pairings_even()
+test_theta_torsion_basis()
+test_mumford_conversion()
+test_interning()
+test_theta_line_pairings()
+test_tracing()
+test_serialization()
+test_point_store()
+test_pairing_executor()
+test_async()
+test_daemon()
+test_cli()
+test_fused_morphism()
+test_gluing_images()
+test_batched_inversion()
+test_fast_sqrt()
+test_tonelli_shanks()
+test_prime_power_dlp()
+test_prepared_dlp()
+test_couple_kummer_point()
+test_compiled_linear_map()
+test_product_images()
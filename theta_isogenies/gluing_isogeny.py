@@ -1,9 +1,13 @@
-from sage.all import Matrix
+from sage.misc.lazy_import import lazy_import
+
+lazy_import("sage.all", "Matrix")
 
 from theta_structures.couple_point import CouplePoint
+from theta_structures.couple_kummer_point import CoupleKummerPoint
 from theta_structures.dimension_two import ThetaStructure, ThetaPoint
 from theta_isogenies.isogeny import ThetaIsogeny
 from utilities.batched_inversion import batched_inversion
+from utilities.linear_map import CompiledLinearMap
 
 
 class GluingThetaIsogeny(ThetaIsogeny):
@@ -24,17 +28,27 @@ class GluingThetaIsogeny(ThetaIsogeny):
         K1_4 = K1_8.double()
 
         # If M is not included, compute the matrix on the fly from the four
-        # torsion.
+        # torsion. Only the x-coordinates of K2_4 are needed so on Montgomery
+        # curves we double x-only
         if M is None:
-            K2_4 = K2_8.double()
+            if self._is_montgomery(K2_8):
+                K2_4 = CoupleKummerPoint.from_couple_point(K2_8).double()
+            else:
+                K2_4 = K2_8.double()
             M = self.get_base_change_matrix(K1_4, K2_4)
 
         # Initalise self
         self._base_change_matrix = M
+        self._base_change = CompiledLinearMap(M)
         self.T_shift = K1_4
         self._precomputation = None
         self._zero_idx = 0
 
+        # Data to compute x(P + T) for T = T_shift with x-only formulas
+        self._translation_data = [
+            self._get_translation_data(T) for T in self.T_shift.points()
+        ]
+
         # Map points from elliptic product onto the product theta structure
         # using the base change matrix
         T1_8 = self.base_change(K1_8)
@@ -43,52 +57,79 @@ class GluingThetaIsogeny(ThetaIsogeny):
         # Compute the codomain of the gluing isogeny
         self._codomain = self._special_compute_codomain(T1_8, T2_8)
 
+    @staticmethod
+    def _is_montgomery(P):
+        """
+        Whether both curves of the CouplePoint P are in the Montgomery model
+        """
+        return all(E.a_invariants() == (0, E.a2(), 0, 1, 0) for E in P.curves())
+
+    @staticmethod
+    def _x_and_double(T):
+        """
+        Return [(X, Z, X2, Z2)] for both components of T where (X : Z) are
+        the coordinates of Ti and (X2 : Z2) those of [2]Ti. On Montgomery
+        curves the doubling is x-only, otherwise we use Sage addition
+        """
+        if isinstance(T, CoupleKummerPoint):
+            TT = T.double()
+            return [XZ + XZ2 for XZ, XZ2 in zip(T.xz(), TT.xz())]
+
+        if GluingThetaIsogeny._is_montgomery(T):
+            return GluingThetaIsogeny._x_and_double(
+                CoupleKummerPoint.from_couple_point(T)
+            )
+
+        xz = []
+        for P in T.points():
+            PP = P + P
+            xz.append((P[0], P[2], PP[0], PP[2]))
+        return xz
+
     @staticmethod
     def get_base_change_matrix(T1, T2):
         """
         Given the four torsion above the kernel generating the gluing isogeny,
         compute the matrix M which allows us to map points on an elliptic
         product to the compatible theta structure.
+
+        T1, T2 can be CouplePoints or CoupleKummerPoints, only their
+        x-coordinates are used.
         """
 
-        def get_matrix(T):
+        def get_matrix(X, Z, X2, Z2, inv_den):
             """
             Compute the matrix [a, b]
                                [c, d]
             From the (X : Z) coordinates of a point
-            T and its double TT = (T + T)
+            T and its double TT = (X2 : Z2)
+
+            With x = X/Z, u = X2/Z2 and det = x - u this is
 
-            NOTE: Assumes that Z = 1 or 0
+                a = -u / det, b = -1 / det, c = x (u - det) / det, d = -a
+
+            which we write with the single denominator
+            den = Z * (X * Z2 - X2 * Z)
             """
-            TT = T + T
-            x = T[0]
-            u = TT[0]
-
-            # Our Z-coordinates are always 1 or 0
-            # as Sage uses affine addition
-            assert T[2] == 1
-            assert TT[2] == 1
-
-            # Compute the matrix coefficents
-            det = x - u
-            inv_det = 1 / det
-            a = -u * inv_det
-            b = -inv_det
-            c = x * (u - det) * inv_det
+            ZZ_inv_den = Z * Z * inv_den
+            a = -X2 * ZZ_inv_den
+            b = -Z2 * ZZ_inv_den
+            c = X * (2 * X2 * Z - X * Z2) * inv_den
             d = -a
             return Matrix(2, 2, [a, b, c, d])
 
-        # Extract elliptic curve points from CouplePoints
-        P1, P2 = T1.points()
-        Q1, Q2 = T2.points()
+        # Extract the x-coordinates of the points and their doubles
+        xz = GluingThetaIsogeny._x_and_double(T1)
+        xz += GluingThetaIsogeny._x_and_double(T2)
+
+        # The four inversions are batched into one
+        dens = [Z * (X * Z2 - X2 * Z) for X, Z, X2, Z2 in xz]
+        inv_dens = batched_inversion(*dens)
 
         # Compute matrices from points
-        # TODO: totally overkill, but if these were all computed together
-        #       you could batch all 4 inversions into one.
-        g1 = get_matrix(P1)
-        g2 = get_matrix(P2)
-        h1 = get_matrix(Q1)
-        h2 = get_matrix(Q2)
+        g1, g2, h1, h2 = [
+            get_matrix(*data, inv_den) for data, inv_den in zip(xz, inv_dens)
+        ]
 
         # the matrices gi, hi does not commute, but g1 \tens g2 should commute with h1 \tens h2
         gh1 = g1 * h1
@@ -151,19 +192,57 @@ class GluingThetaIsogeny(ThetaIsogeny):
             [[a, b, c, d], [a1, b1, c1, d1], [a2, b2, c2, d2], [a3, b3, c3, d3]]
         )
 
+    @staticmethod
+    def _get_translation_data(T):
+        """
+        Precompute what we need to compute x(P + T) for a fixed point T of
+        order four: the affine coordinates of T, the a-invariants used in the
+        chord formula and (X : Z) of [2]T
+        """
+        a1, a2, a3, _, _ = T.curve().a_invariants()
+        xT, yT = T[0], T[1]
+        TT = T + T
+        return xT, yT, a1, a2 + xT, a3, (TT[0], TT[2])
+
+    @staticmethod
+    def _translate_xz(P, data):
+        """
+        Compute (X : Z) of P + T projectively using the chord through P and T.
+        With N = yT - yP and D = xT - xP, we have
+
+            X = N^2 + a1 N D - (a2 + xP + xT) D^2,   Z = D^2
+
+        which avoids the inversion of the affine addition in Sage
+        """
+        xT, yT, a1, a2_xT, a3, xz_2T = data
+
+        # P is the identity, P + T = T
+        if P[2] == 0:
+            return xT, 1
+
+        xP, yP = P[0], P[1]
+        D = xT - xP
+        N = yT - yP
+
+        if D == 0:
+            # P = T so P + T = [2]T
+            if N == 0:
+                return xz_2T
+            # P = -T so P + T is the identity
+            return 1, 0
+
+        DD = D * D
+        X = N * N - (a2_xT + xP) * DD
+        if a1:
+            X += a1 * N * D
+        return X, DD
+
     def apply_base_change(self, coords):
         """
         Apply the basis change by acting with matrix multiplication, treating
         the coordinates as a vector
         """
-        N = self._base_change_matrix
-        x, y, z, t = coords
-        X = N[0, 0] * x + N[0, 1] * y + N[0, 2] * z + N[0, 3] * t
-        Y = N[1, 0] * x + N[1, 1] * y + N[1, 2] * z + N[1, 3] * t
-        Z = N[2, 0] * x + N[2, 1] * y + N[2, 2] * z + N[2, 3] * t
-        T = N[3, 0] * x + N[3, 1] * y + N[3, 2] * z + N[3, 3] * t
-
-        return (X, Y, Z, T)
+        return self._base_change(coords)
 
     def base_change(self, P):
         """
@@ -175,9 +254,13 @@ class GluingThetaIsogeny(ThetaIsogeny):
 
         # extract X,Z coordinates on pairs of points
         P1, P2 = P.points()
-        X1, Z1 = P1[0], P1[2]
-        X2, Z2 = P2[0], P2[2]
+        return self.base_change_xz(P1[0], P1[2], P2[0], P2[2])
 
+    def base_change_xz(self, X1, Z1, X2, Z2):
+        """
+        Compute the basis change on the (X : Z) coordinates of a pair of
+        points to recover the coordinates of a compatible ThetaPoint
+        """
         # Correct in the case of (0 : 0)
         if X1 == 0 and Z1 == 0:
             X1 = 1
@@ -235,15 +318,13 @@ class GluingThetaIsogeny(ThetaIsogeny):
         # Final Hadamard of the above coordinates
         a, b, c, d = ThetaPoint.to_hadamard(*ABCD)
 
-        return ThetaStructure([a, b, c, d])
+        return ThetaStructure.interned([a, b, c, d])
 
-    def special_image(self, P, translate):
+    def _special_image_parts(self, P, translate):
         """
-        When the domain is a non product theta structure on a product of
-        elliptic curves, we will have one of A,B,C,D=0, so the image is more
-        difficult. We need to give the coordinates of P but also of
-        P+Ti, Ti one of the point of 4-torsion used in the isogeny
-        normalisation
+        Compute everything in the image of P except the normalisation
+        lam = num / den of the translated point. Returns (xb, y, z, t), num
+        and den, so that the divisions can be shared over many points
         """
         AxByCzDt = ThetaPoint.to_squared_theta(*P)
 
@@ -261,14 +342,24 @@ class GluingThetaIsogeny(ThetaIsogeny):
         # We can compute x from the translation
         # First we need a normalisation
         if z != 0:
-            zb = AyBxCtDz[3 ^ self._zero_idx]
-            lam = z / zb
+            num = z
+            den = AyBxCtDz[3 ^ self._zero_idx]
         else:
-            tb = AyBxCtDz[2 ^ self._zero_idx] * self._precomputation[2 ^ self._zero_idx]
-            lam = t / tb
+            num = t
+            den = AyBxCtDz[2 ^ self._zero_idx] * self._precomputation[2 ^ self._zero_idx]
 
-        # Finally we recover x
         xb = AyBxCtDz[1 ^ self._zero_idx] * self._precomputation[1 ^ self._zero_idx]
+        return (xb, y, z, t), num, den
+
+    def _special_image_finish(self, parts, num, inv_den):
+        """
+        Given the output of _special_image_parts and the inverse of den,
+        recover x and return the image on the codomain
+        """
+        xb, y, z, t = parts
+        lam = num * inv_den
+
+        # Finally we recover x
         x = xb * lam
 
         xyzt = [0 for _ in range(4)]
@@ -280,16 +371,69 @@ class GluingThetaIsogeny(ThetaIsogeny):
         image = ThetaPoint.to_hadamard(*xyzt)
         return self._codomain(image)
 
-    def __call__(self, P):
+    def special_image(self, P, translate):
         """
-        Take into input the theta null point of A/K_2, and return the image
-        of the point by the isogeny
+        When the domain is a non product theta structure on a product of
+        elliptic curves, we will have one of A,B,C,D=0, so the image is more
+        difficult. We need to give the coordinates of P but also of
+        P+Ti, Ti one of the point of 4-torsion used in the isogeny
+        normalisation
         """
-        if not isinstance(P, CouplePoint):
-            raise TypeError(
-                "Isogeny image for the gluing isogeny is defined to act on CouplePoints"
-            )
+        parts, num, den = self._special_image_parts(P, translate)
+        return self._special_image_finish(parts, num, 1 / den)
+
+    def images(self, points):
+        """
+        Compute the images of many CouplePoints. The translated points
+        P + T_shift are computed with x-only formulas and the normalisations
+        of all the images share a single inversion.
 
+        The normalisation only vanishes when both z and t do, for every
+        representative of P, in which case a ZeroDivisionError is raised as
+        for a single image
+        """
+        data1, data2 = self._translation_data
+
+        points = list(points)
+        all_parts, nums, dens = [], [], []
+        for P in points:
+            if not isinstance(P, CouplePoint):
+                raise TypeError(
+                    "Isogeny image for the gluing isogeny is defined to act on CouplePoints"
+                )
+            P1, P2 = P.points()
+
+            # (X : Z) of P + T on each factor, without inversions
+            X1, Z1 = self._translate_xz(P1, data1)
+            X2, Z2 = self._translate_xz(P2, data2)
+
+            # Push both the point and the translation through the
+            # completion
+            iso_P = self.base_change_xz(P1[0], P1[2], P2[0], P2[2])
+            iso_P_sum_T = self.base_change_xz(X1, Z1, X2, Z2)
+
+            parts, num, den = self._special_image_parts(iso_P, iso_P_sum_T)
+            all_parts.append(parts)
+            nums.append(num)
+            dens.append(den)
+
+        # the zeros are found before inverting, so that the error names the
+        # point instead of coming from the inversion of the whole batch
+        for P, den in zip(points, dens):
+            if den == 0:
+                raise ZeroDivisionError(f"The normalisation of the image of {P} vanishes")
+        inv_dens = batched_inversion(*dens) if dens else []
+        return [
+            self._special_image_finish(parts, num, inv_den)
+            for parts, num, inv_den in zip(all_parts, nums, inv_dens)
+        ]
+
+    def image_by_addition(self, P):
+        """
+        The image of a single CouplePoint, with P + T_shift computed on the
+        elliptic curves rather than with x-only formulas, as a reference for
+        images
+        """
         # Compute sum of points on elliptic curve
         P_sum_T = P + self.T_shift
 
@@ -299,3 +443,14 @@ class GluingThetaIsogeny(ThetaIsogeny):
         iso_P_sum_T = self.base_change(P_sum_T)
 
         return self.special_image(iso_P, iso_P_sum_T)
+
+    def __call__(self, P):
+        """
+        Take into input the theta null point of A/K_2, and return the image
+        of the point by the isogeny
+        """
+        if not isinstance(P, CouplePoint):
+            raise TypeError(
+                "Isogeny image for the gluing isogeny is defined to act on CouplePoints"
+            )
+        return self.images([P])[0]
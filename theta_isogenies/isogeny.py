@@ -1,4 +1,6 @@
-from sage.all import ZZ
+from sage.misc.lazy_import import lazy_import
+
+lazy_import("sage.all", "ZZ")
 
 from theta_structures.dimension_two import ThetaStructure, ThetaPoint
 from theta_isogenies.morphism import Morphism
@@ -133,9 +135,9 @@ class ThetaIsogeny(Morphism):
         self._precomputation = (B_inv, C_inv, D_inv)
         if self._hadamard[1]:
             a, b, c, d = ThetaPoint.to_hadamard(A, B, C, D)
-            return ThetaStructure([a, b, c, d])
+            return ThetaStructure.interned([a, b, c, d])
         else:
-            return ThetaStructure([A, B, C, D])
+            return ThetaStructure.interned([A, B, C, D])
 
     def __call__(self, P):
         """
@@ -162,3 +164,15 @@ class ThetaIsogeny(Morphism):
         if self._hadamard[1]:
             image_coords = ThetaPoint.to_hadamard(*image_coords)
         return self._codomain(image_coords)
+
+    def images(self, points, out=None):
+        """
+        Evaluate the isogeny on an iterable of points (e.g. a PointStore),
+        appending the images to out (e.g. a PointStoreWriter), a new list by
+        default, which is returned
+        """
+        if out is None:
+            out = []
+        for P in points:
+            out.append(self(P))
+        return out
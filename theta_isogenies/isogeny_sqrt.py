@@ -1,4 +1,6 @@
-from sage.all import ZZ
+from sage.misc.lazy_import import lazy_import
+
+lazy_import("sage.all", "ZZ")
 
 from theta_structures.dimension_two import ThetaStructure, ThetaPoint
 from theta_isogenies.isogeny import ThetaIsogeny
@@ -50,9 +52,9 @@ class ThetaIsogeny4(ThetaIsogeny):
 
         if self._hadamard[1]:
             a, b, c, d = ThetaPoint.to_hadamard(A, B, C, D)
-            return ThetaStructure([a, b, c, d])
+            return ThetaStructure.interned([a, b, c, d])
         else:
-            return ThetaStructure([A, B, C, D])
+            return ThetaStructure.interned([A, B, C, D])
 
 
 class ThetaIsogeny2(ThetaIsogeny4):
@@ -90,6 +92,6 @@ class ThetaIsogeny2(ThetaIsogeny4):
 
         if self._hadamard[1]:
             a, b, c, d = ThetaPoint.to_hadamard(A, B, C, D)
-            return ThetaStructure([a, b, c, d])
+            return ThetaStructure.interned([a, b, c, d])
         else:
-            return ThetaStructure([A, B, C, D])
+            return ThetaStructure.interned([A, B, C, D])
@@ -1,8 +1,11 @@
-from sage.all import Matrix
+from sage.misc.lazy_import import lazy_import
+
+lazy_import("sage.all", "Matrix")
 from theta_structures.dimension_two import ThetaStructure
 from theta_structures.dimension_two import ThetaPoint
 from theta_structures.couple_point import CouplePoint
 from theta_isogenies.morphism import Morphism
+from utilities.linear_map import CompiledLinearMap
 
 
 class Isomorphism(Morphism):
@@ -14,6 +17,20 @@ class Isomorphism(Morphism):
     def __init__(self, N=None):
         self.N = N
 
+    @property
+    def N(self):
+        """
+        The change of basis matrix of the isomorphism
+        """
+        return self._N
+
+    @N.setter
+    def N(self, N):
+        # Compile the matrix once so that signed permutations and 0/±1/±i
+        # matrices are applied without multiplications
+        self._N = N
+        self._linear_map = None if N is None else CompiledLinearMap(N)
+
     def dual(self):
         """ """
         if self.N is None:
@@ -24,7 +41,7 @@ class Isomorphism(Morphism):
                 "Dual can only be computed once domain and codomain are known"
             )
 
-        return DualIsomorphism(self.domain(), self.codomain(), N)
+        return DualIsomorphism(self.domain(), self.codomain(), self.N)
 
     def apply_isomorphism(self, P):
         """
@@ -41,13 +58,7 @@ class Isomorphism(Morphism):
                 "Cannot compute an isomorphism with the corresponding matrix set."
             )
 
-        x, y, z, t = P.coords()
-        X = self.N[0, 0] * x + self.N[0, 1] * y + self.N[0, 2] * z + self.N[0, 3] * t
-        Y = self.N[1, 0] * x + self.N[1, 1] * y + self.N[1, 2] * z + self.N[1, 3] * t
-        Z = self.N[2, 0] * x + self.N[2, 1] * y + self.N[2, 2] * z + self.N[2, 3] * t
-        T = self.N[3, 0] * x + self.N[3, 1] * y + self.N[3, 2] * z + self.N[3, 3] * t
-
-        return (X, Y, Z, T)
+        return self._linear_map(P.coords())
 
     def __call__(self, Q):
         if not isinstance(Q, (ThetaPoint, CouplePoint)):
@@ -100,7 +111,7 @@ class SplittingIsomorphism(Isomorphism):
         mapped_null_coords = self.apply_isomorphism(domain.null_point())
 
         # Set the codomain from the new null values
-        self._codomain = ThetaStructure(mapped_null_coords)
+        self._codomain = ThetaStructure.interned(mapped_null_coords)
 
     def level_22_constants_sqr(self, null_coords, chi, i):
         """
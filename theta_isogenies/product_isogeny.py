@@ -5,6 +5,7 @@ from theta_isogenies.gluing_isogeny import GluingThetaIsogeny
 from theta_isogenies.isomorphism import SplittingIsomorphism
 from theta_isogenies.isogeny import ThetaIsogeny
 from utilities.strategy import optimised_strategy
+from utilities.tracing import stage
 
 
 class EllipticProductIsogeny(Morphism):
@@ -43,7 +44,8 @@ class EllipticProductIsogeny(Morphism):
 
         self._phis = self.isogeny_chain(kernel)
         T_last = self._phis[-1].codomain()
-        self._splitting = SplitThetaStructure(T_last)
+        with stage("split"):
+            self._splitting = SplitThetaStructure(T_last)
 
         self._codomain = self._splitting.curves()
 
@@ -75,8 +77,9 @@ class EllipticProductIsogeny(Morphism):
                 level.append(self.strategy[strat_idx])
 
                 # Perform the doublings
-                Tp1 = ker[0].double_iter(self.strategy[strat_idx])
-                Tp2 = ker[1].double_iter(self.strategy[strat_idx])
+                with stage("doubling"):
+                    Tp1 = ker[0].double_iter(self.strategy[strat_idx])
+                    Tp2 = ker[1].double_iter(self.strategy[strat_idx])
 
                 ker = (Tp1, Tp2)
 
@@ -87,24 +90,25 @@ class EllipticProductIsogeny(Morphism):
 
             # Compute the codomain from the 8-torsion
             Tp1, Tp2 = ker
-            if k == 0:
-                phi = GluingThetaIsogeny(Tp1, Tp2)
-            elif k == self.n - 2:
-                # The next isogeny will be a splitting isogeny, so we know we
-                # will have one of a,b,c,d = 0. So at this point switch to
-                # dual theta coordinate
-                phi = ThetaIsogeny(Th, Tp1, Tp2, hadamard=(False, False))
-            elif k == self.n - 1:
-                # Compute the dual isogeny, remembering that we switched to
-                # dual theta coordinates at the previous step.
-                # We output dual theta coordinates on the product, change
-                # to hadamard=(True, True) to output standard coordinates;
-                # this does not change the conversion back to Montgomery
-                # coordinates so we might as well save an Hadamard
-                # transform anyway
-                phi = ThetaIsogeny(Th, Tp1, Tp2, hadamard=(True, False))
-            else:
-                phi = ThetaIsogeny(Th, Tp1, Tp2)
+            with stage("codomain"):
+                if k == 0:
+                    phi = GluingThetaIsogeny(Tp1, Tp2)
+                elif k == self.n - 2:
+                    # The next isogeny will be a splitting isogeny, so we know we
+                    # will have one of a,b,c,d = 0. So at this point switch to
+                    # dual theta coordinate
+                    phi = ThetaIsogeny(Th, Tp1, Tp2, hadamard=(False, False))
+                elif k == self.n - 1:
+                    # Compute the dual isogeny, remembering that we switched to
+                    # dual theta coordinates at the previous step.
+                    # We output dual theta coordinates on the product, change
+                    # to hadamard=(True, True) to output standard coordinates;
+                    # this does not change the conversion back to Montgomery
+                    # coordinates so we might as well save an Hadamard
+                    # transform anyway
+                    phi = ThetaIsogeny(Th, Tp1, Tp2, hadamard=(True, False))
+                else:
+                    phi = ThetaIsogeny(Th, Tp1, Tp2)
 
             # Update the chain of isogenies
             Th = phi.codomain()
@@ -115,13 +119,26 @@ class EllipticProductIsogeny(Morphism):
             level.pop()
 
             # Push through points for the next step
-            kernel_elements = [(phi(T1), phi(T2)) for T1, T2 in kernel_elements]
+            with stage("push"):
+                kernel_elements = self.push_kernel_elements(phi, kernel_elements)
 
-        splitting_iso = SplittingIsomorphism(Th, zeta=self._zeta)
+        with stage("split"):
+            splitting_iso = SplittingIsomorphism(Th, zeta=self._zeta)
         isogeny_chain.append(splitting_iso)
 
         return isogeny_chain
 
+    @staticmethod
+    def push_kernel_elements(phi, kernel_elements):
+        """
+        Compute the images of the pairs of kernel elements by phi, the
+        gluing isogeny evaluates all of them in one batch
+        """
+        if isinstance(phi, GluingThetaIsogeny):
+            images = phi.images([T for pair in kernel_elements for T in pair])
+            return list(zip(images[::2], images[1::2]))
+        return [(phi(T1), phi(T2)) for T1, T2 in kernel_elements]
+
     def evaluate_isogeny(self, P):
         """
         Given a point P, of type CouplePoint on the domain E1 x E2, computes the
@@ -141,5 +158,26 @@ class EllipticProductIsogeny(Morphism):
         then the affine coordinates of the points are returned, otherwise points
         on the Kummer line are returned.
         """
-        image_P = self.evaluate_isogeny(P)
-        return self._splitting(image_P, lift=lift)
+        with stage("image"):
+            image_P = self.evaluate_isogeny(P)
+            return self._splitting(image_P, lift=lift)
+
+    def images(self, points, lift=True):
+        """
+        Evaluate many CouplePoints under the action of this isogeny, the
+        gluing step, which is the most expensive one, and the lift to the
+        curves are done in one batch
+        """
+        points = list(points)
+        for P in points:
+            if not isinstance(P, CouplePoint):
+                raise TypeError(
+                    "EllipticProductIsogeny isogeny expects as input a CouplePoint on the domain product E1 x E2"
+                )
+
+        with stage("image"):
+            gluing, phis = self._phis[0], self._phis[1:]
+            images = gluing.images(points)
+            for f in phis:
+                images = [f(P) for P in images]
+            return self._splitting.images(images, lift=lift)
@@ -4,6 +4,7 @@ from theta_isogenies.isogeny import ThetaIsogeny
 from theta_isogenies.product_isogeny import EllipticProductIsogeny
 from theta_isogenies.isogeny_sqrt import ThetaIsogeny4, ThetaIsogeny2
 from utilities.strategy import optimised_strategy
+from utilities.tracing import stage
 
 
 class EllipticProductIsogenySqrt(EllipticProductIsogeny):
@@ -44,8 +45,9 @@ class EllipticProductIsogenySqrt(EllipticProductIsogeny):
                 level.append(self.strategy[strat_idx])
 
                 # Perform the doublings
-                Tp1 = ker[0].double_iter(self.strategy[strat_idx])
-                Tp2 = ker[1].double_iter(self.strategy[strat_idx])
+                with stage("doubling"):
+                    Tp1 = ker[0].double_iter(self.strategy[strat_idx])
+                    Tp2 = ker[1].double_iter(self.strategy[strat_idx])
 
                 ker = (Tp1, Tp2)
 
@@ -56,10 +58,11 @@ class EllipticProductIsogenySqrt(EllipticProductIsogeny):
 
             # Compute the codomain from the 8-torsion
             Tp1, Tp2 = ker
-            if k == 0:
-                phi = GluingThetaIsogeny(Tp1, Tp2)
-            else:
-                phi = ThetaIsogeny(Th, Tp1, Tp2)
+            with stage("codomain"):
+                if k == 0:
+                    phi = GluingThetaIsogeny(Tp1, Tp2)
+                else:
+                    phi = ThetaIsogeny(Th, Tp1, Tp2)
             Th = phi.codomain()
 
             # Update the chain of isogenies
@@ -71,18 +74,22 @@ class EllipticProductIsogenySqrt(EllipticProductIsogeny):
             level.pop()
 
             # Push through points for the next step
-            kernel_elements = [(phi(T1), phi(T2)) for T1, T2 in kernel_elements]
+            with stage("push"):
+                kernel_elements = self.push_kernel_elements(phi, kernel_elements)
 
         # last 2 isogenies
         Tp1, Tp2 = kernel_elements[0]
-        phi = ThetaIsogeny4(Th, Tp1, Tp2, hadamard=(False, False))
+        with stage("codomain"):
+            phi = ThetaIsogeny4(Th, Tp1, Tp2, hadamard=(False, False))
         isogeny_chain.append(phi)
         Th = phi.codomain()
-        phi = ThetaIsogeny2(Th, hadamard=(True, False))
+        with stage("codomain"):
+            phi = ThetaIsogeny2(Th, hadamard=(True, False))
         isogeny_chain.append(phi)
         Th = phi.codomain()
 
-        splitting_iso = SplittingIsomorphism(Th)
+        with stage("split"):
+            splitting_iso = SplittingIsomorphism(Th)
         isogeny_chain.append(splitting_iso)
 
         return isogeny_chain
@@ -0,0 +1,247 @@
+from sage.misc.lazy_import import lazy_import
+
+lazy_import("sage.all", "ZZ")
+
+from theta_structures.couple_point import CouplePoint
+from utilities.batched_inversion import batched_inversion
+from utilities.supersingular import montgomery_coefficient
+
+# ============================================ #
+#     x-only arithmetic on Montgomery curves   #
+# ============================================ #
+
+
+def xDBL(X, Z, A24):
+    """
+    Given (X : Z) of P on y^2 = x^3 + Ax^2 + x, compute (X : Z) of [2]P
+    with A24 = (A + 2) / 4
+
+    Cost: 2M + 2S + 1c
+    """
+    t0 = X + Z
+    t0 = t0 * t0
+    t1 = X - Z
+    t1 = t1 * t1
+    t2 = t0 - t1
+    return t0 * t1, t2 * (t1 + A24 * t2)
+
+
+def xDBL_iter(X, Z, A24, n):
+    """
+    Compute (X : Z) of [2^n]P from (X : Z) of P
+    """
+    for _ in range(n):
+        t0 = X + Z
+        t0 = t0 * t0
+        t1 = X - Z
+        t1 = t1 * t1
+        t2 = t0 - t1
+        X = t0 * t1
+        Z = t2 * (t1 + A24 * t2)
+    return X, Z
+
+
+def xADD(XP, ZP, XQ, ZQ, XPQ, ZPQ):
+    """
+    Differential addition: given (X : Z) of P, Q and P - Q, compute
+    (X : Z) of P + Q
+
+    Cost: 4M + 2S
+    """
+    t0 = (XP + ZP) * (XQ - ZQ)
+    t1 = (XP - ZP) * (XQ + ZQ)
+    s = t0 + t1
+    d = t0 - t1
+    return ZPQ * s * s, XPQ * d * d
+
+
+def xDBLADD(XP, ZP, XQ, ZQ, XPQ, ZPQ, A24):
+    """
+    One step of the Montgomery ladder: given (X : Z) of P, Q and P - Q,
+    compute (X : Z) of [2]P and P + Q, sharing (XP ± ZP)
+
+    Cost: 6M + 4S + 1c
+    """
+    t0 = XP + ZP
+    t1 = XP - ZP
+    t2 = (XQ - ZQ) * t0
+    t3 = (XQ + ZQ) * t1
+    t0 = t0 * t0
+    t1 = t1 * t1
+    t4 = t0 - t1
+
+    s = t2 + t3
+    d = t2 - t3
+    return t0 * t1, t4 * (t1 + A24 * t4), ZPQ * s * s, XPQ * d * d
+
+
+def xLADDER(m, X, Z, A24):
+    """
+    Montgomery ladder: given (X : Z) of P and m >= 0, compute (X : Z) of
+    [m]P and [m + 1]P
+    """
+    X0, Z0 = 1 + 0 * X, 0 * X
+    X1, Z1 = X, Z
+    for bit in ZZ(m).bits()[::-1]:
+        if bit:
+            X1, Z1, X0, Z0 = xDBLADD(X1, Z1, X0, Z0, X, Z, A24)
+        else:
+            X0, Z0, X1, Z1 = xDBLADD(X0, Z0, X1, Z1, X, Z, A24)
+    return (X0, Z0), (X1, Z1)
+
+
+def recover_y(A, P, XQ, ZQ, XQP, ZQP):
+    """
+    Okeya-Sakurai y-coordinate recovery, following Algorithm 5 of
+    "Montgomery curves and their arithmetic" by Costello and Smith.
+
+    Given an affine point P = (xP, yP) on y^2 = x^3 + Ax^2 + x and the
+    (X : Z) coordinates of Q and Q + P, returns projective coordinates
+    (X : Y : Z) of Q
+
+    Cost: 10M + 1S, no inversion
+    """
+    xP, yP = P[0], P[1]
+
+    v1 = xP * ZQ
+    v2 = XQ + v1
+    v3 = XQ - v1
+    v3 = v3 * v3 * XQP
+    v1 = 2 * A * ZQ
+    v2 = v2 + v1
+    v4 = xP * XQ + ZQ
+    v2 = v2 * v4
+    v1 = v1 * ZQ
+    v2 = (v2 - v1) * ZQP
+    Y = v2 - v3
+    v1 = 2 * yP * ZQ * ZQP
+    return v1 * XQ, Y, v1 * ZQ
+
+
+class CoupleKummerPoint:
+    """
+    x-only representation of P = (P1, P2) in E1 x E2 for Montgomery
+    curves, storing the (X : Z) coordinates of P1 and P2.
+
+    Doubling, differential addition and the Montgomery ladder avoid Sage
+    point objects and inversions. Full points can be recovered with
+    `lift()` given P and the x-coordinates of [m]P and [m + 1]P.
+    """
+
+    def __init__(self, XZ1, XZ2, curves, A24=None):
+        self.XZ1 = tuple(XZ1)
+        self.XZ2 = tuple(XZ2)
+        self._curves = tuple(curves)
+
+        # (A + 2) / 4 for both curves, shared by every multiple of P
+        if A24 is None:
+            A24 = tuple((montgomery_coefficient(E) + 2) / 4 for E in self._curves)
+        self._A24 = A24
+
+    @classmethod
+    def from_couple_point(cls, P):
+        """
+        Forget the y-coordinates of a CouplePoint
+        """
+        P1, P2 = P.points()
+        return cls((P1[0], P1[2]), (P2[0], P2[2]), P.curves())
+
+    def _new(self, XZ1, XZ2):
+        return self.__class__(XZ1, XZ2, self._curves, A24=self._A24)
+
+    def __repr__(self):
+        return "[({} : {}),({} : {})]".format(*self.XZ1, *self.XZ2)
+
+    def parent(self):
+        return self._curves
+
+    def curves(self):
+        return self.parent()
+
+    def xz(self):
+        return self.XZ1, self.XZ2
+
+    def __getitem__(self, i):
+        # Operator to get self[i], the (X : Z) coordinates on Ei
+        if i == 0:
+            return self.XZ1
+        elif i == 1:
+            return self.XZ2
+        else:
+            raise IndexError("Index {} is out of range.".format(i))
+
+    def __eq__(self, other):
+        if not isinstance(other, CoupleKummerPoint):
+            return False
+        for (X, Z), (Xo, Zo) in zip(self.xz(), other.xz()):
+            if X * Zo != Xo * Z:
+                return False
+        return True
+
+    def is_zero(self):
+        return self.XZ1[1] == 0 and self.XZ2[1] == 0
+
+    def double(self):
+        """
+        Computes [2] P = ([2] P1, [2] P2)
+        """
+        A24_1, A24_2 = self._A24
+        return self._new(xDBL(*self.XZ1, A24_1), xDBL(*self.XZ2, A24_2))
+
+    def double_iter(self, n):
+        """
+        Compute [2^n] P = ([2^n] P1, [2^n] P2)
+        """
+        A24_1, A24_2 = self._A24
+        return self._new(xDBL_iter(*self.XZ1, A24_1, n), xDBL_iter(*self.XZ2, A24_2, n))
+
+    def diff_add(self, other, diff):
+        """
+        Compute P + Q from P, Q and P - Q
+        """
+        return self._new(
+            xADD(*self.XZ1, *other.XZ1, *diff.XZ1),
+            xADD(*self.XZ2, *other.XZ2, *diff.XZ2),
+        )
+
+    def ladder(self, m):
+        """
+        Compute the pair ([m] P, [m + 1] P) with the Montgomery ladder
+        """
+        A24_1, A24_2 = self._A24
+        mP1, mP1_P1 = xLADDER(m, *self.XZ1, A24_1)
+        mP2, mP2_P2 = xLADDER(m, *self.XZ2, A24_2)
+        return self._new(mP1, mP2), self._new(mP1_P1, mP2_P2)
+
+    def __mul__(self, m):
+        """
+        Compute [m] P = ([m] P1, [m] P2)
+        """
+        m = ZZ(m)
+        if m < 0:
+            m = -m
+        return self.ladder(m)[0]
+
+    def __rmul__(self, m):
+        return self * m
+
+    def lift(self, P, sum_with_P):
+        """
+        Given the CouplePoint P used as difference and sum_with_P, the
+        x-only coordinates of self + P, recover self as a CouplePoint. Used
+        with the output of `ladder()` on P to compute [m]P. The two
+        normalisations share a single inversion.
+        """
+        if self.XZ1[1] == 0 or self.XZ2[1] == 0:
+            raise ValueError("Cannot lift a point with a component at infinity")
+
+        E1, E2 = self._curves
+        P1, P2 = P.points()
+        X1, Y1, Z1 = recover_y(montgomery_coefficient(E1), P1, *self.XZ1, *sum_with_P.XZ1)
+        X2, Y2, Z2 = recover_y(montgomery_coefficient(E2), P2, *self.XZ2, *sum_with_P.XZ2)
+        Z1_inv, Z2_inv = batched_inversion(Z1, Z2)
+
+        one = Z1_inv.parent().one()
+        Q1 = E1.point((X1 * Z1_inv, Y1 * Z1_inv, one), check=False)
+        Q2 = E2.point((X2 * Z2_inv, Y2 * Z2_inv, one), check=False)
+        return CouplePoint(Q1, Q2)
@@ -1,4 +1,6 @@
-from sage.all import ZZ
+from sage.misc.lazy_import import lazy_import
+
+lazy_import("sage.all", "ZZ")
 from utilities.discrete_log import tate_pairing_pari, weil_pairing_pari
 
 
@@ -1,7 +1,15 @@
-from sage.all import EllipticCurve
+from sage.misc.lazy_import import lazy_import
+
+lazy_import("sage.all", ["EllipticCurve", "matrix"])
+lazy_import("sage.structure.element", ["get_coercion_model", "RingElement"])
 from collections import namedtuple
 from utilities.supersingular import montgomery_coefficient
-from utilities.fast_sqrt import sqrt_Fp2
+from utilities.fast_sqrt import sqrt_Fp2, sqrt_Fp2_or_none
+from utilities.batched_inversion import batched_inversion
+from biextensions.morphism import TrivialChangeModel, Translation
+from theta_structures.dimension_two import ThetaPoint
+from theta_structures.interning import THETA_STRUCTURES
+from biextensions.biextension import Biextension
 
 ThetaNullPoint = namedtuple("ThetaNullPoint_dim_1", "a b")
 
@@ -51,9 +59,8 @@ def montgomery_curve_to_theta_null_point(E):
     # alpha is a root of
     # x^2 + Ax + 1
     disc = A * A - 4
-    assert disc.is_square()
-
-    d = sqrt_Fp2(A * A - 4)
+    d = sqrt_Fp2_or_none(disc)
+    assert d is not None
     alpha = (-A + d) / 2
 
     # The theta coordinates a^2 and b^2
@@ -134,3 +141,433 @@ def montgomery_point_to_theta_point(O0, P):
         U = a * (X - Z)
         V = b * (X + Z)
         return (U, V)
+
+
+# ============================================ #
+#     Theta model of level 2 of Kummer lines   #
+# ============================================ #
+
+
+def _translate_coords_by_index(P_coords, indices):
+    """
+    Action of the point of 2-torsion with index (i, j) on level 2 theta
+    coordinates: i swaps the coordinates, j changes the sign of the second
+    """
+    x, y = P_coords
+    i, j = indices
+    if i:
+        x, y = y, x
+    if j:
+        y = -y
+    return x, y
+
+
+class ThetaLinePoint:
+    """
+    A point (x : y) on the Kummer line in level 2 theta coordinates
+    """
+
+    def __init__(self, parent, coords):
+        if not isinstance(parent, ThetaLine):
+            raise ValueError
+
+        self._parent = parent
+        self._coords = tuple(coords)
+
+        self._squared_theta = None
+        self._inverse_coords = None
+
+    def parent(self):
+        """
+        Return the parent of the element, of type ThetaLine
+        """
+        return self._parent
+
+    def __reduce_ex__(self, protocol):
+        """
+        Pickle with the compact format of utilities.serialization
+        """
+        from utilities.serialization import reduce_point
+
+        return reduce_point(self, protocol)
+
+    def coords(self):
+        """
+        Return the projective coordinates of the point
+        """
+        return self._coords
+
+    def is_zero(self):
+        """
+        An element is zero if it is equivalent to the null point of the parent
+        ThetaLine
+        """
+        return self == self.parent().zero()
+
+    @staticmethod
+    def to_hadamard(x, y):
+        """
+        Hadamard transformation of two coordinates
+        """
+        return x + y, x - y
+
+    def squared_theta(self):
+        """
+        Compute the Squared Theta transformation of this element
+        which is the square operator followed by Hadamard.
+        """
+        if self._squared_theta is None:
+            x, y = self.coords()
+            self._squared_theta = self.to_hadamard(x * x, y * y)
+        return self._squared_theta
+
+    def double(self):
+        """
+        Computes [2]*self
+
+        Cost: 4S 2M
+        """
+        y0, Y0 = self.parent()._arithmetic_precomputation()
+
+        xp, yp = self.squared_theta()
+        xp = xp * xp
+        yp = Y0 * yp * yp
+
+        X, Y = self.to_hadamard(xp, yp)
+        return self._parent((X, y0 * Y))
+
+    def diff_add(P, Q, PQ):
+        """
+        Given the theta points of P, Q and P-Q computes the theta point of
+        P + Q.
+
+        Cost: 4S 5M
+        """
+        Y0 = P.parent()._arithmetic_precomputation()[-1]
+
+        p1, p2 = P.squared_theta()
+        q1, q2 = Q.squared_theta()
+
+        X, Y = P.to_hadamard(p1 * q1, Y0 * p2 * q2)
+        PQx, PQy = PQ.coords()
+        return P.parent()((X * PQy, Y * PQx))
+
+    # we have P=self, Q, R, R+Q, P+R, P+Q and we compute P+Q+R
+    def three_way_add(self, Q, R, QR, PR, PQ):
+        # we define it only in the affine case
+        raise NotImplementedError("This method is not implemented for projective theta lines. Use affine coordinates")
+
+    def scale(self, n):
+        """
+        Scale all coordinates of the point by `n`
+        """
+        x, y = self.coords()
+        if not isinstance(n, RingElement):
+            raise ValueError(f"Cannot scale by element {n} of type {type(n)}")
+        return self._parent((n * x, n * y))
+
+    def ratio(self, other):
+        """
+        Return the ratio of two theta points, lambda s.t. lambda P = Q
+        """
+        for i in range(2):
+            if self.coords()[i] != 0:
+                l = other.coords()[i] / self.coords()[i]
+                assert self.scale(l).coords() == other.coords()
+                return l
+
+    def translate_by(self, T):
+        f = self.parent().translate_by(T)
+        return f(self)
+
+    # The scalar multiplications and the ladders of ThetaPoint only use
+    # double and diff_add, we share them
+    double_iter = ThetaPoint.double_iter
+    __mul__ = ThetaPoint.__mul__
+    __rmul__ = ThetaPoint.__rmul__
+    full_ladder3 = ThetaPoint.full_ladder3
+    full_ladder3_bis = ThetaPoint.full_ladder3_bis
+    ladder3 = ThetaPoint.ladder3
+
+    def __eq__(self, other):
+        """
+        Projective equality of two points of the Kummer line
+        """
+        if not isinstance(other, ThetaLinePoint):
+            return False
+
+        x1, y1 = self.coords()
+        x2, y2 = other.coords()
+        return x1 * y2 == x2 * y1
+
+    def __repr__(self):
+        return f"Theta line point with coordinates: {self.coords()}"
+
+
+class AffineThetaLinePoint(ThetaLinePoint):
+    def inverse_coords(self):
+        """
+        The inverses of the coordinates, cached: in the ladders the
+        differences are always the same few points
+        """
+        if self._inverse_coords is None:
+            self._inverse_coords = batched_inversion(*self.coords())
+        return self._inverse_coords
+
+    def __eq__(self, other):
+        """
+        Exact equality of the affine coordinates
+        """
+        if isinstance(other, ThetaLinePoint):
+            other = self._parent(other.coords())
+        if not isinstance(other, AffineThetaLinePoint):
+            return False
+        return self.coords() == other.coords()
+
+    def is_proj_eq(self, other):
+        """
+        Projective equality of two points of the Kummer line
+        """
+        return ThetaLinePoint.__eq__(self, other)
+
+    def diff_add(P, Q, PQ):
+        """
+        Given the affine theta points of P, Q and P-Q computes the affine
+        theta point of P + Q.
+
+        Cost: 4S 6M, and 1I the first time P-Q is used as a difference
+        """
+        Ainv, Binv = P.parent()._arithmetic_precomputation()[-2:]
+
+        p1, p2 = P.squared_theta()
+        q1, q2 = Q.squared_theta()
+
+        X, Y = P.to_hadamard(Ainv * p1 * q1, Binv * p2 * q2)
+        PQx_inv, PQy_inv = PQ.inverse_coords()
+        return P.parent()((X * PQx_inv, Y * PQy_inv))
+
+    def double(self):
+        """
+        Computes [2]*self
+
+        Cost: 4S 4M
+        """
+        ainv, binv, Ainv, Binv = self.parent()._arithmetic_precomputation()
+
+        xp, yp = self.squared_theta()
+        X, Y = self.to_hadamard(Ainv * xp * xp, Binv * yp * yp)
+        return self._parent((ainv * X, binv * Y))
+
+    def three_way_add(self, Q, R, QR, PR, PQ):
+        """
+        Given P = self, Q, R, Q + R, P + R and P + Q, computes P + Q + R
+        """
+        (q1, q2), (r1, r2) = Q.coords(), R.coords()
+        (o1, o2), (s1, s2) = self.parent().coords(), QR.coords()
+        (u1, u2), (v1, v2) = PQ.coords(), PR.coords()
+        x, y = self.coords()
+
+        S_Q_R = self.to_hadamard(q1 * r1, q2 * r2)
+        S_0_QR = self.to_hadamard(o1 * s1, o2 * s2)
+        S_PQ_PR = self.to_hadamard(u1 * v1, u2 * v2)
+
+        QR1_inv, QR2_inv, x_inv, y_inv = batched_inversion(*S_Q_R, 2 * x, 2 * y)
+
+        S1, S2 = self.to_hadamard(
+            S_0_QR[0] * S_PQ_PR[0] * QR1_inv, S_0_QR[1] * S_PQ_PR[1] * QR2_inv
+        )
+        return self._parent((S1 * x_inv, S2 * y_inv))
+
+
+class ThetaLine:
+    """
+    The Kummer line of an elliptic curve with a level 2 theta structure,
+    defined by its theta null point (a : b). This is the dimension one
+    analogue of ThetaStructure, with the same interface for the biextension
+    code: double, diff_add and the ladders.
+    """
+
+    _point = ThetaLinePoint
+
+    def __init__(self, null_point):
+        if not len(null_point) == 2:
+            raise ValueError
+
+        self._base_ring = get_coercion_model().common_parent(*(c.parent() for c in null_point))
+        self._precomputation = None
+
+        self._null_point = self._point(self, null_point)
+
+    @classmethod
+    def interned(cls, null_point):
+        """
+        Return the shared theta line with this null point from the registry
+        THETA_STRUCTURES
+        """
+        return THETA_STRUCTURES.get(cls, null_point)
+
+    @classmethod
+    def from_montgomery(cls, E):
+        """
+        One of the four theta lines of the Montgomery curve E, see
+        montgomery_curve_to_theta_null_point; points of E are mapped with
+        montgomery_point
+        """
+        return cls(tuple(montgomery_curve_to_theta_null_point(E)))
+
+    def null_point(self):
+        """
+        Return the null point of the given theta line
+        """
+        return self._null_point
+
+    def __reduce_ex__(self, protocol):
+        """
+        Pickle with the compact format of utilities.serialization, the
+        unpickled line is the interned one
+        """
+        from utilities.serialization import reduce_structure
+
+        return reduce_structure(self, protocol)
+
+    def __copy__(self):
+        """
+        Theta lines are immutable and shared (see interned), like Sage
+        parents a copy is the line itself
+        """
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def base_ring(self):
+        """
+        Return the base ring of the common parent of the coordinates of the null point
+        """
+        return self._base_ring
+
+    def zero(self):
+        """
+        The additive identity is the theta null point
+        """
+        return self.null_point()
+
+    def __repr__(self):
+        return f"Theta line over {self.base_ring()} with null point: {self.null_point()}"
+
+    def coords(self):
+        """
+        Return the coordinates of the theta null point of the theta line
+        """
+        return self.null_point().coords()
+
+    def squared_theta(self):
+        """
+        Square the coefficients and then compute the Hadamard transformation of
+        the theta null point of the theta line
+        """
+        return self.null_point().squared_theta()
+
+    def montgomery_curve(self):
+        """
+        The Montgomery curve of the theta line, see
+        theta_null_point_to_montgomery_curve
+        """
+        return theta_null_point_to_montgomery_curve(self.coords())
+
+    def montgomery_point(self, P):
+        """
+        The theta point of the point P of the Montgomery curve of the theta
+        line
+        """
+        return self(tuple(montgomery_point_to_theta_point(self.coords(), P)))
+
+    def _arithmetic_precomputation(self):
+        """
+        Precompute the 2 field elements y0 = a / b and Y0 = A^2 / B^2 used in
+        doubling and differential additions
+        """
+        if self._precomputation is None:
+            a, b = self.null_point().coords()
+            AA, BB = self.squared_theta()
+            b_inv, BB_inv = batched_inversion(b, BB)
+            self._precomputation = (a * b_inv, AA * BB_inv)
+        return self._precomputation
+
+    def _translation_index(self, T, eq):
+        """
+        The index (i, j) of the point of 2-torsion T, compared to the
+        translates of the null point with eq
+        """
+        null_point = self.coords()
+        for ind in ((0, 0), (0, 1), (1, 0), (1, 1)):
+            if eq(T, self(_translate_coords_by_index(null_point, ind))):
+                return ind
+        raise ValueError("The argument of this method should be a valid 2-torsion point.")
+
+    def _translation(self, ind):
+        N = matrix(
+            [
+                list(_translate_coords_by_index((1, 0), ind)),
+                list(_translate_coords_by_index((0, 1), ind)),
+            ]
+        ).transpose()
+        return Translation(domain=self, N=N)
+
+    def translate_by(self, T):
+        return self._translation(self._translation_index(T, lambda P, Q: P == Q))
+
+    def __call__(self, P):
+        if isinstance(P, (tuple, list)):
+            coords = tuple(P)
+        elif isinstance(P, ThetaLinePoint):
+            coords = P.coords()
+        else:
+            raise TypeError(
+                f"A theta line point is given by a tuple or list of coordinates or a ThetaLinePoint, not {type(P).__name__}"
+            )
+        if coords == (0, 0):
+            raise ValueError("Cannot create a theta point with all zero coordinates")
+        return self._point(self, coords)
+
+    def to_affine(self):
+        return TrivialChangeModel(self, AffineThetaLine.interned(self.coords()))
+
+
+class AffineThetaLine(ThetaLine):
+    """
+    Theta line with affine (cubical) arithmetic, needed by the biextension
+    pairings, see AffineThetaStructure
+    """
+
+    _point = AffineThetaLinePoint
+
+    def _arithmetic_precomputation(self):
+        if self._precomputation is None:
+            a, b = self.null_point().coords()
+            AA, BB = self.squared_theta()
+            # The Hadamard transform squares to 2 in dimension one
+            self._precomputation = batched_inversion(a, b, 2 * AA, 2 * BB)
+        return self._precomputation
+
+    def to_projective(self):
+        return TrivialChangeModel(self, ThetaLine.interned(self.coords()))
+
+    def translate_by(self, T):
+        return self._translation(self._translation_index(T, lambda P, Q: P.is_proj_eq(Q)))
+
+
+def montgomery_biextension(P, Q, PQ=None):
+    """
+    Given points P, Q (and optionally P + Q) of a Montgomery curve E, the
+    biextension element [0, P; Q, P + Q] on the affine theta line of E, on
+    which tate_pairing and weil_pairing can be called.
+
+    NOTE: compared to the pairings of SageMath, the pairings obtained are
+    raised to the power -2 for odd n, and to the power -1 for even n,
+    thanks to the translation by the point of 2-torsion.
+    """
+    if PQ is None:
+        PQ = P + Q
+    theta = AffineThetaLine.interned(ThetaLine.from_montgomery(P.curve()).coords())
+    return Biextension(*(theta.montgomery_point(X) for X in (P, Q, PQ)))
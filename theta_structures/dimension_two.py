@@ -1,17 +1,25 @@
 # Sage Imports
-from sage.all import (
-    cached_method,
-    Integer,
-    HyperellipticCurve,
-    PolynomialRing,
-    matrix
-)
-from sage.structure.element import get_coercion_model, RingElement
+from sage.misc.cachefunc import cached_method
+from sage.misc.lazy_import import lazy_import
+
+lazy_import("sage.all", ["Integer", "HyperellipticCurve", "PolynomialRing", "matrix"])
+lazy_import("sage.structure.element", ["get_coercion_model", "RingElement"])
+
 from utilities.batched_inversion import batched_inversion
+from utilities.fast_sqrt import sqrt_Fp2_or_none
 from biextensions.morphism import Isogeny, TrivialChangeModel, Translation, LinearChangeModel
+from theta_structures.interning import THETA_STRUCTURES
 
 
-cm = get_coercion_model()
+# The pairs (chi, i) of a character chi of (Z/2Z)^2, given by the signs
+# chi(t) = (-1)^(s.t) for t = 0, 1, 2, 3, and of an index i such that
+# chi(i) = 1. These index the level (2, 2) Riemann relations.
+EVEN_CHARACTERISTICS = tuple(
+    (tuple(bin(s & t).count("1") % 2 for t in range(4)), i)
+    for s in range(4)
+    for i in range(4)
+    if bin(s & i).count("1") % 2 == 0
+)
 
 
 # ============================================ #
@@ -30,18 +38,45 @@ class ThetaStructure:
         if not len(null_point) == 4:
             raise ValueError
 
-        self._base_ring = cm.common_parent(*(c.parent() for c in null_point))
+        self._base_ring = get_coercion_model().common_parent(*(c.parent() for c in null_point))
         self._point = ThetaPoint
         self._precomputation = None
 
         self._null_point = self._point(self, null_point)
 
+    @classmethod
+    def interned(cls, null_point):
+        """
+        Return the shared structure with this null point from the registry
+        THETA_STRUCTURES, so that its precomputations are only done once
+        """
+        return THETA_STRUCTURES.get(cls, null_point)
+
     def null_point(self):
         """
         Return the null point of the given theta structure
         """
         return self._null_point
 
+    def __reduce_ex__(self, protocol):
+        """
+        Pickle with the compact format of utilities.serialization, the
+        unpickled structure is the interned one
+        """
+        from utilities.serialization import reduce_structure
+
+        return reduce_structure(self, protocol)
+
+    def __copy__(self):
+        """
+        Theta structures are immutable and shared (see interned), like Sage
+        parents a copy is the structure itself
+        """
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
     def base_ring(self):
         """
         Return the base ring of the common parent of the coordinates of the null point
@@ -185,6 +220,89 @@ class ThetaStructure:
             raise ValueError("Converted curve is not a hyperelliptic curve")
         return H
 
+    @cached_method
+    def mumford_conversion(self):
+        """
+        Conversion between Mumford coordinates of divisors on the curve
+        hyperelliptic_from_theta() and theta points, see MumfordThetaConversion
+        """
+        from theta_structures.mumford import MumfordThetaConversion
+
+        return MumfordThetaConversion(self)
+
+    @cached_method
+    def kummer_equation_constants(self):
+        """
+        Return the constants (E, F, G, H) of the quartic equation of the
+        Kummer surface in theta coordinates
+
+            x^4 + y^4 + z^4 + t^4 + 2E xyzt - F(x^2t^2 + y^2z^2)
+                - G(x^2z^2 + y^2t^2) - H(x^2y^2 + z^2t^2) = 0
+
+        see Gaudry, Fast genus 2 arithmetic based on Theta functions. The
+        constant E is recovered from the null point lying on the surface.
+        """
+        a, b, c, d = self.coords()
+        aa, bb, cc, dd = a * a, b * b, c * c, d * d
+        a4, b4, c4, d4 = aa * aa, bb * bb, cc * cc, dd * dd
+
+        F_inv, G_inv, H_inv, abcd_inv = batched_inversion(
+            aa * dd - bb * cc, aa * cc - bb * dd, aa * bb - cc * dd, 2 * a * b * c * d
+        )
+        F = (a4 - b4 - c4 + d4) * F_inv
+        G = (a4 - b4 + c4 - d4) * G_inv
+        H = (a4 + b4 - c4 - d4) * H_inv
+        E = -(
+            a4 + b4 + c4 + d4
+            - F * (aa * dd + bb * cc)
+            - G * (aa * cc + bb * dd)
+            - H * (aa * bb + cc * dd)
+        ) * abcd_inv
+        return E, F, G, H
+
+    def kummer_equation(self, coords):
+        """
+        Evaluate the quartic equation of the Kummer surface at coords
+        """
+        E, F, G, H = self.kummer_equation_constants()
+        x, y, z, t = coords
+        xx, yy, zz, tt = x * x, y * y, z * z, t * t
+        return (
+            xx * xx + yy * yy + zz * zz + tt * tt
+            + 2 * E * x * y * z * t
+            - F * (xx * tt + yy * zz)
+            - G * (xx * zz + yy * tt)
+            - H * (xx * yy + zz * tt)
+        )
+
+    @staticmethod
+    def _even_riemann_sums(P_coords, Q_coords):
+        """
+        For the 10 even pairs (chi, i), that is chi(i) = 1, compute
+
+            U_{chi, i}(P, Q) = sum_t chi(t) P_{i + t} Q_t
+
+        indexed by the pairs in EVEN_CHARACTERISTICS
+        """
+        return [
+            sum(
+                (-P_coords[i ^ t] if chi_t else P_coords[i ^ t]) * Q_coords[t]
+                for t, chi_t in enumerate(chi)
+            )
+            for chi, i in EVEN_CHARACTERISTICS
+        ]
+
+    @cached_method
+    def _normal_add_precomputation(self):
+        """
+        The inverses of the 10 even U_{chi, i}(0, 0), used by normal_add
+        """
+        O = self.coords()
+        U0 = self._even_riemann_sums(O, O)
+        if any(u == 0 for u in U0):
+            raise ValueError("An even theta constant vanishes, the Kummer surface is a product")
+        return batched_inversion(*U0)
+
     def __call__(self, P):
          # if coords == ThetaPoint(self, (0, 0, 0, 0)):
         if type(P) == tuple:
@@ -196,7 +314,7 @@ class ThetaStructure:
         return self._point(self, coords)
     
     def to_affine(self):
-        return TrivialChangeModel(self, AffineThetaStructure(self.coords()))
+        return TrivialChangeModel(self, AffineThetaStructure.interned(self.coords()))
 
 
 # ======================================== #
@@ -230,6 +348,14 @@ class ThetaPoint:
         """
         return self._parent
 
+    def __reduce_ex__(self, protocol):
+        """
+        Pickle with the compact format of utilities.serialization
+        """
+        from utilities.serialization import reduce_point
+
+        return reduce_point(self, protocol)
+
     def theta(self):
         """
         Return the parent theta structure of this ThetaPoint"""
@@ -377,6 +503,58 @@ class ThetaPoint:
     def compatible_add(self, PT, Q, QT):
         raise NotImplementedError("This method is not implemented yet.")
 
+    def normal_add(self, Q):
+        """
+        Given the theta points of P and Q, compute one of P + Q, P - Q
+        (which one depends on the choice of a square root).
+
+        The level (2, 2) Riemann relations give, for the 10 even (chi, i),
+
+            U_{chi, i}(P + Q, P - Q) U_{chi, i}(0, 0)
+                = U_{chi, i}(P, P) U_{chi, i}(Q, Q)
+
+        from which we recover the products X_j Y_j and X_j Y_k + X_k Y_j of
+        the coordinates of X = P + Q and Y = P - Q. X is then found with one
+        square root and no inversion.
+        """
+        theta = self.parent()
+        U0_inv = theta._normal_add_precomputation()
+        UP = theta._even_riemann_sums(self.coords(), self.coords())
+        UQ = theta._even_riemann_sums(Q.coords(), Q.coords())
+        W = {
+            (chi, i): uP * uQ * u0_inv
+            for (chi, i), uP, uQ, u0_inv in zip(EVEN_CHARACTERISTICS, UP, UQ, U0_inv)
+        }
+
+        # The diagonal products D_j = X_j Y_j from the four characters at i = 0
+        # (up to a common factor 4)
+        D = self.to_hadamard(*(W[chi, 0] for chi, i in EVEN_CHARACTERISTICS if i == 0))
+
+        # B[j, k] = X_j Y_k + X_k Y_j (up to the same common factor): for i != 0
+        # the two even characters give the sums over the cosets {j, j + i}
+        B = {}
+        for i in range(1, 4):
+            W_i = [W[chi, i] for chi, i_chi in EVEN_CHARACTERISTICS if i_chi == i]
+            j = 1 if i != 1 else 2
+            B[0, i] = 2 * (W_i[0] + W_i[1])
+            B[min(j, i ^ j), max(j, i ^ j)] = 2 * (W_i[0] - W_i[1])
+
+        if D[0] == 0:
+            raise ValueError("normal_add assumes the first coordinates of P + Q and P - Q are non-zero")
+
+        # X_1 / X_0 and Y_1 / Y_0 are the roots of
+        # D_0 z^2 - B_01 z + D_1, the other coordinates are then linear
+        disc = B[0, 1] * B[0, 1] - 4 * D[0] * D[1]
+        r = sqrt_Fp2_or_none(disc)
+        if r is None or r == 0:
+            raise ValueError("Could not compute the normal addition of these points")
+
+        X0 = 2 * D[0] * r
+        X1 = (B[0, 1] + r) * r
+        X2 = (B[0, 1] + r) * B[0, 2] - 2 * D[0] * B[1, 2]
+        X3 = (B[0, 1] + r) * B[0, 3] - 2 * D[0] * B[1, 3]
+        return self._parent((X0, X1, X2, X3))
+
     def scale(self, n):
         """
         Scale all coordinates of the ThetaPoint by `n`
@@ -583,7 +761,7 @@ class AffineThetaStructure(ThetaStructure):
         return self._precomputation
 
     def to_projective(self):
-        return TrivialChangeModel(self, ThetaStructure(self.coords()))
+        return TrivialChangeModel(self, ThetaStructure.interned(self.coords()))
     
     def translate_by(self, T):
         def translate_coords_by_index(P_coords, indices):
@@ -600,7 +778,7 @@ class AffineThetaStructure(ThetaStructure):
             return a,b,c,d
         
         null_point = self.coords()
-        proj = ThetaStructure(null_point)
+        proj = ThetaStructure.interned(null_point)
         for i in range(16):
             ind = (i//8, (i%8)//4, (i%4)//2, i%2)
             T_ind = self(translate_coords_by_index(null_point, ind))
@@ -729,7 +907,7 @@ class AffineThetaPoint(ThetaPoint):
         S_PQ_PR = self._componentwise_multiply(PQ.coords(), PR.coords())
         S_PQ_PR = self.to_hadamard(*S_PQ_PR)
 
-        xQR_inv, yQR_inv, zQR_inv, tQR_inv, xP_inv, yP_inv, zP_inv, tP_inv = batched_inversion(*S_Q_R, *self.scale(4).coords())
+        xQR_inv, yQR_inv, zQR_inv, tQR_inv, xP_inv, yP_inv, zP_inv, tP_inv = batched_inversion(*S_Q_R, *(4 * x for x in self.coords()))
 
         S_sums = self._componentwise_multiply(S_0_QR, S_PQ_PR)
         S_sums = self._componentwise_multiply(S_sums,
@@ -738,7 +916,7 @@ class AffineThetaPoint(ThetaPoint):
 
         S_PQR = self._componentwise_multiply(S_sums, (xP_inv, yP_inv, zP_inv, tP_inv))
 
-        return self._parent(S_PQR)
+        return self._parent(tuple(S_PQR))
     
     # we have P=self, P+T, Q, Q+T and we compute P+Q, P+Q+T
     def compatible_add(self, PT, Q, QT):
@@ -0,0 +1,136 @@
+import threading
+from collections import OrderedDict
+
+# ================================================ #
+#   Interning of theta structures by null point    #
+# ================================================ #
+
+
+def null_point_key(null_point):
+    """
+    Hashable key of a null point: its coordinates together with their
+    parents, so that equal elements of different rings are not confused.
+
+    NOTE: the coordinates are not normalised, as the scaling of the null
+    point matters for affine theta structures and for to_affine
+    """
+    coords = tuple(null_point)
+    return tuple((c.parent(), c) for c in coords)
+
+
+def rosenhain_fingerprint(theta):
+    """
+    The Rosenhain invariants (lam, mu, nu) of theta, which do not depend on
+    the scaling of the null point, or None when they are not defined (e.g.
+    for products of elliptic curves)
+    """
+    try:
+        return tuple(theta.rosenhain_from_theta())
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+class ThetaStructureRegistry:
+    """
+    A bounded registry of theta structures keyed on the type of the structure
+    and its null point. Requesting a structure twice returns the same object,
+    together with its cached precomputations (common parent of the
+    coordinates, arithmetic constants, ...). When the registry holds more
+    than maxsize structures, the least recently used ones are evicted.
+
+    With fingerprint=True, the structures are also indexed by their
+    Rosenhain invariants, which lets us find structures which are the same
+    up to the scaling of the null point (e.g. the codomains of the same
+    isogeny computed by different jobs). This costs a few inversions per new
+    structure, so it is disabled by default.
+
+    The registry may be shared by several threads: its tables are only
+    touched under a lock, while new structures are created outside of it.
+    """
+
+    def __init__(self, maxsize=256, fingerprint=False):
+        self.maxsize = maxsize
+        self.fingerprint = fingerprint
+        self.hits = 0
+        self.misses = 0
+
+        # key -> (structure, fingerprint or None)
+        self._structures = OrderedDict()
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return (
+            f"Registry of {len(self)} theta structures "
+            f"(maxsize={self.maxsize}, hits={self.hits}, misses={self.misses})"
+        )
+
+    def __len__(self):
+        return len(self._structures)
+
+    def get(self, cls, null_point):
+        """
+        Return the interned structure cls(null_point), creating it if needed
+        """
+        key = (cls, null_point_key(null_point))
+        with self._lock:
+            entry = self._structures.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._structures.move_to_end(key)
+                return entry[0]
+            self.misses += 1
+
+        # created without the lock, as the constructor may intern other
+        # structures; when two threads race, the first one inserted wins
+        theta = cls(null_point)
+        fp = rosenhain_fingerprint(theta) if self.fingerprint else None
+
+        with self._lock:
+            entry = self._structures.get(key)
+            if entry is not None:
+                self._structures.move_to_end(key)
+                return entry[0]
+            self._structures[key] = (theta, fp)
+            if fp is not None:
+                self._fingerprints.setdefault(fp, []).append(key)
+
+            while len(self._structures) > self.maxsize:
+                self._evict()
+        return theta
+
+    def _evict(self):
+        """
+        Remove the least recently used structure, with the lock held
+        """
+        key, (_, fp) = self._structures.popitem(last=False)
+        if fp is not None:
+            keys = self._fingerprints.get(fp)
+            if keys is not None:
+                keys.remove(key)
+                if not keys:
+                    del self._fingerprints[fp]
+
+    def find_isomorphic(self, theta):
+        """
+        The interned structures with the same Rosenhain invariants as theta,
+        only available when the registry was created with fingerprint=True
+        """
+        if not self.fingerprint:
+            raise ValueError("The registry does not index the fingerprints of the structures")
+        fp = rosenhain_fingerprint(theta)
+        if fp is None:
+            return []
+        with self._lock:
+            return [self._structures[key][0] for key in self._fingerprints.get(fp, [])]
+
+    def clear(self):
+        with self._lock:
+            self._structures.clear()
+            self._fingerprints.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# The registry used by ThetaStructure.interned and AffineThetaStructure.interned
+THETA_STRUCTURES = ThetaStructureRegistry()
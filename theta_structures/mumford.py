@@ -0,0 +1,358 @@
+from itertools import product
+
+from sage.misc.lazy_import import lazy_import
+
+lazy_import("sage.all", ["Matrix", "vector"])
+
+from utilities.batched_inversion import batched_inversion_or_zero
+from utilities.fast_sqrt import batched_sqrt_Fp2, sqrt_Fp2_or_none
+
+# ================================================ #
+#   Conversion between Mumford coordinates on the  #
+#   Rosenhain curve and theta coordinates          #
+# ================================================ #
+
+# The Weierstrass points of y^2 = x(x - 1)(x - lam)(x - mu)(x - nu), the
+# index 5 stands for the point at infinity
+INFINITY = 5
+
+
+def _reduce_subset(A):
+    """
+    The points of order 2 of the Jacobian are the even subsets A of the six
+    Weierstrass points modulo complement: we represent them by the subset of
+    size 0 or 2
+    """
+    if len(A) > 3:
+        A = frozenset(range(6)) - A
+    return frozenset(A)
+
+
+def _subset_pairing(A, B):
+    """
+    Weil pairing of the points of order 2 represented by A and B, written
+    additively in F2
+    """
+    return len(A & B) % 2
+
+
+def _theta_pairing(T, S):
+    """
+    Commutator pairing of the elements T = (i, s) and S = (j, r) of the
+    Heisenberg group of level 2, acting by X_t -> (-1)^(s.t) X_(t + i),
+    written additively in F2
+    """
+    (i, s), (j, r) = T, S
+    return (bin(s & j).count("1") + bin(r & i).count("1")) % 2
+
+
+class MumfordThetaConversion:
+    """
+    Conversion between Mumford coordinates (u, v) of divisors on the
+    Rosenhain curve H: y^2 = f(x) = x(x - 1)(x - lam)(x - mu)(x - nu) of
+    a ThetaStructure (see ThetaStructure.hyperelliptic_from_theta) and theta
+    points on its Kummer surface.
+
+    For D = (x1, y1) + (x2, y2) - 2*infinity, with u = x^2 + u1 x + u0 and
+    v = v1 x + v0, the Kummer surface of H in P^3 is given by the coordinates
+    of Cassels and Flynn,
+
+        xi = (1, x1 + x2, x1 x2, (F0(x1, x2) - 2 y1 y2) / (x1 - x2)^2)
+           = (1, -u1, u0, v1^2 + f5 u1^3 - f4 u1^2 - f5 u1 u0 + f3 u1 - f2)
+
+    and xi = (0, 1, x1, f5 x1^2) for D = (x1, y1) - infinity. Both are
+    embeddings by |2 Theta|, so theta coordinates are xi up to a linear
+    map N. We find N by matching the 16 points of order 2 on both sides,
+    enumerating the symplectic bases of the 2-torsion of the theta
+    structure. This is done once, when the conversion is created.
+
+    From theta to Mumford, v is recovered up to sign (as points on the
+    Kummer surface are up to sign) with one square root. Points of the
+    Kummer surface coming from the quadratic twist give None.
+    """
+
+    def __init__(self, theta):
+        self._theta = theta
+        self._curve = theta.hyperelliptic_from_theta()
+
+        f = self._curve.hyperelliptic_polynomials()[0]
+        self._poly_ring = f.parent()
+        self._f = f
+        self._f_coeffs = [f[i] for i in range(6)]
+
+        lam, mu, nu = theta.rosenhain_from_theta()
+        F = theta.base_ring()
+        self._roots = (F(0), F(1), lam, mu, nu)
+
+        self._N = self._change_of_coordinates()
+        self._N_rows = tuple(tuple(row) for row in self._N.rows())
+        self._N_inv_rows = tuple(tuple(row) for row in self._N.inverse().rows())
+
+    def __repr__(self):
+        return f"Mumford-theta conversion for {self._theta} and {self._curve}"
+
+    def curve(self):
+        return self._curve
+
+    def theta_structure(self):
+        return self._theta
+
+    def matrix(self):
+        """
+        The matrix N sending Cassels-Flynn coordinates to theta coordinates
+        """
+        return self._N
+
+    # ================================ #
+    #   Precomputation of the matrix   #
+    # ================================ #
+
+    def _Q(self, u1, u0):
+        """
+        The polynomial in u1, u0 such that xi_4 = v1^2 + Q(u1, u0)
+        """
+        _, _, f2, f3, f4, f5 = self._f_coeffs
+        return ((f5 * u1 - f4) * u1 + f3 - f5 * u0) * u1 - f2
+
+    def _two_torsion_kummer(self, A):
+        """
+        Cassels-Flynn coordinates of the point of order 2 represented by the
+        subset A of size 0 or 2
+        """
+        F = self._theta.base_ring()
+        if not A:
+            return vector(F, [0, 0, 0, 1])
+
+        i, j = sorted(A)
+        if j == INFINITY:
+            e = self._roots[i]
+            return vector(F, [0, 1, e, self._f_coeffs[5] * e * e])
+
+        ei, ej = self._roots[i], self._roots[j]
+        u1, u0 = -(ei + ej), ei * ej
+        return vector(F, [1, -u1, u0, self._Q(u1, u0)])
+
+    def _two_torsion_theta(self, T):
+        """
+        Theta coordinates of the null point translated by T = (i, s)
+        """
+        i, s = T
+        O = self._theta.coords()
+        return vector(
+            [-O[t ^ i] if bin(s & t).count("1") % 2 else O[t ^ i] for t in range(4)]
+        )
+
+    def _change_of_coordinates(self):
+        """
+        Find the matrix N such that N * xi is the theta point of the divisor
+        with Cassels-Flynn coordinates xi.
+
+        We fix a basis T1, ..., T4 of the 2-torsion of the Jacobian of H. For
+        each basis S1, ..., S4 of the theta group with the same pairings,
+        the matrix N sending 0, T1, ..., T4 to the null point and its
+        translates by S1, ..., S4 is determined by these 5 points, and we
+        keep the one which sends the 16 points of order 2 correctly.
+        """
+        basis = [frozenset(A) for A in ({0, 1}, {2, 3}, {1, 2}, {3, 4})]
+        gram = [[_subset_pairing(A, B) for B in basis] for A in basis]
+
+        # All 16 combinations of the basis, on the curve side
+        combinations = list(product(range(2), repeat=4))
+        kummer_points = []
+        for c in combinations:
+            A = frozenset()
+            for ck, Ak in zip(c, basis):
+                if ck:
+                    A = A ^ Ak
+            kummer_points.append(self._two_torsion_kummer(_reduce_subset(A)))
+
+        K = Matrix([kummer_points[c] for c in (8, 4, 2, 1)]).transpose()
+        K_inv = K.inverse()
+        K0 = K_inv * kummer_points[0]
+
+        elements = [(i, s) for i in range(4) for s in range(4)][1:]
+
+        def add(T, S):
+            return (T[0] ^ S[0], T[1] ^ S[1])
+
+        def symplectic_bases(S):
+            """
+            Extend S to bases with the pairings given by gram
+            """
+            if len(S) == 4:
+                yield S
+                return
+            k = len(S)
+            spanned = {(0, 0)}
+            for Sj in S:
+                spanned |= {add(T, Sj) for T in spanned}
+            for T in elements:
+                if T in spanned:
+                    continue
+                if all(_theta_pairing(Sj, T) == gram[j][k] for j, Sj in enumerate(S)):
+                    yield from symplectic_bases(S + [T])
+
+        for S in symplectic_bases([]):
+            theta_points = []
+            for c in combinations:
+                T = (0, 0)
+                for ck, Sk in zip(c, S):
+                    if ck:
+                        T = add(T, Sk)
+                theta_points.append(T)
+
+            theta_coords = [self._two_torsion_theta(T) for T in theta_points]
+            B = Matrix([theta_coords[c] for c in (8, 4, 2, 1)]).transpose()
+            if B.det() == 0:
+                continue
+            B0 = B.inverse() * theta_coords[0]
+
+            N = B * Matrix.diagonal([b / k for b, k in zip(B0, K0)]) * K_inv
+
+            # Check that all points of order 2 are sent to the right node
+            if all(
+                _proportional(N * xi, X)
+                for xi, X in zip(kummer_points, theta_coords)
+            ):
+                return N
+
+        raise ValueError(
+            "Could not match the Kummer surfaces of the Rosenhain curve and the theta structure"
+        )
+
+    # ============================= #
+    #   From Mumford to theta       #
+    # ============================= #
+
+    def _kummer_coords(self, D):
+        """
+        Cassels-Flynn coordinates of the divisor D = (u, v), no inversion
+        """
+        u, v = D[0], D[1]
+        if not u.is_monic():
+            u = u.monic()
+
+        if u.degree() == 2:
+            u1, u0 = u[1], u[0]
+            v1 = v[1]
+            return (u0**0, -u1, u0, v1 * v1 + self._Q(u1, u0))
+        if u.degree() == 1:
+            x1 = -u[0]
+            return (0 * x1, x1**0, x1, self._f_coeffs[5] * x1 * x1)
+
+        one = self._f_coeffs[5] ** 0
+        return (0 * one, 0 * one, 0 * one, one)
+
+    @staticmethod
+    def _apply(rows, xi):
+        x0, x1, x2, x3 = xi
+        return tuple(r0 * x0 + r1 * x1 + r2 * x2 + r3 * x3 for r0, r1, r2, r3 in rows)
+
+    def to_theta(self, D):
+        """
+        Given a divisor D, either a point of the Jacobian of H or a pair of
+        polynomials (u, v), compute the theta point of D on the Kummer surface
+        """
+        return self._theta(self._apply(self._N_rows, self._kummer_coords(D)))
+
+    def to_theta_batch(self, divisors):
+        """
+        Theta points of many divisors. As theta points are projective, this
+        costs no inversion at all: the batch only shares the lookups of the
+        structure constants.
+        """
+        theta, rows = self._theta, self._N_rows
+        return [theta(self._apply(rows, self._kummer_coords(D))) for D in divisors]
+
+    # ============================= #
+    #   From theta to Mumford       #
+    # ============================= #
+
+    def _f_mod_u(self, u1, u0):
+        """
+        Coefficients (r1, r0) of f mod x^2 + u1 x + u0
+        """
+        c = list(self._f_coeffs)
+        for k in range(5, 1, -1):
+            ck = c[k]
+            c[k - 1] -= ck * u1
+            c[k - 2] -= ck * u0
+        return c[1], c[0]
+
+    def to_mumford(self, P):
+        """
+        Given a theta point P, compute the Mumford coordinates (u, v) of
+        one of the divisors +D, -D above P, or None when P comes from the
+        quadratic twist
+        """
+        return self.to_mumford_batch([P])[0]
+
+    def to_mumford_batch(self, points):
+        """
+        Mumford coordinates of the divisors above many theta points, or None
+        for points coming from the quadratic twist. All the normalisations
+        share a single batched inversion, and so do the divisions by 2 v1.
+        The square roots use the cached constants of the base field.
+        """
+        R = self._poly_ring
+        x = R.gen()
+        rows = self._N_inv_rows
+        xis = [self._apply(rows, P.coords()) for P in points]
+
+        # Normalise by the first non-zero of the first two coordinates,
+        # both are zero only for the neutral point
+        pivots = [xi[0] if xi[0] != 0 else xi[1] for xi in xis]
+        pivots_inv = batched_inversion_or_zero(pivots)
+
+        # Degree 2: u = x^2 + u1 x + u0 and v1^2 = xi_4 / xi_1 - Q(u1, u0)
+        # Degree 1: u = x - x1 and v^2 = f(x1)
+        normalised, squares = [], []
+        for xi, p_inv in zip(xis, pivots_inv):
+            if p_inv == 0:
+                normalised.append(None)
+                squares.append(xi[3] * 0)
+            elif xi[0] != 0:
+                u1, u0 = -xi[1] * p_inv, xi[2] * p_inv
+                normalised.append((u1, u0))
+                squares.append(xi[3] * p_inv - self._Q(u1, u0))
+            else:
+                x1 = xi[2] * p_inv
+                normalised.append((x1,))
+                squares.append(self._f(x1))
+        roots = batched_sqrt_Fp2(squares)
+
+        # With f = r1 x + r0 mod u, v0 = (r1 + u1 v1^2) / (2 v1) when v1 != 0
+        two_v1 = [
+            2 * r if r is not None and u is not None and len(u) == 2 else 0 * s
+            for u, r, s in zip(normalised, roots, squares)
+        ]
+        two_v1_inv = batched_inversion_or_zero(two_v1)
+
+        divisors = []
+        for u, r, s, t_inv in zip(normalised, roots, squares, two_v1_inv):
+            if r is None:
+                divisors.append(None)
+            elif u is None:
+                divisors.append((R(1), R(0)))
+            elif len(u) == 1:
+                divisors.append((x - u[0], R(r)))
+            else:
+                u1, u0 = u
+                r1, r0 = self._f_mod_u(u1, u0)
+                if t_inv != 0:
+                    v0 = (r1 + u1 * s) * t_inv
+                else:
+                    # v1 = 0, so that v0^2 = r0
+                    v0 = sqrt_Fp2_or_none(r0)
+                    if v0 is None:
+                        divisors.append(None)
+                        continue
+                divisors.append((R([u0, u1, 1]), R([v0, r])))
+        return divisors
+
+
+def _proportional(X, Y):
+    """
+    Whether the vectors X and Y of length 4 are proportional
+    """
+    return all(X[i] * Y[j] == X[j] * Y[i] for i in range(4) for j in range(i + 1, 4))
@@ -4,7 +4,8 @@ from theta_structures.dimension_one import (
     theta_point_to_montgomery_point,
 )
 from theta_structures.couple_point import CouplePoint
-from utilities.fast_sqrt import sqrt_Fp2
+from utilities.batched_inversion import batched_inversion_or_zero
+from utilities.fast_sqrt import batched_sqrt_Fp2
 
 
 class SplitThetaStructure:
@@ -73,19 +74,37 @@ class SplitThetaStructure:
         Given the (X : Z) point on the KummerLine of E compute the point
             ±P = (X : Y : Z) on the curve
         """
-        if Z == 0:
-            return E(0)
-
-        x = X / Z
+        return SplitThetaStructure.lift_points(E, [(X, Z)])[0]
 
+    @staticmethod
+    def lift_points(E, xz):
+        """
+        Lift many (X : Z) points of the KummerLine of E to points ±P on the
+        curve, with a single inversion for all the Z and the square roots
+        computed by batched_sqrt_Fp2
+        """
+        xz = list(xz)
         A = E.a_invariants()[1]
-        y2 = x * (x**2 + A * x + 1)
-        y = sqrt_Fp2(y2)
 
-        return E(x, y)
-
-    def __call__(self, P, lift=True):
-        """ """
+        # Z = 0 gives the point at infinity
+        Z_inv = batched_inversion_or_zero([Z for _, Z in xz])
+        xs = [X * z for (X, _), z in zip(xz, Z_inv)]
+        ys = batched_sqrt_Fp2(
+            [x * (x**2 + A * x + 1) for x, z in zip(xs, Z_inv) if z != 0]
+        )
+
+        points, ys = [], iter(ys)
+        for x, z in zip(xs, Z_inv):
+            if z == 0:
+                points.append(E(0))
+                continue
+            y = next(ys)
+            if y is None:
+                raise ValueError(f"The point with x-coordinate {x} is not on {E}")
+            points.append(E(x, y))
+        return points
+
+    def _montgomery_points(self, P):
         if not isinstance(P, ThetaPoint):
             raise TypeError
 
@@ -93,14 +112,30 @@ class SplitThetaStructure:
         P1, P2 = self.split(P)
 
         # Convert to Montgomery points
-        Q1X, Q1Z = theta_point_to_montgomery_point(self.O1, P1)
-        Q2X, Q2Z = theta_point_to_montgomery_point(self.O2, P2)
+        return (
+            theta_point_to_montgomery_point(self.O1, P1),
+            theta_point_to_montgomery_point(self.O2, P2),
+        )
+
+    def __call__(self, P, lift=True):
+        """ """
+        Q1, Q2 = self._montgomery_points(P)
 
         if lift:
             # lift from the Kummer to the elliptic curve
-            Q1 = self.to_points(self.E1, Q1X, Q1Z)
-            Q2 = self.to_points(self.E2, Q2X, Q2Z)
-
-            return CouplePoint(Q1, Q2)
+            return CouplePoint(self.to_points(self.E1, *Q1), self.to_points(self.E2, *Q2))
         else:
-            return [(Q1X, Q1Z), (Q2X, Q2Z)]
+            return [tuple(Q1), tuple(Q2)]
+
+    def images(self, points, lift=True):
+        """
+        The images of many ThetaPoints, as in __call__, lifting all the
+        points of each curve in one batch
+        """
+        xz = [self._montgomery_points(P) for P in points]
+        if not lift:
+            return [[tuple(Q1), tuple(Q2)] for Q1, Q2 in xz]
+
+        Q1s = self.lift_points(self.E1, [Q1 for Q1, _ in xz])
+        Q2s = self.lift_points(self.E2, [Q2 for _, Q2 in xz])
+        return [CouplePoint(Q1, Q2) for Q1, Q2 in zip(Q1s, Q2s)]
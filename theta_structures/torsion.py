@@ -0,0 +1,158 @@
+from sage.misc.lazy_import import lazy_import
+
+lazy_import("sage.all", ["ZZ", "PolynomialRing"])
+
+from biextensions.biextension import Biextension
+from theta_structures.dimension_two import AffineThetaStructure
+from utilities.order import has_order_D
+
+# ================================================= #
+#   Points of order D and torsion bases on Kummer   #
+#   surfaces in theta coordinates                   #
+# ================================================= #
+
+
+def theta_points(theta, start=0):
+    """
+    Deterministically generate points on the Kummer surface of the
+    ThetaStructure (or AffineThetaStructure) theta.
+
+    For k = start + 1, start + 2, ... we set x = 1, y = i + k, z = y^2 where
+    i generates the base field and yield the theta points (x, y, z, t) for
+    the roots t of the quartic equation of the Kummer surface, which in t
+    reads
+
+        t^4 - (F x^2 + G y^2 + H z^2) t^2 + 2E xyz t
+            + x^4 + y^4 + z^4 - F y^2 z^2 - G x^2 z^2 - H x^2 y^2 = 0
+
+    NOTE: points of the Kummer surface defined over the base field come
+    from the Jacobian or from its quadratic twist.
+    """
+    E, F, G, H = theta.kummer_equation_constants()
+    R = PolynomialRing(theta.base_ring(), name="t")
+
+    one = theta.base_ring().one()
+    gen = theta.base_ring().gen()
+
+    k = start
+    # Try 1000 times then give up, just protection
+    # for infinite loops
+    for _ in range(1000):
+        k += 1
+        x, y = one, gen + k
+        z = y * y
+
+        xx, yy, zz = x * x, y * y, z * z
+        c0 = xx * xx + yy * yy + zz * zz - F * yy * zz - G * xx * zz - H * xx * yy
+        c1 = 2 * E * x * y * z
+        c2 = -(F * xx + G * yy + H * zz)
+        quartic = R([c0, c1, c2, 0, 1])
+
+        for t in quartic.roots(multiplicities=False):
+            yield theta((x, y, z, t))
+
+    raise ValueError(
+        "Generated 1000 candidates, something is probably going wrong somewhere."
+    )
+
+
+def default_cofactor(theta, D):
+    """
+    The cofactor (p + 1) / D, which clears everything but the D-torsion of
+    superspecial abelian surfaces over Fp2 whose group of points is
+    (Z/(p+1)Z)^4, as the ones reached by isogenies from products of
+    supersingular curves
+    """
+    p = theta.base_ring().characteristic()
+    if (p + 1) % D != 0:
+        raise ValueError(
+            f"D = {ZZ(D).factor()} must divide p + 1 = {ZZ(p + 1).factor()}, "
+            "otherwise give the cofactor"
+        )
+    return (p + 1) // D
+
+
+def generate_theta_point_order_D(theta, D, cofactor=None, start=0):
+    """
+    Input:  A ThetaStructure or AffineThetaStructure theta
+            An integer D
+            The cofactor n such that n * P is in the D-torsion for
+            every point P of the Jacobian, (p + 1) / D by default
+    Output: Theta points of order D
+
+    The cofactors are cleared with the theta ladder and the exact order is
+    checked with has_order_D. Checking that D * P is zero as well discards
+    the points coming from the quadratic twist.
+    """
+    D = ZZ(D)
+    if cofactor is None:
+        cofactor = default_cofactor(theta, D)
+    cofactor = ZZ(cofactor)
+
+    for G in theta_points(theta, start=start):
+        P = G * cofactor
+
+        # Check that P has order exactly D
+        if has_order_D(P, D, check_torsion=True):
+            yield P
+
+    raise ValueError("Never found a point P of order D.")
+
+
+def compute_theta_point_order_D(theta, D, cofactor=None, start=0):
+    """
+    Wrapper function around a generator which returns the first
+    point of order D
+    """
+    return generate_theta_point_order_D(
+        theta, D, cofactor=cofactor, start=start
+    ).__next__()
+
+
+def theta_torsion_basis_with_pairing(theta, D, cofactor=None):
+    """
+    Find points P, Q of order D on the Kummer surface of theta with a
+    non degenerate pairing, together with P + Q (up to the sign of Q, which
+    is invisible on the Kummer surface) and the biextension Weil pairing
+    w(P, Q).
+
+    NOTE: level 2 theta coordinates give the square of the Weil pairing,
+    so for even D we check that w(P, Q) has order D / 2.
+    """
+    D = ZZ(D)
+    if D % 2 == 0 and D <= 2:
+        raise ValueError("The pairing of points of order 2 is always trivial in level 2")
+    pairing_order = D if D % 2 else D // 2
+
+    # The biextension arithmetic is done in affine theta coordinates
+    if isinstance(theta, AffineThetaStructure):
+        affine = theta
+    else:
+        affine = AffineThetaStructure.interned(theta.coords())
+
+    Ps = generate_theta_point_order_D(theta, D, cofactor=cofactor)
+    P = next(Ps)
+    for Q in Ps:
+        # normal_add fails in some degenerate cases, e.g. when P + Q and
+        # P - Q share their ratio X_1 / X_0, we then simply try another Q
+        try:
+            PQ = P.normal_add(Q)
+        except ValueError:
+            continue
+
+        # Make sure the points are linearly independent
+        P_aff, Q_aff, PQ_aff = affine(P.coords()), affine(Q.coords()), affine(PQ.coords())
+        pair = Biextension(P_aff, Q_aff, PQ_aff).weil_pairing(D)
+        if has_order_D(pair, pairing_order, multiplicative=True):
+            return P, Q, PQ, pair
+
+    raise ValueError("Never found a point Q linearly independent to P")
+
+
+def theta_torsion_basis(theta, D, cofactor=None):
+    """
+    Wrapper function around theta_torsion_basis_with_pairing which only
+    returns P, Q and P + Q
+    """
+    P, Q, PQ, _ = theta_torsion_basis_with_pairing(theta, D, cofactor=cofactor)
+    return P, Q, PQ
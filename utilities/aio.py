@@ -0,0 +1,308 @@
+"""
+asyncio entry points for the pairings and the isogeny chains. The
+computations run in a managed pool of worker processes, so that they do not
+block the event loop:
+
+    pairing = await apair(P, Q, PQ, n, k=2)
+    phi = await aisogeny(kernel, n)
+    images = await aisogeny(kernel, n, points=[R1, R2])
+
+Concurrent requests are micro-batched: the requests arriving within
+batch_delay seconds (or until max_batch of them) are sent as one task when
+
+- they are pairings of points of the same structure with the same
+  parameters: the structure is decoded once per task and keeps its
+  precomputation in the worker (see theta_structures.interning), and the
+  points travel as raw coordinates as in biextensions.executor;
+- they are isogenies with the same kernel and length: the chain is computed
+  once, and the points of all the requests are evaluated by a single call
+  to EllipticProductIsogeny.images, whose gluing step shares one inversion.
+
+At most max_concurrency tasks are in the pool at a time, the other batches
+wait for a slot. Cancelling a request removes it from its batch; once all
+the requests of a task are cancelled the task is cancelled too, unless a
+worker already started it, in which case its result is dropped.
+"""
+
+import asyncio
+import os
+import pickle
+
+from utilities.serialization import STRUCTURE, decode_header, encode_header
+
+# ============================================= #
+#   Tasks, run in the workers                   #
+# ============================================= #
+
+
+def _pairings_task(header, method, args, data):
+    from biextensions.executor import compute_pairings
+
+    codec, theta, _ = decode_header(header, STRUCTURE)
+    return compute_pairings(codec, theta, method, args, data)
+
+
+def _isogeny_task(kernel_data, data):
+    """
+    Compute the isogeny with the pickled kernel and length, returns the
+    pickled isogeny (when requested) and images of the points
+    """
+    from theta_isogenies.product_isogeny import EllipticProductIsogeny
+
+    kernel, n = pickle.loads(kernel_data)
+    points, want_isogeny = pickle.loads(data)
+    phi = EllipticProductIsogeny(kernel, n)
+    images = phi.images(points) if points else []
+    return pickle.dumps((phi if want_isogeny else None, images))
+
+
+# ============================================= #
+#   Pool                                        #
+# ============================================= #
+
+
+class _Batch:
+    __slots__ = ("prepare", "requests", "timer")
+
+    def __init__(self, prepare):
+        self.prepare = prepare
+        self.requests = []
+        self.timer = None
+
+
+class AsyncWorkerPool:
+    """
+    A pool of `processes` workers (all the cores by default) computing
+    pairings and isogenies for asyncio code, with at most max_concurrency
+    tasks (2 per worker by default) in the pool, see the docstring of the
+    module. context is a multiprocessing context or the name of a start
+    method.
+    """
+
+    def __init__(
+        self, processes=None, max_concurrency=None, max_batch=64, batch_delay=1e-3, context=None
+    ):
+        self.processes = processes or os.cpu_count() or 1
+        self.max_concurrency = max_concurrency or 2 * self.processes
+        self.max_batch = max_batch
+        self.batch_delay = batch_delay
+        self.context = context
+
+        self._executor = None
+        self._semaphore = None
+        self._loop = None
+        self._batches = {}
+        self._tasks = set()
+
+    def __repr__(self):
+        return (
+            f"Async worker pool over {self.processes} processes "
+            f"(max_concurrency={self.max_concurrency}, max_batch={self.max_batch})"
+        )
+
+    def _pool(self):
+        if self._executor is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            context = self.context
+            if context is None or isinstance(context, str):
+                context = multiprocessing.get_context(context)
+            self._executor = ProcessPoolExecutor(self.processes, mp_context=context)
+        return self._executor
+
+    def _slots(self):
+        """
+        The semaphore limiting the tasks in the pool, for the running loop
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    # ----------------------------------------- #
+    #   Batching                                #
+    # ----------------------------------------- #
+
+    def _submit(self, key, payload, prepare):
+        """
+        Add a request to the batch of key, returns its future.
+
+        prepare(payloads) returns (function, args, finish): the task
+        function(*args) is run in a worker and finish(result) gives the
+        list of the results of the requests.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = _Batch(prepare)
+            batch.timer = loop.call_later(self.batch_delay, self._flush, key)
+        batch.requests.append((future, payload))
+        if len(batch.requests) >= self.max_batch:
+            self._flush(key)
+        return future
+
+    def _flush(self, key):
+        batch = self._batches.pop(key, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        requests = [(f, p) for f, p in batch.requests if not f.done()]
+        if requests:
+            task = asyncio.ensure_future(self._run(batch.prepare, requests))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, prepare, requests):
+        async with self._slots():
+            # requests may have been cancelled while waiting for a slot
+            requests = [(f, p) for f, p in requests if not f.done()]
+            if not requests:
+                return
+            futures = [f for f, _ in requests]
+            try:
+                # preparing (e.g. pickling the points) and submitting may
+                # fail too, e.g. with a BrokenProcessPool after a crash
+                function, args, finish = prepare([p for _, p in requests])
+                task = asyncio.get_running_loop().run_in_executor(self._pool(), function, *args)
+
+                def cancel_if_abandoned(_):
+                    if all(f.cancelled() for f in futures):
+                        task.cancel()
+
+                for f in futures:
+                    f.add_done_callback(cancel_if_abandoned)
+
+                results = finish(await task)
+            except asyncio.CancelledError:
+                for f in futures:
+                    f.cancel()
+                return
+            except BaseException as e:
+                for f in futures:
+                    if not f.done():
+                        f.set_exception(e)
+                if not isinstance(e, Exception):
+                    raise
+                return
+
+        for f, result in zip(futures, results):
+            if not f.done():
+                f.set_result(result)
+
+    # ----------------------------------------- #
+    #   Requests                                #
+    # ----------------------------------------- #
+
+    async def pair(self, P, Q, PQ, n, k=1, d=None, weil=False):
+        """
+        The reduced Tate pairing (or the Weil pairing when weil is True) of
+        the Biextension (P, Q, P + Q), see Biextension.tate_pairing
+        """
+        codec, header = encode_header(STRUCTURE, P.parent())
+        data = codec.encode_elements(P.coords() + Q.coords() + PQ.coords())
+        n, d = int(n), None if d is None else int(d)
+        if weil:
+            method, args = "weil_pairing", (n, None, False)
+        else:
+            method, args = "tate_pairing", (n, int(k), d, None, False)
+
+        def prepare(payloads):
+            function_args = (header, method, args, b"".join(payloads))
+
+            def finish(result):
+                return codec.decode_elements(result, 0, len(result) // codec.element_size)
+
+            return _pairings_task, function_args, finish
+
+        return await self._submit(("pairing", header, method, args), data, prepare)
+
+    async def isogeny(self, kernel, n, points=None):
+        """
+        The EllipticProductIsogeny with this kernel and length, or the
+        images of the CouplePoints points by it when they are given
+        """
+        kernel_data = pickle.dumps((tuple(kernel), int(n)))
+        points = None if points is None else list(points)
+
+        def prepare(payloads):
+            want_isogeny = any(p is None for p in payloads)
+            all_points = [P for p in payloads if p is not None for P in p]
+            # pickled in the calling thread, see biextensions.executor
+            data = pickle.dumps((all_points, want_isogeny))
+
+            def finish(result):
+                phi, images = pickle.loads(result)
+                results, i = [], 0
+                for p in payloads:
+                    if p is None:
+                        results.append(phi)
+                    else:
+                        results.append(images[i : i + len(p)])
+                        i += len(p)
+                return results
+
+            return _isogeny_task, (kernel_data, data), finish
+
+        return await self._submit(("isogeny", kernel_data), points, prepare)
+
+    # ----------------------------------------- #
+    #   Shutdown                                #
+    # ----------------------------------------- #
+
+    async def aclose(self):
+        """
+        Send the pending batches, wait for the tasks and shut down the
+        workers
+        """
+        for key in list(self._batches):
+            self._flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.close()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+        return False
+
+
+# ============================================= #
+#   Entry points                                #
+# ============================================= #
+
+_DEFAULT_POOL = None
+
+
+def default_pool():
+    """
+    The pool used by apair and aisogeny when none is given, created on
+    first use
+    """
+    global _DEFAULT_POOL
+    if _DEFAULT_POOL is None:
+        _DEFAULT_POOL = AsyncWorkerPool()
+    return _DEFAULT_POOL
+
+
+async def apair(P, Q, PQ, n, k=1, d=None, weil=False, pool=None):
+    """
+    Awaitable pairing of (P, Q, P + Q), see AsyncWorkerPool.pair
+    """
+    return await (pool or default_pool()).pair(P, Q, PQ, n, k=k, d=d, weil=weil)
+
+
+async def aisogeny(kernel, n, points=None, pool=None):
+    """
+    Awaitable isogeny, or images of points, see AsyncWorkerPool.isogeny
+    """
+    return await (pool or default_pool()).isogeny(kernel, n, points=points)
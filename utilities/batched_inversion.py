@@ -31,3 +31,141 @@ def batched_inversion(*input):
         inverses.append(inverses_multiples[i] * multiples[i - 1])
 
     return inverses
+
+
+def _product_tree(values):
+    """
+    Return the levels of the product tree of values, from the leaves to the
+    root, an odd element at the end of a level is carried up unchanged
+    """
+    levels = [values]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [level[i] * level[i + 1] for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+
+def tree_inversion_or_zero(values):
+    """
+    Given a list of k values, compute their inverses with a product tree
+    using about 3k multiplications and one inversion.
+
+    Zero values are masked by one before building the tree and their
+    inverse is set to zero afterwards, matching invert_or_zero, so that a
+    zero does not poison the whole batch.
+    """
+    values = list(values)
+    if not values:
+        return []
+
+    zeros = [v == 0 for v in values]
+    one = values[0].parent().one()
+    masked = [one if z else v for v, z in zip(values, zeros)]
+
+    levels = _product_tree(masked)
+
+    # Walk back down the tree: the inverse of a child is the inverse of its
+    # parent times its sibling
+    inverses = [1 / levels[-1][0]]
+    for level in reversed(levels[:-1]):
+        children = []
+        for i, inv in enumerate(inverses):
+            if 2 * i + 1 < len(level):
+                left, right = level[2 * i], level[2 * i + 1]
+                children.append(inv * right)
+                children.append(inv * left)
+            else:
+                children.append(inv)
+        inverses = children
+
+    zero = 0 * one
+    return [zero if z else inv for inv, z in zip(inverses, zeros)]
+
+
+def _tree_inversion_or_zero_pickled(data):
+    """
+    Worker for iter_batched_inversion_or_zero, acting on pickled chunks
+    """
+    import pickle
+
+    return pickle.dumps(tree_inversion_or_zero(pickle.loads(data)))
+
+
+def _chunks(values, chunk_size):
+    """
+    Split an iterable into lists of at most chunk_size elements, lazily
+    """
+    chunk = []
+    for v in values:
+        chunk.append(v)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_batched_inversion_or_zero(values, chunk_size=4096, processes=None, pool=None):
+    """
+    Invert the elements of an arbitrary iterable, zeros are sent to zero.
+
+    The input is consumed in chunks of chunk_size elements, each inverted
+    with tree_inversion_or_zero, and the inverses are yielded in order, so
+    that memory stays bounded by the chunk size (times the number of
+    processes) for very large batches. This costs one inversion per chunk.
+
+    When pool is given (a multiprocessing Pool or a concurrent.futures
+    executor, which is left open) the chunks are inverted in parallel on
+    it, `processes` chunks (all the cores by default) at a time. Otherwise,
+    when processes > 1, a pool of worker processes is started for the
+    call; pass a pool to amortise the start-up over many calls.
+
+    NOTE: chunks are pickled in the calling thread, pari elements are not
+    safe to pickle from the pool's feeder thread.
+    """
+    chunks = _chunks(values, chunk_size)
+
+    if pool is None and (processes is None or processes <= 1):
+        for chunk in chunks:
+            yield from tree_inversion_or_zero(chunk)
+        return
+
+    if pool is None:
+        from multiprocessing import Pool
+
+        with Pool(processes) as pool:
+            yield from _pool_inversion_or_zero(chunks, processes, pool)
+        return
+
+    import os
+
+    yield from _pool_inversion_or_zero(chunks, processes or os.cpu_count() or 1, pool)
+
+
+def _pool_inversion_or_zero(chunks, processes, pool):
+    """
+    Invert the chunks on pool, `processes` chunks at a time
+    """
+    import pickle
+
+    while True:
+        window = [pickle.dumps(chunk) for _, chunk in zip(range(processes), chunks)]
+        if not window:
+            break
+        for data in pool.map(_tree_inversion_or_zero_pickled, window):
+            yield from pickle.loads(data)
+
+
+def batched_inversion_or_zero(values, chunk_size=4096, processes=None, pool=None):
+    """
+    Invert the elements of an arbitrary iterable and return a list, zeros
+    are sent to zero, see iter_batched_inversion_or_zero
+    """
+    return list(
+        iter_batched_inversion_or_zero(
+            values, chunk_size=chunk_size, processes=processes, pool=pool
+        )
+    )
@@ -0,0 +1,404 @@
+"""
+Command line front end for batch jobs: pairings of a stream of triples
+(P, Q, P + Q) of theta points, and images of a stream of points by an
+isogeny chain.
+
+    python -m utilities.cli pairings --structure fixtures/kummer_e10_r10000000000000000000000115_seed0.json \\
+        --input triples.jsonl -n 0x10000000000000000000000115 -k 2 --pairing reduced-tate
+    python -m utilities.cli pairings --input triples.bin --output pairings.bin \\
+        -n 0x10000000000000000000000115 --workers 8 --batch-size 256
+    python -m utilities.cli images --isogeny chain.json --input points.jsonl
+
+Formats (elements of GF(p^2) are lists of hex coefficients from the
+constant one, as in utilities.instances):
+
+    structure   a JSON object with p (hex) and the null_point, e.g. an
+                instance file of the fixtures directory, read over
+                GF(p^2) = GF(p)[i] with i^2 = -1; or a STRUCTURE file in
+                the format of utilities.serialization
+    triples     JSON lines [P, Q, PQ] where a point is the list of its
+                coordinates; or a BIEXTENSIONS file of
+                utilities.serialization (e.g. written by a PointStoreWriter),
+                which holds the structure too
+    pairings    JSON lines of elements, or an ELEMENTS file
+    isogeny     a JSON object with p (hex), the a-invariants E1 and E2, the
+                kernel K1, K2 as couple points, and the length n
+    points      JSON lines of couple points, as in utilities.instances
+
+The input and the output are streams, read and written in batches of
+--batch-size. With --workers > 1 the batches are computed by a pool of
+processes, see biextensions.executor. The throughput is printed on stderr
+at the end.
+"""
+
+import argparse
+import json
+import pickle
+import sys
+import time
+
+from sage.misc.lazy_import import lazy_import
+
+lazy_import("sage.all", ["EllipticCurve", "ZZ"])
+
+from biextensions.biextension import Biextension
+from theta_structures.dimension_two import AffineThetaStructure
+from utilities.instances import (
+    decode_couple_point,
+    decode_element,
+    encode_couple_point,
+    encode_element,
+    kummer_field,
+)
+from utilities.serialization import (
+    BIEXTENSIONS,
+    ELEMENTS,
+    MAGIC,
+    decode_biextensions,
+    decode_structure,
+    read_kind,
+)
+
+# ============================================= #
+#   Ladders                                     #
+# ============================================= #
+
+# The exp_function g -> g^n of the pairings, module level functions so that
+# they can be sent to the workers
+
+
+def _ladder(g, n):
+    return g.ladder(n)
+
+
+def _full_ladder_bis(g, n):
+    _, g2 = g.full_ladder_bis(n)
+    return g2
+
+
+def _fast_ladder(g, n):
+    return g.fast_ladder(n)
+
+
+# fast_ladder_bis is the default of Biextension
+LADDERS = {
+    "ladder": _ladder,
+    "full_ladder_bis": _full_ladder_bis,
+    "fast_ladder": _fast_ladder,
+    "fast_ladder_bis": None,
+}
+
+# pairing -> (method of Biextension, whether it takes k and d)
+PAIRINGS = {
+    "tate": ("non_reduced_tate_pairing", False),
+    "even-tate": ("even_non_reduced_tate_pairing", False),
+    "reduced-tate": ("tate_pairing", True),
+    "weil": ("weil_pairing", False),
+}
+
+# ============================================= #
+#   Input                                       #
+# ============================================= #
+
+
+def _open_input(path, binary=False):
+    if path == "-":
+        return sys.stdin.buffer if binary else sys.stdin
+    return open(path, "rb" if binary else "r")
+
+
+def _is_binary(path):
+    if path == "-":
+        return sys.stdin.buffer.peek(len(MAGIC))[: len(MAGIC)] == MAGIC
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def read_structure(path):
+    """
+    The affine structure described by the file at path
+    """
+    if _is_binary(path):
+        with open(path, "rb") as f:
+            theta = decode_structure(f.read())
+        if isinstance(theta, AffineThetaStructure):
+            return theta
+        return theta.to_affine().codomain()
+
+    with open(path) as f:
+        data = json.load(f)
+    F = kummer_field(ZZ(int(data["p"], 16)))
+    return AffineThetaStructure.interned(tuple(decode_element(F, c) for c in data["null_point"]))
+
+
+def _json_lines(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_triples(path, theta=None):
+    """
+    The structure and an iterator over the triples (P, Q, P + Q), or
+    Biextension elements, of the input at path. theta is needed for JSON
+    input
+    """
+    if _is_binary(path):
+        if path != "-":
+            from utilities.point_store import PointStore
+
+            store = PointStore(path)
+            if store.kind != BIEXTENSIONS:
+                raise ValueError(f"{path} is not a file of biextension elements")
+            return store.theta(), iter(store)
+        data = sys.stdin.buffer.read()
+        if read_kind(data) != BIEXTENSIONS:
+            raise ValueError("The input is not a file of biextension elements")
+        return decode_biextensions(data)
+
+    if theta is None:
+        raise ValueError("A --structure is needed for JSON lines input")
+    F, point = theta.base_ring(), theta._point
+
+    def triples():
+        with _open_input(path) as f:
+            for line in _json_lines(f):
+                yield tuple(
+                    point(theta, tuple(decode_element(F, c) for c in P)) for P in line
+                )
+
+    return theta, triples()
+
+
+def _batched(iterable, size):
+    batch = []
+    for x in iterable:
+        batch.append(x)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ============================================= #
+#   Output                                      #
+# ============================================= #
+
+
+class _JSONLinesWriter:
+    def __init__(self, path, encode):
+        self._file = sys.stdout if path == "-" else open(path, "w")
+        self._encode = encode
+
+    def append(self, x):
+        self._file.write(json.dumps(self._encode(x)))
+        self._file.write("\n")
+
+    def close(self):
+        if self._file is sys.stdout:
+            self._file.flush()
+        else:
+            self._file.close()
+
+
+def _pairings_writer(path, binary, field):
+    if not binary:
+        return _JSONLinesWriter(path, encode_element)
+    if path == "-":
+        raise ValueError("Binary output needs an --output file")
+    from utilities.point_store import PointStoreWriter
+
+    return PointStoreWriter(path, kind=ELEMENTS, field=field)
+
+
+def _report(count, what, elapsed, args):
+    print(
+        f"{count} {what} in {elapsed:.3f}s ({count / elapsed if elapsed else 0:.1f}/s, "
+        f"{args.workers} workers, batch size {args.batch_size})",
+        file=sys.stderr,
+    )
+
+
+# ============================================= #
+#   Pairings                                    #
+# ============================================= #
+
+
+def _pairing_arguments(args):
+    method, reduced = PAIRINGS[args.pairing]
+    n = ZZ(int(args.n, 0))
+    exp_function = LADDERS[args.ladder]
+    if reduced:
+        d = None if args.d is None else ZZ(int(args.d, 0))
+        return method, (n, args.k, d, exp_function, args.check)
+    return method, (n, exp_function, args.check)
+
+
+def run_pairings(args):
+    theta = read_structure(args.structure) if args.structure else None
+    theta, triples = read_triples(args.input, theta)
+    method, arguments = _pairing_arguments(args)
+    out = _pairings_writer(args.output, args.output_format == "binary", theta.base_ring())
+
+    count = 0
+    t0 = time.perf_counter()
+    try:
+        if args.workers > 1:
+            from biextensions.executor import PairingExecutor
+
+            with PairingExecutor(theta, processes=args.workers, chunk_size=args.batch_size) as executor:
+                for x in executor.imap(method, triples, *arguments):
+                    out.append(x)
+                    count += 1
+        else:
+            for batch in _batched(triples, args.batch_size):
+                for x in batch:
+                    g = x if isinstance(x, Biextension) else Biextension(*x)
+                    out.append(getattr(g, method)(*arguments))
+                count += len(batch)
+    finally:
+        out.close()
+    _report(count, "pairings", time.perf_counter() - t0, args)
+
+
+# ============================================= #
+#   Isogeny images                              #
+# ============================================= #
+
+# The isogeny of the worker, set by _initialize_isogeny (or by run_images
+# without workers)
+_ISOGENY = None
+
+
+def build_isogeny(description, sqrt=False):
+    """
+    The EllipticProductIsogeny (or EllipticProductIsogenySqrt) described by
+    the JSON object description
+    """
+    F = kummer_field(ZZ(int(description["p"], 16)))
+    E1 = EllipticCurve(F, [decode_element(F, a) for a in description["E1"]])
+    E2 = EllipticCurve(F, [decode_element(F, a) for a in description["E2"]])
+    kernel = [decode_couple_point(E1, E2, description[K]) for K in ("K1", "K2")]
+    if sqrt:
+        from theta_isogenies.product_isogeny_sqrt import EllipticProductIsogenySqrt
+
+        return EllipticProductIsogenySqrt(kernel, description["n"])
+    from theta_isogenies.product_isogeny import EllipticProductIsogeny
+
+    return EllipticProductIsogeny(kernel, description["n"])
+
+
+def _initialize_isogeny(data):
+    """
+    Initializer of the pool: the isogeny built and pickled by run_images
+    """
+    global _ISOGENY
+    _ISOGENY = pickle.loads(data)
+
+
+def _images_batch(points):
+    """
+    The encoded images of a batch of encoded couple points, by the isogeny
+    of the process
+    """
+    phi = _ISOGENY
+    E1, E2 = phi.domain()
+    images = phi.images([decode_couple_point(E1, E2, P) for P in points])
+    return [encode_couple_point(P) for P in images]
+
+
+def run_images(args):
+    global _ISOGENY
+    with open(args.isogeny) as f:
+        description = json.load(f)
+    # built here once: a worker failing in the initializer would be
+    # replaced forever by the pool
+    try:
+        phi = build_isogeny(description, args.sqrt)
+    except Exception as error:
+        raise SystemExit(f"Cannot build the isogeny described in {args.isogeny}: {error!r}") from error
+    out = _JSONLinesWriter(args.output, lambda x: x)
+
+    count = 0
+    t0 = time.perf_counter()
+    with _open_input(args.input) as f:
+        batches = _batched(_json_lines(f), args.batch_size)
+        try:
+            if args.workers > 1:
+                import multiprocessing
+
+                # the batches are plain JSON data, safe to send from any
+                # thread, and the isogeny is pickled here
+                with multiprocessing.get_context().Pool(
+                    args.workers,
+                    initializer=_initialize_isogeny,
+                    initargs=(pickle.dumps(phi),),
+                ) as pool:
+                    for images in pool.imap(_images_batch, batches):
+                        for P in images:
+                            out.append(P)
+                        count += len(images)
+            else:
+                _ISOGENY = phi
+                for batch in batches:
+                    for P in _images_batch(batch):
+                        out.append(P)
+                    count += len(batch)
+        finally:
+            out.close()
+    _report(count, "images", time.perf_counter() - t0, args)
+
+
+# ============================================= #
+#   Command line                                #
+# ============================================= #
+
+
+def parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m utilities.cli",
+        description="Batch pairings and isogeny images",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def common(command):
+        command.add_argument("--input", default="-", help="input file, - for stdin")
+        command.add_argument("--output", default="-", help="output file, - for stdout")
+        command.add_argument("--workers", type=int, default=1, help="number of processes")
+        command.add_argument("--batch-size", type=int, default=64)
+
+    pairings = commands.add_parser("pairings", help="pairings of triples (P, Q, P + Q)")
+    common(pairings)
+    pairings.add_argument("--structure", help="structure of JSON lines input")
+    pairings.add_argument("-n", required=True, help="order of Q (0x for hex)")
+    pairings.add_argument("-k", type=int, default=1, help="embedding degree")
+    pairings.add_argument("-d", help="exponent of the final exponentiation")
+    pairings.add_argument("--pairing", choices=list(PAIRINGS), default="reduced-tate")
+    pairings.add_argument("--ladder", choices=list(LADDERS), default="fast_ladder_bis")
+    pairings.add_argument("--output-format", choices=["jsonl", "binary"], default="jsonl")
+    pairings.add_argument("--check", action="store_true", help="check Q is n-torsion")
+    pairings.set_defaults(run=run_pairings)
+
+    images = commands.add_parser("images", help="images of points by an isogeny chain")
+    common(images)
+    images.add_argument("--isogeny", required=True, help="JSON description of the chain")
+    images.add_argument("--sqrt", action="store_true", help="use EllipticProductIsogenySqrt")
+    images.set_defaults(run=run_images)
+
+    return parser
+
+
+def main(argv=None):
+    command_line = parser()
+    args = command_line.parse_args(argv)
+    if args.batch_size < 1:
+        command_line.error("the batch size must be positive")
+    if args.command == "pairings" and args.pairing == "even-tate" and int(args.n, 0) % 2:
+        command_line.error("the even Tate pairing needs an even order -n")
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
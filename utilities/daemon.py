@@ -0,0 +1,711 @@
+"""
+A long running local server for pairings and isogeny images, so that short
+lived clients do not re-import Sage and rebuild the same structures.
+
+The server keeps warm state: the structures (interned, with their
+arithmetic precomputation), the prepared fixed Q pairings (the point Q, the
+exponent of the final exponentiation and the kind of pairing) and the
+isogeny chains. Clients register these once, get back a handle, then send
+requests against it over a Unix domain socket:
+
+    $ python -m utilities.daemon /tmp/pairings.sock
+
+    with PairingClient("/tmp/pairings.sock") as client:
+        h = client.register_pairing(Q, r, k=2)
+        pairings = client.pairings(h, [(P1, P1Q), (P2, P2Q)])
+        phi = client.register_isogeny((K1, K2), n)
+        images = client.images(phi, [R1, R2])
+        print(client.stats())
+
+Registering the same data again (e.g. from a new client) gives the same
+handle, without recomputing anything.
+
+Frames are length prefixed, the field elements are in the format of
+utilities.serialization:
+
+    request     length (u32), op (u8), request id (u32), payload
+    response    length (u32), status (u8, 0 or 1 on error), request id
+                (u32), payload or the error message
+
+    op                  payload                         response
+    REGISTER_PAIRING    weil (u8), k (u8), length of n  handle (u32)
+                        (u16), n, then Q as a POINTS
+                        record
+    PAIR                handle (u32), the coordinates   the pairings
+                        of P and P + Q for each pair
+    REGISTER_ISOGENY    n (u32), the field header, the  handle (u32), the
+                        a-invariants of E1 and E2, the  a-invariants of the
+                        (projective) coordinates of     codomain
+                        the kernel K1, K2 in E1 x E2
+    IMAGES              handle (u32), the coordinates   the coordinates of
+                        of the CouplePoints             the images
+    STATS               (empty)                         JSON
+    SHUTDOWN            (empty)                         (empty)
+
+Requests are batched: the server waits batch_delay seconds after the first
+request of a batch, then takes all the queued requests (at most max_batch)
+and serves the PAIR requests of a same handle together, and the IMAGES
+requests of a same handle with a single call to
+EllipticProductIsogeny.images, which shares the inversion of the gluing
+step. The computations run in the thread of the event loop: the requests
+which arrive meanwhile are queued in the socket buffers and form the next
+batch.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import stat
+import struct
+import time
+from collections import deque
+
+from sage.misc.lazy_import import lazy_import
+
+lazy_import("sage.all", ["EllipticCurve", "ZZ"])
+
+from biextensions.biextension import Biextension
+from theta_structures.couple_point import CouplePoint
+from utilities.serialization import (
+    POINTS,
+    FieldCodec,
+    decode_header,
+    encode_header,
+    field_codec,
+)
+
+# Operations
+REGISTER_PAIRING = 1
+PAIR = 2
+REGISTER_ISOGENY = 3
+IMAGES = 4
+STATS = 5
+SHUTDOWN = 6
+
+_OP_NAMES = {
+    REGISTER_PAIRING: "register_pairing",
+    PAIR: "pair",
+    REGISTER_ISOGENY: "register_isogeny",
+    IMAGES: "images",
+    STATS: "stats",
+    SHUTDOWN: "shutdown",
+}
+
+OK = 0
+ERROR = 1
+
+_FRAME = struct.Struct(">IBI")
+
+
+def _frame(code, request_id, payload=b""):
+    # the length counts the code and the request id
+    return _FRAME.pack(len(payload) + 5, code, request_id) + payload
+
+
+# ============================================= #
+#   Encoding of elliptic curves and points      #
+# ============================================= #
+
+
+def _couple_elements(P):
+    """
+    The 6 projective coordinates of the CouplePoint P = (P1, P2)
+    """
+    P1, P2 = P.points()
+    return list(P1) + list(P2)
+
+
+def _couples_from_elements(curves, elements):
+    E1, E2 = curves
+    return [
+        CouplePoint(E1(elements[i : i + 3]), E2(elements[i + 3 : i + 6]))
+        for i in range(0, len(elements), 6)
+    ]
+
+
+def _curves_from_elements(F, elements):
+    return EllipticCurve(F, elements[:5]), EllipticCurve(F, elements[5:10])
+
+
+def _is_socket(path):
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+# ============================================= #
+#   Statistics                                  #
+# ============================================= #
+
+
+class ServerStats:
+    """
+    Counters of the requests and batches, and the queue wait and latency
+    of the last `window` requests of each operation
+    """
+
+    def __init__(self, window=1024):
+        self.window = window
+        self.started = time.monotonic()
+        self.requests = {}
+        self.errors = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.max_batch_size = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self._latencies = {}
+        self._waits = {}
+
+    def queued(self):
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+    def batch(self, size):
+        self.queue_depth -= size
+        self.batches += 1
+        self.batched_requests += size
+        self.max_batch_size = max(self.max_batch_size, size)
+
+    def served(self, op, wait, latency):
+        name = _OP_NAMES.get(op, str(op))
+        self.requests[name] = self.requests.get(name, 0) + 1
+        self._waits.setdefault(name, deque(maxlen=self.window)).append(wait)
+        self._latencies.setdefault(name, deque(maxlen=self.window)).append(latency)
+
+    @staticmethod
+    def _summary(values):
+        values = sorted(values)
+        n = len(values)
+        return {
+            "mean": sum(values) / n,
+            "p50": values[n // 2],
+            "p95": values[min(n - 1, (95 * n) // 100)],
+            "p99": values[min(n - 1, (99 * n) // 100)],
+            "max": values[-1],
+        }
+
+    def report(self):
+        """
+        The statistics as a dictionary, times in seconds
+        """
+        return {
+            "uptime": time.monotonic() - self.started,
+            "requests": dict(self.requests),
+            "errors": self.errors,
+            "batches": self.batches,
+            "mean_batch_size": self.batched_requests / self.batches if self.batches else 0,
+            "max_batch_size": self.max_batch_size,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "queue_wait": {k: self._summary(v) for k, v in self._waits.items()},
+            "latency": {k: self._summary(v) for k, v in self._latencies.items()},
+        }
+
+
+# ============================================= #
+#   Server                                      #
+# ============================================= #
+
+
+class _PreparedPairing:
+    """
+    The warm state of a fixed Q pairing
+    """
+
+    def __init__(self, codec, theta, Q, n, k, weil):
+        self.codec = codec
+        self.theta = theta
+        self.Q = Q
+        self.n = n
+        self.weil = weil
+        p = theta.base_ring().characteristic()
+        # the final exponentiation, computed once
+        self.k = k
+        self.d = None if weil else (p**k - 1) // n
+        theta._arithmetic_precomputation()
+
+    def pairings(self, data):
+        codec, theta = self.codec, self.theta
+        m = len(theta.coords())
+        coords = codec.decode_elements(data, 0, len(data) // codec.element_size)
+        if len(coords) % (2 * m):
+            raise ValueError("Truncated pairs")
+        point, Q, n = theta._point, self.Q, self.n
+        pairings = []
+        for i in range(0, len(coords), 2 * m):
+            P = point(theta, tuple(coords[i : i + m]))
+            PQ = point(theta, tuple(coords[i + m : i + 2 * m]))
+            g = Biextension(P, Q, PQ)
+            if self.weil:
+                pairings.append(g.weil_pairing(n))
+            else:
+                pairings.append(g.tate_pairing(n, k=self.k, d=self.d))
+        return pairings
+
+
+class PairingServer:
+    """
+    Serve the pairings and isogeny images over the Unix socket at path,
+    see the docstring of the module
+    """
+
+    def __init__(self, path, max_batch=256, batch_delay=1e-3, window=1024):
+        self.path = path
+        self.max_batch = max_batch
+        self.batch_delay = batch_delay
+        self.stats = ServerStats(window)
+
+        self._handles = {}
+        self._states = []
+        self._queue = None
+        self._done = None
+
+    def __repr__(self):
+        return f"Pairing server at {self.path} with {len(self._states)} handles"
+
+    # ----------------------------------------- #
+    #   Warm state                              #
+    # ----------------------------------------- #
+
+    def _handle(self, payload, build):
+        """
+        The handle of the state registered with payload, built on first use
+        """
+        handle = self._handles.get(payload)
+        if handle is None:
+            handle = len(self._states)
+            self._states.append(build(payload))
+            self._handles[payload] = handle
+        return handle
+
+    def _state(self, handle, cls):
+        if handle >= len(self._states) or not isinstance(self._states[handle][0], cls):
+            raise ValueError(f"Unknown handle {handle}")
+        return self._states[handle]
+
+    @staticmethod
+    def _build_pairing(payload):
+        weil, k, length = struct.unpack_from(">BBH", payload)
+        n = ZZ(int.from_bytes(payload[4 : 4 + length], "big"))
+        data = payload[4 + length :]
+        codec, theta, offset = decode_header(data, POINTS)
+        (count,) = struct.unpack_from(">I", data, offset)
+        if count != 1:
+            raise ValueError("Expected a single point Q")
+        Q = theta._point(theta, tuple(codec.decode_elements(data, offset + 4, len(theta.coords()))))
+        return (_PreparedPairing(codec, theta, Q, n, k, bool(weil)), b"")
+
+    @staticmethod
+    def _build_isogeny(payload):
+        from theta_isogenies.product_isogeny import EllipticProductIsogeny
+
+        (n,) = struct.unpack_from(">I", payload)
+        codec, offset = FieldCodec.from_header(payload, 4)
+        elements = codec.decode_elements(payload, offset, 22)
+        curves = _curves_from_elements(codec.field, elements[:10])
+        kernel = _couples_from_elements(curves, elements[10:])
+        phi = EllipticProductIsogeny(kernel, n)
+        E3, E4 = phi.codomain()
+        codomain = codec.encode_elements(list(E3.a_invariants()) + list(E4.a_invariants()))
+        return (phi, codomain)
+
+    # ----------------------------------------- #
+    #   Requests                                #
+    # ----------------------------------------- #
+
+    def _register(self, request, build):
+        handle = self._handle(bytes(request[2]), build)
+        self._respond(request, struct.pack(">I", handle) + self._states[handle][1])
+
+    def _pairs(self, handle, requests):
+        prepared, _ = self._state(handle, _PreparedPairing)
+        codec = prepared.codec
+        for request in requests:
+            try:
+                pairings = prepared.pairings(request[2][4:])
+            except Exception as e:
+                self._fail(request, e)
+                continue
+            self._respond(request, codec.encode_elements(pairings))
+
+    def _images(self, handle, requests):
+        from theta_isogenies.product_isogeny import EllipticProductIsogeny
+
+        phi, _ = self._state(handle, EllipticProductIsogeny)
+        codec = field_codec(phi.E1.base_field())
+        # a malformed request only fails itself, not the requests batched
+        # with it
+        valid = []
+        for request in requests:
+            data = request[2]
+            try:
+                if (len(data) - 4) % (6 * codec.element_size):
+                    raise ValueError("Truncated points")
+                elements = codec.decode_elements(data, 4, (len(data) - 4) // codec.element_size)
+                valid.append((request, _couples_from_elements(phi.domain(), elements)))
+            except Exception as e:
+                self._fail(request, e)
+
+        # all the points of the batch share the gluing step
+        try:
+            images = phi.images([P for _, points in valid for P in points])
+        except Exception:
+            # find the failing requests
+            for request, points in valid:
+                try:
+                    self._respond(request, self._encode_images(codec, phi.images(points)))
+                except Exception as e:
+                    self._fail(request, e)
+            return
+
+        i = 0
+        for request, points in valid:
+            self._respond(request, self._encode_images(codec, images[i : i + len(points)]))
+            i += len(points)
+
+    @staticmethod
+    def _encode_images(codec, images):
+        return codec.encode_elements(c for P in images for c in _couple_elements(P))
+
+    def _respond(self, request, payload, code=OK):
+        op, request_id, _, writer, t0, t1 = request
+        writer.write(_frame(code, request_id, payload))
+        now = time.monotonic()
+        self.stats.served(op, t1 - t0, now - t0)
+
+    def _fail(self, request, error):
+        self.stats.errors += 1
+        self._respond(request, f"{type(error).__name__}: {error}".encode(), ERROR)
+
+    def _process(self, batch):
+        """
+        Serve a batch of requests, grouping the PAIR and IMAGES requests by
+        handle
+        """
+        t1 = time.monotonic()
+        batch = [request[:5] + (t1,) for request in batch]
+        groups = {}
+        for request in batch:
+            op, payload = request[0], request[2]
+            try:
+                if op == REGISTER_PAIRING:
+                    self._register(request, self._build_pairing)
+                elif op == REGISTER_ISOGENY:
+                    self._register(request, self._build_isogeny)
+                elif op in (PAIR, IMAGES):
+                    (handle,) = struct.unpack_from(">I", payload)
+                    groups.setdefault((op, handle), []).append(request)
+                else:
+                    raise ValueError(f"Unknown operation {op}")
+            except Exception as e:
+                self._fail(request, e)
+
+        for (op, handle), requests in groups.items():
+            try:
+                if op == PAIR:
+                    self._pairs(handle, requests)
+                else:
+                    self._images(handle, requests)
+            except Exception as e:
+                for request in requests:
+                    self._fail(request, e)
+
+    # ----------------------------------------- #
+    #   Event loop                              #
+    # ----------------------------------------- #
+
+    async def _read(self, reader, writer):
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(_FRAME.size)
+                except asyncio.IncompleteReadError:
+                    break
+                length, op, request_id = _FRAME.unpack(header)
+                payload = await reader.readexactly(length - 5)
+                t0 = time.monotonic()
+                if op == STATS:
+                    report = json.dumps(self.stats.report()).encode()
+                    writer.write(_frame(OK, request_id, report))
+                elif op == SHUTDOWN:
+                    writer.write(_frame(OK, request_id))
+                    await writer.drain()
+                    self._done.set()
+                    break
+                else:
+                    self.stats.queued()
+                    self._queue.put_nowait((op, request_id, payload, writer, t0))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # the server is shutting down
+            pass
+        finally:
+            writer.close()
+
+    async def _consume(self):
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            # let the concurrent requests arrive
+            await asyncio.sleep(self.batch_delay)
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+            self.stats.batch(len(batch))
+            self._process(batch)
+
+    def _bind(self):
+        """
+        The listening socket at path, only accessible by the user. A stale
+        socket left at path is replaced, anything else is an error
+        """
+        if os.path.lexists(self.path):
+            if not _is_socket(self.path):
+                raise FileExistsError(f"{self.path} exists and is not a socket")
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except ConnectionRefusedError:
+                os.remove(self.path)
+            else:
+                raise FileExistsError(f"A server is already listening at {self.path}")
+            finally:
+                probe.close()
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # bind under a restrictive umask, so that the socket is never
+        # accessible by the other users
+        umask = os.umask(0o177)
+        try:
+            sock.bind(self.path)
+        except BaseException:
+            sock.close()
+            raise
+        finally:
+            os.umask(umask)
+        return sock
+
+    async def serve(self):
+        """
+        Serve until a SHUTDOWN request
+        """
+        self._queue = asyncio.Queue()
+        self._done = asyncio.Event()
+        server = await asyncio.start_unix_server(self._read, sock=self._bind())
+        consumer = asyncio.ensure_future(self._consume())
+        try:
+            async with server:
+                await self._done.wait()
+        finally:
+            consumer.cancel()
+            if _is_socket(self.path):
+                os.remove(self.path)
+
+    def run(self):
+        asyncio.run(self.serve())
+
+
+def serve(path, **kwargs):
+    """
+    Run a PairingServer at path until a SHUTDOWN request
+    """
+    PairingServer(path, **kwargs).run()
+
+
+# ============================================= #
+#   Client                                      #
+# ============================================= #
+
+
+class ServerError(Exception):
+    """
+    An error raised by the server while serving a request
+    """
+
+
+class PairingClient:
+    """
+    A blocking client of a PairingServer. Requests can be pipelined with
+    send and receive, the other methods send a request and wait for its
+    response.
+    """
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # the server may still be starting
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._socket.connect(path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+        self._file = self._socket.makefile("rb")
+        self._next_id = 0
+        self._responses = {}
+        # handle -> (codec, structure or domain curves, codomain curves)
+        self._pairings = {}
+        self._isogenies = {}
+
+    def __repr__(self):
+        return f"Pairing client of {self.path}"
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    # ----------------------------------------- #
+    #   Frames                                  #
+    # ----------------------------------------- #
+
+    def send(self, op, payload=b""):
+        """
+        Send a request, returns its id
+        """
+        request_id = self._next_id
+        self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+        self._socket.sendall(_frame(op, request_id, payload))
+        return request_id
+
+    def receive(self, request_id):
+        """
+        The payload of the response to the request, raises ServerError if it
+        failed
+        """
+        while request_id not in self._responses:
+            header = self._file.read(_FRAME.size)
+            if len(header) < _FRAME.size:
+                raise ConnectionError("The server closed the connection")
+            length, code, i = _FRAME.unpack(header)
+            self._responses[i] = (code, self._file.read(length - 5))
+        code, payload = self._responses.pop(request_id)
+        if code != OK:
+            raise ServerError(payload.decode())
+        return payload
+
+    def request(self, op, payload=b""):
+        return self.receive(self.send(op, payload))
+
+    # ----------------------------------------- #
+    #   Pairings                                #
+    # ----------------------------------------- #
+
+    def register_pairing(self, Q, n, k=1, weil=False):
+        """
+        Prepare the reduced Tate pairings (or the Weil pairings when weil is
+        True) with the fixed point Q, returns its handle
+        """
+        theta = Q.parent()
+        codec, header = encode_header(POINTS, theta)
+        n = ZZ(n)
+        n_bytes = int(n).to_bytes((n.nbits() + 7) // 8, "big")
+        payload = b"".join(
+            [
+                struct.pack(">BBH", int(weil), k, len(n_bytes)),
+                n_bytes,
+                header,
+                struct.pack(">I", 1),
+                codec.encode_elements(Q.coords()),
+            ]
+        )
+        (handle,) = struct.unpack(">I", self.request(REGISTER_PAIRING, payload))
+        self._pairings[handle] = (codec, theta)
+        return handle
+
+    def send_pairings(self, handle, pairs):
+        """
+        Send the pairings of the pairs (P, P + Q), returns the request id
+        """
+        codec, _ = self._pairings[handle]
+        coords = [c for P, PQ in pairs for c in P.coords() + PQ.coords()]
+        return self.send(PAIR, struct.pack(">I", handle) + codec.encode_elements(coords))
+
+    def receive_pairings(self, handle, request_id):
+        codec, _ = self._pairings[handle]
+        data = self.receive(request_id)
+        return codec.decode_elements(data, 0, len(data) // codec.element_size)
+
+    def pairings(self, handle, pairs):
+        """
+        The pairings with Q of the points P, given by the pairs (P, P + Q)
+        """
+        return self.receive_pairings(handle, self.send_pairings(handle, pairs))
+
+    def pair(self, handle, P, PQ):
+        return self.pairings(handle, [(P, PQ)])[0]
+
+    # ----------------------------------------- #
+    #   Isogenies                               #
+    # ----------------------------------------- #
+
+    def register_isogeny(self, kernel, n):
+        """
+        Build the EllipticProductIsogeny with this kernel and length on the
+        server, returns its handle
+        """
+        K1, K2 = kernel
+        E1, E2 = K1.curves()
+        codec = field_codec(E1.base_field())
+        elements = list(E1.a_invariants()) + list(E2.a_invariants())
+        elements += _couple_elements(K1) + _couple_elements(K2)
+        payload = struct.pack(">I", n) + codec.header() + codec.encode_elements(elements)
+        data = self.request(REGISTER_ISOGENY, payload)
+        (handle,) = struct.unpack_from(">I", data)
+        codomain = _curves_from_elements(codec.field, codec.decode_elements(data, 4, 10))
+        self._isogenies[handle] = (codec, codomain)
+        return handle
+
+    def send_images(self, handle, points):
+        codec, _ = self._isogenies[handle]
+        elements = [c for P in points for c in _couple_elements(P)]
+        return self.send(IMAGES, struct.pack(">I", handle) + codec.encode_elements(elements))
+
+    def receive_images(self, handle, request_id):
+        codec, codomain = self._isogenies[handle]
+        data = self.receive(request_id)
+        elements = codec.decode_elements(data, 0, len(data) // codec.element_size)
+        return _couples_from_elements(codomain, elements)
+
+    def images(self, handle, points):
+        """
+        The images of the CouplePoints by the isogeny
+        """
+        return self.receive_images(handle, self.send_images(handle, points))
+
+    # ----------------------------------------- #
+    #   Server                                  #
+    # ----------------------------------------- #
+
+    def stats(self):
+        """
+        The queue and latency statistics of the server, see ServerStats
+        """
+        return json.loads(self.request(STATS))
+
+    def shutdown(self):
+        self.request(SHUTDOWN)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve pairings and isogeny images")
+    parser.add_argument("path", help="path of the Unix socket")
+    parser.add_argument("--max-batch", type=int, default=256)
+    parser.add_argument("--batch-delay", type=float, default=1e-3)
+    args = parser.parse_args()
+    serve(args.path, max_batch=args.max_batch, batch_delay=args.batch_delay)
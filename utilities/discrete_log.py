@@ -1,16 +1,19 @@
 # Sage imports
-from sage.all import ZZ
+from sage.misc.cachefunc import cached_function
+from sage.misc.lazy_import import lazy_import
 
-# import pari for fast dlog
-import cypari2
+lazy_import("sage.all", ["ZZ", "CRT_list", "isqrt"])
+
+# import pari for fast dlog, the instance shared with SageMath is only
+# created on first use
+lazy_import("sage.libs.pari", "pari")
+
+from utilities.strategy import optimised_strategy_old
 
 # ===================================== #
 #  Fast DLP solving using Weil pairing  #
 # ===================================== #
 
-# Make instance of Pari
-pari = cypari2.Pari()
-
 
 def discrete_log_pari(a, base, order):
     """
@@ -157,7 +160,343 @@ def windowed_pohlig_hellman(a, base, e, window):
     return dlog
 
 
-def BiDLP(R, P, Q, D, ePQ=None):
+@cached_function
+def factored_order(order):
+    """
+    The factorisation of order as a tuple of pairs (l, e), computed only
+    once for each order
+    """
+    return tuple((ZZ(l), ZZ(e)) for l, e in ZZ(order).factor())
+
+
+def _baby_steps_table(base, n):
+    """
+    Helper function for baby_step_giant_step: for m = ceil(sqrt(n)),
+    the dictionary of the baby steps base^j for 0 <= j < m and the
+    giant step base^(-m)
+    """
+    m = isqrt(n - 1) + 1
+    baby_steps = {}
+    g = base**0
+    for j in range(m):
+        baby_steps.setdefault(g, j)
+        g = g * base
+    return m, baby_steps, base ** (-m)
+
+
+def baby_step_giant_step(a, base, n, table=None):
+    """
+    Solve the discrete log a = base^x for an element
+    base of order n with O(sqrt(n)) multiplications.
+
+    The baby steps only depend on base, and can be
+    given as table (from _baby_steps_table) when solving
+    many discrete logs in the same base.
+    """
+    if table is None:
+        table = _baby_steps_table(base, n)
+    m, baby_steps, giant = table
+
+    for i in range(m):
+        j = baby_steps.get(a)
+        if j is not None:
+            return i * m + j
+        a = a * giant
+
+    raise ValueError(f"{a} is not a power of the base {base}")
+
+
+def prime_power_pohlig_hellman(a, base, l, e, window=None, bsgs_bound=2**32):
+    """
+    Solve the discrete log for a = base^x for
+    elements base,a of order l^e using the
+    Pohlig-Hellman algorithm, computing in
+    windows l^w.
+
+    Each digit is the discrete log in the subgroup
+    of order l^w, solved with baby-step giant-step
+    (or Pari for large primes, giving it the
+    factorisation of the order).
+    """
+    l, e = ZZ(l), ZZ(e)
+    if window is None:
+        # Windows of about 8 bits, so baby-step giant-step
+        # uses about 16 steps
+        window = max(1, ZZ(2**8).exact_log(l))
+    w = min(window, e)
+    step = l**w
+
+    # When the window is not a divisor of e, the last
+    # digit is smaller
+    e_div_w, e_rem = divmod(e, w)
+    n = e_div_w + (1 if e_rem else 0)
+
+    # Compute base^(l^(w*i)) for i in (0, ..., n-1)
+    baby_steps = _precompute_baby_steps(base, step, n - 1)
+
+    # For both widths, the generator of the subgroup of order
+    # l^width and its baby steps table, computed once
+    subgroups = {}
+
+    dlog = 0
+    for i in range(n):
+        width = w if i < e_div_w else e_rem
+        if width not in subgroups:
+            s = base ** (l ** (e - width))
+            table = None
+            if l**width <= bsgs_bound:
+                table = _baby_steps_table(s, l**width)
+            subgroups[width] = (s, table)
+        s, table = subgroups[width]
+
+        # Work in the subgroup of order l^width
+        ri = a ** (l ** (e - w * i - width))
+        if table is None:
+            order = pari([l**width, pari.matrix(1, 2, [l, width])])
+            alpha_i = ZZ(pari.fflog(ri, s, order))
+        else:
+            alpha_i = baby_step_giant_step(ri, s, l**width, table=table)
+
+        # Update a value and dlog computation
+        if alpha_i:
+            a /= baby_steps[i] ** alpha_i
+            dlog += alpha_i * step**i
+
+    return dlog
+
+
+def _prime_power_pohlig_hellman_pickled(data):
+    """
+    Helper for pohlig_hellman: worker processes receive and
+    return pickled data
+    """
+    import pickle
+
+    args = pickle.loads(data)
+    return prime_power_pohlig_hellman(*args)
+
+
+def pohlig_hellman(a, base, order, window=None, bsgs_bound=2**32, processes=None):
+    """
+    Solve the discrete log for a = base^x for an
+    element base of smooth order D, solving the
+    discrete log for each prime power l^e dividing
+    D with prime_power_pohlig_hellman and
+    recombining with CRT.
+
+    The factorisation of D is cached by factored_order, so
+    we never pay for Pari factoring the order on each call.
+
+    When processes > 1, the prime power pieces are solved in
+    parallel by a pool of worker processes. Starting the pool costs
+    tens of milliseconds, so this only pays off for large pieces.
+
+    NOTE: for small orders (say below 2^20) the overhead of Python
+    makes discrete_log_pari faster, this is meant for large smooth
+    orders such as 2^e * 3^f.
+
+    NOTE: the tasks are pickled in the calling thread, pari elements
+    are not safe to pickle from the pool's feeder thread.
+    """
+    order = ZZ(order)
+
+    tasks, moduli = [], []
+    for l, e in factored_order(order):
+        l_e = l**e
+        cofactor = order // l_e
+        tasks.append((a**cofactor, base**cofactor, l, e, window, bsgs_bound))
+        moduli.append(l_e)
+
+    if processes is None or processes <= 1 or len(tasks) == 1:
+        residues = [prime_power_pohlig_hellman(*task) for task in tasks]
+    else:
+        import pickle
+        from multiprocessing import Pool
+
+        data = [pickle.dumps(task) for task in tasks]
+        with Pool(min(processes, len(tasks))) as pool:
+            residues = pool.map(_prime_power_pohlig_hellman_pickled, data)
+
+    if len(residues) == 1:
+        return residues[0]
+    return CRT_list(residues, moduli)
+
+
+class PrimePowerDLP:
+    """
+    Discrete logarithms a = base^x for a fixed base of order l^e, with
+    tables computed once so that each new logarithm costs little more
+    than the powerings by l^w.
+
+    Writing x in base l^w, the digit x_i is recovered from a lookup of
+
+        (a * base^-(x_0 + ... + x_(i-1) l^(w(i-1))))^(l^(e - w(i+1)))
+
+    in the table of the subgroup of order l^w. The powers of a by l^(wk)
+    needed along the way are computed following an optimal strategy, as for
+    the kernels of an isogeny chain: "doublings" are powerings by l^w and
+    "images" are the corrections by base^(-x_i l^t), which are stored.
+
+    When w does not divide e, the most significant digit has the remaining
+    r = e - w(n - 1) bits.
+    """
+
+    def __init__(self, base, l, e, window=None, strategy=None):
+        l, e = ZZ(l), ZZ(e)
+        if window is None:
+            # Smallest window such that the lookup table has about e entries
+            window = max(1, ZZ(e).exact_log(l))
+        w = min(window, e)
+
+        self.base = base
+        self.l = l
+        self.e = e
+        self.w = w
+
+        # Number of digits, the last one has r <= w digits in base l
+        self.n = (e + w - 1) // w
+        self.r = e - w * (self.n - 1)
+
+        # The first n - 1 digits are found by the strategy on a^(l^r)
+        if strategy is None:
+            strategy = []
+            if self.n > 1:
+                strategy = optimised_strategy_old(self.n - 1, mul_c=w * self._power_cost(l))
+        self.strategy = strategy
+
+        self.l_w = l**w
+        self.l_r = l**self.r
+        self.last_shift = l ** (w - self.r)
+
+        # Lookup table for the subgroup of order l^w generated by
+        # h = base^(l^(e-w))
+        h = base ** (l ** (e - w))
+        self.table = {}
+        hk = h**0
+        for k in range(self.l_w):
+            self.table[hk] = k
+            hk = hk * h
+
+        # corrections[t][d] = base^(-d l^t) for the shifts t which appear,
+        # that is w*i for a and r + w*i for the powers of a^(l^r)
+        shifts = set(range(0, e, w)) | set(range(self.r, e, w))
+        g_inv = base ** (-1)
+        self.corrections = {}
+        for t in range(e):
+            if t in shifts:
+                row = [g_inv**0]
+                for _ in range(1, self.l_w):
+                    row.append(row[-1] * g_inv)
+                self.corrections[t] = row
+            g_inv = g_inv**l
+
+    @staticmethod
+    def _power_cost(l):
+        """
+        Number of multiplications to compute x^l by square and multiply
+        """
+        return l.nbits() - 1 + sum(l.bits()) - 1
+
+    def _lookup(self, a):
+        try:
+            return self.table[a]
+        except KeyError:
+            raise ValueError(f"{a} is not a power of the base {self.base}")
+
+    def discrete_log(self, a):
+        """
+        Compute x in [0, l^e) such that a = base^x
+        """
+        l_w, w, n, r = self.l_w, self.w, self.n, self.r
+        corrections = self.corrections
+
+        dlog = 0
+        if n > 1:
+            # Bookkeeping for optimal strategy, shifts[k] is the power of
+            # l such that elements[k] = a'^(l^shifts[k]) for the current a'
+            strat_idx = 0
+            level = [0]
+            elements = [a**self.l_r]
+            shifts = [r]
+
+            for i in range(n - 1):
+                prev = sum(level)
+                elt = elements[-1]
+
+                while prev != (n - 2 - i):
+                    level.append(self.strategy[strat_idx])
+
+                    # Raise to the power l^(w * strategy[strat_idx])
+                    elt = elt ** (l_w ** self.strategy[strat_idx])
+
+                    elements.append(elt)
+                    shifts.append(shifts[-1] + w * self.strategy[strat_idx])
+                    prev += self.strategy[strat_idx]
+                    strat_idx += 1
+
+                # elt is now in the subgroup of order l^w
+                d = self._lookup(elt)
+                elements.pop()
+                level.pop()
+                shifts.pop()
+
+                # Remove base^(d l^(wi)) from a and all stored powers
+                if d:
+                    dlog += d * l_w**i
+                    a = a * corrections[w * i][d]
+                    elements = [
+                        elt * corrections[w * i + s][d]
+                        for elt, s in zip(elements, shifts)
+                    ]
+
+        # The last digit has r digits in base l
+        k = self._lookup(a)
+        dlog += (k // self.last_shift) * l_w ** (n - 1)
+        return dlog
+
+    def __call__(self, a):
+        return self.discrete_log(a)
+
+
+class PreparedDLP:
+    """
+    Discrete logarithms a = base^x for a fixed base of smooth order D.
+    Precomputes a PrimePowerDLP for each prime power l^e dividing D,
+    logarithms are then solved with Pohlig-Hellman and recombined with CRT.
+
+    Useful when many logarithms are computed in the same base, as in
+    compression where all pairings are compared with e(P, Q).
+    """
+
+    def __init__(self, base, order, window=None):
+        self.base = base
+        self.order = ZZ(order)
+
+        self._factors = []
+        for l, e in self.order.factor():
+            l_e = l**e
+            cofactor = self.order // l_e
+            dlp = PrimePowerDLP(base**cofactor, l, e, window=window)
+            self._factors.append((l_e, cofactor, dlp))
+
+    def discrete_log(self, a):
+        """
+        Compute x in [0, D) such that a = base^x
+        """
+        if len(self._factors) == 1:
+            return self._factors[0][2].discrete_log(a)
+
+        residues, moduli = [], []
+        for l_e, cofactor, dlp in self._factors:
+            residues.append(dlp.discrete_log(a**cofactor))
+            moduli.append(l_e)
+        return CRT_list(residues, moduli)
+
+    def __call__(self, a):
+        return self.discrete_log(a)
+
+
+def BiDLP(R, P, Q, D, ePQ=None, dlp=None):
     """
     Given a basis P,Q of E[D] finds
     a,b such that R = [a]P + [b]Q.
@@ -168,7 +507,14 @@ def BiDLP(R, P, Q, D, ePQ=None):
     Optional: include the pairing e(P,Q) which can be precomputed
     which is helpful when running multiple BiDLP problems with P,Q
     as input. This happens, for example, during compression.
+    Even better, include a PreparedDLP with base e(P,Q) to reuse
+    its tables for the discrete logarithms.
     """
+    if dlp is not None:
+        pair_a = weil_pairing_pari(R, Q, D)
+        pair_b = weil_pairing_pari(R, -P, D)
+        return dlp.discrete_log(pair_a), dlp.discrete_log(pair_b)
+
     # e(P,Q)
     if ePQ:
         pair_PQ = ePQ
@@ -189,7 +535,7 @@ def BiDLP(R, P, Q, D, ePQ=None):
     return a, b
 
 
-def BiDLP_power_two(R, P, Q, e, window, ePQ=None):
+def BiDLP_power_two(R, P, Q, e, window, ePQ=None, dlp=None):
     r"""
     Same as the above, but uses optimisations using that
     D = 2^e.
@@ -208,17 +554,15 @@ def BiDLP_power_two(R, P, Q, e, window, ePQ=None):
     Finally, as the Tate pairing produces elements in \mu_n
     we also have fast inversion from conjugation, but SageMath
     has slow conjugation, so this doesn't help for now.
+
+    When many BiDLPs share the basis P, Q, pass a PreparedDLP
+    with base e(P,Q) and order 2^e as dlp: its tables are reused
+    and window is then ignored.
     """
     p = R.curve().base_ring().characteristic()
     D = 2**e
     exp = (p**2 - 1) // D
 
-    # e(P,Q)
-    if ePQ:
-        pair_PQ = ePQ
-    else:
-        pair_PQ = tate_pairing_pari(P, Q, D) ** exp
-
     # Write R = aP + bQ for unknown a,b
     # e(R, Q) = e(P, Q)^a
     pair_a = tate_pairing_pari(Q, -R, D) ** exp
@@ -226,6 +570,15 @@ def BiDLP_power_two(R, P, Q, e, window, ePQ=None):
     # e(R,-P) = e(P, Q)^b
     pair_b = tate_pairing_pari(P, R, D) ** exp
 
+    if dlp is not None:
+        return dlp.discrete_log(pair_a), dlp.discrete_log(pair_b)
+
+    # e(P,Q)
+    if ePQ:
+        pair_PQ = ePQ
+    else:
+        pair_PQ = tate_pairing_pari(P, Q, D) ** exp
+
     # Now solve the dlog in Fq
     a = windowed_pohlig_hellman(pair_a, pair_PQ, e, window)
     b = windowed_pohlig_hellman(pair_b, pair_PQ, e, window)
@@ -233,7 +586,7 @@ def BiDLP_power_two(R, P, Q, e, window, ePQ=None):
     return a, b
 
 
-def DLP_power_two(R, P, Q, e, window, ePQ=None, first=True):
+def DLP_power_two(R, P, Q, e, window, ePQ=None, first=True, dlp=None):
     r"""
     This is the same as BiDLP but it only returns either a or b
     depending on whether first is true or false.
@@ -244,18 +597,18 @@ def DLP_power_two(R, P, Q, e, window, ePQ=None, first=True):
     D = 2**e
     exp = (p**2 - 1) // D
 
+    if first:
+        pair = tate_pairing_pari(Q, -R, D) ** exp
+    else:
+        pair = tate_pairing_pari(P, R, D) ** exp
+
+    if dlp is not None:
+        return dlp.discrete_log(pair)
+
     # e(P,Q)
     if ePQ:
         pair_PQ = ePQ
     else:
         pair_PQ = tate_pairing_pari(P, Q, D) ** exp
 
-    if first:
-        pair_a = tate_pairing_pari(Q, -R, D) ** exp
-        x = windowed_pohlig_hellman(pair_a, pair_PQ, e, window)
-
-    else:
-        pair_b = tate_pairing_pari(P, R, D) ** exp
-        x = windowed_pohlig_hellman(pair_b, pair_PQ, e, window)
-
-    return x
+    return windowed_pohlig_hellman(pair, pair_PQ, e, window)
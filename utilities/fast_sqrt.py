@@ -1,3 +1,27 @@
+"""
+Square roots in Fp and Fp2.
+
+For p = 3 mod 4 and Fp2 = Fp[i], i^2 = -1, a square root costs two
+exponentiations in Fp, with the Legendre checks folded in (see
+_sqrt_Fp2_coords), and no inversion. A single exponentiation is not
+possible with these formulas: the second one raises (x0 + alpha)/2 where
+alpha is the square root of the norm, the output of the first.
+
+Exponentiations of different elements can not be shared either: x -> x^k
+is a homomorphism, so raising a product only gives the product of the
+roots. batched_sqrt_Fp2 thus shares the lookup of the constants of the
+field, and the callers share the inversions around the roots, as in
+SplitThetaStructure.lift_points and MumfordThetaConversion.
+"""
+
+from functools import lru_cache
+
+from utilities.tonelli_shanks import (
+    normalise_root,
+    tonelli_shanks_or_none,
+    tonelli_shanks_table,
+)
+
 # ============================================ #
 #     Fast square root and quadratic roots     #
 # ============================================ #
@@ -26,16 +50,79 @@ def invert_or_zero(x):
     return 1 / x
 
 
-def sqrt_Fp(x):
+@lru_cache(maxsize=None)
+def _sqrt_constants(F):
     """
-    Faster computation of sqrt in Fp assuming p = 3 mod 4
+    Constants for square roots in F = Fp or Fp2 when p = 3 mod 4:
+    the exponents (p + 1)/4 and (p - 3)/4 and the inverse of 2 in Fp.
+    Cached on the parent field, as F.prime_subfield() is not cheap.
+
+    Returns None when the formulas below do not apply, that is when
+    p = 1 mod 4 or F has degree larger than 2.
+
+    NOTE: the exponentiations themselves are left to the native (GMP)
+    modular powering, which already uses a sliding window chain.
+    """
+    p = F.characteristic()
+    if p % 4 != 3 or F.degree() > 2:
+        return None
+    return (p + 1) // 4, (p - 3) // 4, 1 / F.prime_subfield()(2)
+
+
+@lru_cache(maxsize=None)
+def _sqrt_engine(F):
     """
-    p = x.parent().characteristic()
-    exp = (p + 1) // 4
+    Return the function x -> sqrt(x) or None used for elements of F: the
+    p = 3 mod 4 formulas when they apply, and Tonelli-Shanks with cached
+    tables for any other field of odd characteristic
+    """
+    constants = _sqrt_constants(F)
+    if constants is None:
+        table = tonelli_shanks_table(F)
+
+        def engine(x):
+            return tonelli_shanks_or_none(x, table)
+
+    elif F.degree() == 1:
+        exp = constants[0]
+
+        def engine(x):
+            return _sqrt_Fp(x, exp)
+
+    elif F.gen() ** 2 == -1:
+
+        def engine(x):
+            x0, x1 = x.list()
+            root = _sqrt_Fp2_coords(x0, x1, *constants)
+            if root is None:
+                return None
+            return F(list(root))
 
+    else:
+        # Fp2 = Fp[g] for some other modulus: we work in the basis (1, i)
+        # for a fixed square root i = u + v*g of -1
+        i = normalise_root(F["x"]([1, 0, 1]).roots(multiplicities=False)[0])
+        u, v = i.list()
+        u_v, v_inv = u / v, 1 / v
+
+        def engine(x):
+            a, b = x.list()
+            root = _sqrt_Fp2_coords(a - b * u_v, b * v_inv, *constants)
+            if root is None:
+                return None
+            y0, y1 = root
+            return F([y0 + y1 * u, y1 * v])
+
+    return engine
+
+
+def _sqrt_Fp(x, exp):
+    """
+    Square-root of x in Fp, p = 3 mod 4, or None when x is not a square
+    """
     r = x**exp
     if r * r != x:
-        return 0
+        return None
 
     # To ensure the result matches
     # Rust
@@ -44,40 +131,121 @@ def sqrt_Fp(x):
     return r
 
 
-def sqrt_Fp2(x, canonical=False):
+def sqrt_Fp(x):
     """
-    Fast computation of square-roots in SageMath using that p = 3 mod 4
+    Faster computation of sqrt in Fp, using that p = 3 mod 4 when possible
+    and Tonelli-Shanks otherwise. Non-squares give 0.
+    """
+    r = _sqrt_engine(x.parent())(x)
+    if r is None:
+        return 0
+    return r
+
+
+def _sqrt_Fp2_coords(x0, x1, exp, exp_inv, inv_two):
+    """
+    Square-root (y0, y1) of x = x0 + i*x1 in Fp2 = Fp[i]/(i^2 + 1),
+    p = 3 mod 4, or None when x is not a square, given the constants of
+    _sqrt_constants.
+
+    Writing x = x0 + i*x1, the Legendre symbol of x is the one of its norm
+    x0^2 + x1^2 in Fp, so the check is folded into the computation of the
+    square root alpha of the norm. Then one exponentiation of
+    delta = (x0 + alpha)/2 gives at once its quadratic character, its square
+    root and the inverse of the square root, so we never call is_square()
+    and never invert.
+
+    Cost: 2 exponentiations in Fp (1 when x is in Fp)
     """
-    F = x.parent()
-    x0, x1 = x.list()
 
     if x1 == 0:
-        lx0 = x0.is_square()
-        if lx0:
-            y0 = sqrt_Fp(x0)
-            root = F([y0, 0])
-            if canonical:
-                return canonical_root(root)
-            return root
-
-        else:
-            y1 = sqrt_Fp(-x0)
-            root = F([0, y1])
-            if canonical:
-                return canonical_root(root)
-            return root
-
-    delta = x0**2 + x1**2
-    sqrt_delta = sqrt_Fp(delta)
-
-    y02 = (x0 + sqrt_delta) / 2
-    if not y02.is_square():
-        y02 -= sqrt_delta
-
-    y0 = sqrt_Fp(y02)
-    y1 = x1 / (y0 + y0)
-    root = F([y0, y1])
+        # every element of Fp is a square in Fp2: either x0 or -x0
+        # is a square in Fp, as -1 is not
+        r = x0**exp
+        rr = r * r
+        if int(r) % 2 != 0:
+            r = -r
+        if rr == x0:
+            return r, x1
+        return x1, r
+
+    norm = x0**2 + x1**2
+    alpha = norm**exp
+    if alpha * alpha != norm:
+        return None
+    if int(alpha) % 2 != 0:
+        alpha = -alpha
+
+    # delta * t^2 = ±1 according to delta being a square
+    delta = (x0 + alpha) * inv_two
+    t = delta**exp_inv
+    y = delta * t
+
+    if y * t == 1:
+        # y = sqrt(delta), 1/y = t
+        y0 = y
+        y1 = x1 * t * inv_two
+    else:
+        # (x0 - alpha)/2 = -x1^2/(4*delta) is a square
+        # and y = sqrt(-delta)
+        y0 = -x1 * t * inv_two
+        y1 = y
 
-    if canonical:
+    # To ensure the result matches
+    # Rust
+    if int(y0) % 2 != 0:
+        y0, y1 = -y0, -y1
+    return y0, y1
+
+
+def sqrt_Fp2_or_none(x, canonical=False):
+    """
+    Fast computation of square-roots in SageMath using that p = 3 mod 4
+    (Tonelli-Shanks for other fields), returns None when x is not a square
+    """
+    root = _sqrt_engine(x.parent())(x)
+    if canonical and root is not None:
         return canonical_root(root)
     return root
+
+
+def sqrt_Fp2(x, canonical=False):
+    """
+    Fast computation of square-roots in SageMath using that p = 3 mod 4
+    (Tonelli-Shanks for other fields).
+
+    Raises a ValueError when x is not a square, where older versions
+    silently returned a wrong value; use sqrt_Fp2_or_none to test for
+    squares.
+    """
+    root = sqrt_Fp2_or_none(x, canonical=canonical)
+    if root is None:
+        raise ValueError(f"{x} is not a square")
+    return root
+
+
+def batched_sqrt_Fp2(values, canonical=False):
+    """
+    Square-roots of many elements of the same field, None for the
+    non-squares. The constants of the field are looked up once, and the
+    elements of Fp2 = Fp[i] go through _sqrt_Fp2_coords directly.
+    """
+    values = list(values)
+    if not values:
+        return []
+
+    F = values[0].parent()
+    constants = _sqrt_constants(F)
+    if constants is None or F.degree() == 1 or F.gen() ** 2 != -1:
+        engine = _sqrt_engine(F)
+        roots = [engine(x) for x in values]
+    else:
+        roots = []
+        for x in values:
+            x0, x1 = x.list()
+            root = _sqrt_Fp2_coords(x0, x1, *constants)
+            roots.append(None if root is None else F(list(root)))
+
+    if canonical:
+        return [None if r is None else canonical_root(r) for r in roots]
+    return roots
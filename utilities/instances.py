@@ -0,0 +1,257 @@
+"""
+Reproducible instances for the tests and the benchmarks: a Kummer surface
+obtained by gluing a product of supersingular elliptic curves, together with
+points on the product, as computed by generate_kummer in tests.py.
+
+Generating an instance (finding p, torsion bases, Velu isogenies, points of
+order r) takes much longer than reloading it, so instances are generated
+from a seed once and cached as JSON files: the fixtures directory of the
+repository holds the instances of the tests and the benchmarks, and the
+other ones are saved in a user cache directory, see kummer_instance. Only
+the data needed to rebuild them is stored: p and the exponents, the curves,
+the kernel of the gluing isogeny and the points. The theta null point of
+the codomain is stored as well, and checked when reloading.
+"""
+
+import json
+import os
+
+from sage.misc.lazy_import import lazy_import
+
+lazy_import("sage.all", ["EllipticCurve", "GF", "ZZ", "set_random_seed"])
+
+from theta_structures.couple_point import CouplePoint
+from theta_isogenies.gluing_isogeny import GluingThetaIsogeny
+from utilities.discrete_log import discrete_log_pari
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fixtures")
+
+# Bump when the format or the generation changes, older files are then
+# regenerated
+VERSION = 1
+
+# ============================================= #
+#   Encoding of field elements and points       #
+# ============================================= #
+
+
+def encode_element(x):
+    return [hex(c) for c in x.list()]
+
+
+def decode_element(F, x):
+    return F([int(c, 16) for c in x])
+
+
+def encode_point(P):
+    if P.is_zero():
+        return None
+    return [encode_element(P[0]), encode_element(P[1])]
+
+
+def decode_point(E, P):
+    if P is None:
+        return E(0)
+    F = E.base_ring()
+    return E(decode_element(F, P[0]), decode_element(F, P[1]))
+
+
+def encode_couple_point(P):
+    return [encode_point(Pi) for Pi in P.points()]
+
+
+def decode_couple_point(E1, E2, P):
+    return CouplePoint(decode_point(E1, P[0]), decode_point(E2, P[1]))
+
+
+# ============================================= #
+#   Generation                                  #
+# ============================================= #
+
+
+def kummer_field(p):
+    """
+    The field GF(p^2) = GF(p)[i] with i^2 = -1 of the instances
+    """
+    return GF(p**2, name="i", modulus=[1, 0, 1])
+
+
+def kummer_prime(e, r):
+    """
+    The smallest prime p = 2^e * 3^2 * r * f - 1, returns p and f
+    """
+    f = 1
+    while not (2**e * 3**2 * r * f - 1).is_prime():
+        f += 1
+    return 2**e * 3**2 * r * f - 1, f
+
+
+def _order_r_point(E, cofactor):
+    """
+    A point of order r on the supersingular curve E, where cofactor is
+    (p + 1) / r with r prime
+    """
+    while True:
+        P = cofactor * E.random_point()
+        if not P.is_zero():
+            return P
+
+
+def _torsion_basis(E, r, cofactor):
+    """
+    A basis of the r-torsion of E, with r prime
+    """
+    P = _order_r_point(E, cofactor)
+    Q = _order_r_point(E, cofactor)
+    while P.weil_pairing(Q, r) == 1:
+        Q = _order_r_point(E, cofactor)
+    return P, Q
+
+
+def generate_kummer_instance(e, r, seed=0, even=False):
+    """
+    Generate the data of an instance from a seed, see generate_kummer and
+    generate_kummer_even in tests.py: a gluing isogeny phi: E1 x E2 -> K,
+    where E1 and E2 are 3-isogenous to E0: y^2 = x^3 + x, two points P, Q of
+    E1 x E2 of order r (or of order 4r above the kernel of phi when even is
+    True) and a random point R.
+    """
+    e, r = ZZ(e), ZZ(r)
+    set_random_seed(seed)
+    p, f = kummer_prime(e, r)
+
+    F = kummer_field(p)
+    E0 = EllipticCurve(F, [1, 0])
+
+    # generate E x E' from E0, for a little randomization
+    P0, Q0 = E0.torsion_basis(2**e)
+    P3, Q3 = E0.torsion_basis(3)
+    phi1, phi2 = E0.isogeny(P3), E0.isogeny(Q3)
+    E1, E2 = phi1.codomain(), phi2.codomain()
+    P1, Q1 = phi1(P0), phi1(Q0)
+    P2, Q2 = phi2(P0), phi2(Q0)
+
+    # find the isotropic kernel subgroup generated by K8_1, K8_2: it will be
+    # the kernel of a gluing isogeny E x E' -> K
+    isotropic_factor = -discrete_log_pari(
+        P2.weil_pairing(Q2, 2**e), P1.weil_pairing(Q1, 2**e), 2**e
+    )
+    K8_1 = (2 ** (e - 3)) * CouplePoint(isotropic_factor * P1, P2)
+    K8_2 = (2 ** (e - 3)) * CouplePoint(Q1, Q2)
+
+    # a basis of the r-torsion of E x E', and a random point
+    cofactor = (p + 1) // r
+    P1_r, Q1_r = _torsion_basis(E1, r, cofactor)
+    P2_r, Q2_r = _torsion_basis(E2, r, cofactor)
+    P, Q = CouplePoint(P1_r, P2_r), CouplePoint(Q1_r, Q2_r)
+    if even:
+        P, Q = P + K8_1 * 2, Q + K8_2 * 2
+    R = CouplePoint(E1.random_point(), E2.random_point())
+
+    null_point = GluingThetaIsogeny(K8_1, K8_2).codomain().coords()
+
+    return {
+        "version": VERSION,
+        "seed": seed,
+        "even": even,
+        "p": hex(p),
+        "e": int(e),
+        "r": hex(r),
+        "f": int(f),
+        "E1": [encode_element(F(a)) for a in E1.a_invariants()],
+        "E2": [encode_element(F(a)) for a in E2.a_invariants()],
+        "K8_1": encode_couple_point(K8_1),
+        "K8_2": encode_couple_point(K8_2),
+        "P": encode_couple_point(P),
+        "Q": encode_couple_point(Q),
+        "R": encode_couple_point(R),
+        "null_point": [encode_element(c) for c in null_point],
+    }
+
+
+def load_kummer_instance(data):
+    """
+    Rebuild an instance from its data, returns the same tuple as
+    generate_kummer in tests.py:
+
+        Kum_proj, Kum, phi, P, Q, R, p, e, r, f
+    """
+    p, r = ZZ(int(data["p"], 16)), ZZ(int(data["r"], 16))
+    e, f = ZZ(data["e"]), ZZ(data["f"])
+
+    F = kummer_field(p)
+    E1 = EllipticCurve(F, [decode_element(F, a) for a in data["E1"]])
+    E2 = EllipticCurve(F, [decode_element(F, a) for a in data["E2"]])
+    K8_1, K8_2, P, Q, R = (
+        decode_couple_point(E1, E2, data[k]) for k in ("K8_1", "K8_2", "P", "Q", "R")
+    )
+
+    phi = GluingThetaIsogeny(K8_1, K8_2)
+    Kum_proj = phi.codomain()
+    if Kum_proj.coords() != tuple(decode_element(F, c) for c in data["null_point"]):
+        raise ValueError("The gluing isogeny does not give the stored null point")
+    Kum = Kum_proj.to_affine().codomain()
+
+    return Kum_proj, Kum, phi, P, Q, R, p, e, r, f
+
+
+def fixture_name(e, r, seed=0, even=False):
+    """
+    The name of the file of an instance, which determines it (r itself is
+    in the name: two primes of the same size give two files)
+    """
+    return f"kummer{'_even' if even else ''}_e{e}_r{ZZ(r):x}_seed{seed}.json"
+
+
+def cache_directory():
+    """
+    The directory where the generated instances are saved:
+    $THETA_PAIRINGS_CACHE, or theta-pairings in the user cache directory
+    """
+    directory = os.environ.get("THETA_PAIRINGS_CACHE")
+    if directory:
+        return directory
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache, "theta-pairings")
+
+
+def _read_instance(path, r):
+    if not os.path.exists(path):
+        return None
+    with open(path) as fh:
+        data = json.load(fh)
+    # regenerate stale files
+    if data.get("version") != VERSION or int(data["r"], 16) != r:
+        return None
+    return data
+
+
+def kummer_instance(e, r, seed=0, even=False, directory=FIXTURES, cache=None):
+    """
+    The instance generated by generate_kummer_instance(e, r, seed, even).
+
+    It is loaded from the fixtures directory of the repository, which is
+    only read, or else from the cache directory (cache_directory() by
+    default), where it is saved the first time. With directory=None the
+    fixtures are not read, and with cache=False nothing is read from or
+    written to the cache.
+    """
+    name = fixture_name(e, r, seed=seed, even=even)
+    r = ZZ(r)
+
+    for d in (directory, None if cache is False else cache or cache_directory()):
+        data = _read_instance(os.path.join(d, name), r) if d else None
+        if data is not None:
+            return load_kummer_instance(data)
+
+    data = generate_kummer_instance(e, r, seed=seed, even=even)
+    if cache is not False:
+        cache = cache or cache_directory()
+        os.makedirs(cache, exist_ok=True)
+        # write then rename, so that concurrent runs never read a partial file
+        path = os.path.join(cache, name)
+        with open(f"{path}.{os.getpid()}", "w") as fh:
+            json.dump(data, fh, indent=1)
+        os.replace(f"{path}.{os.getpid()}", path)
+
+    return load_kummer_instance(data)
@@ -0,0 +1,166 @@
+# ================================================ #
+#     Compiled linear maps on coordinate tuples    #
+# ================================================ #
+
+
+class CompiledLinearMap:
+    """
+    A matrix N, square or rectangular, compiled once for repeated
+    application to coordinate tuples, computing N * (x, y, z, t) in column
+    convention.
+
+    At construction the entries are inspected and the map is specialised:
+
+    - "signed_permutation": N is square and every row has one entry equal to
+      ±1, in distinct columns, so the image is a permutation of the
+      coordinates up to sign (e.g. Translations by 2-torsion points), no
+      multiplications.
+    - "unit": every entry lies in {0, ±1, ±i} with i^2 = -1 (e.g. Hadamard
+      like changes and the splitting matrices), only additions, negations and
+      at most one multiplication by i per row.
+    - "general": the entries are flattened into a tuple, so that we never call
+      Matrix.__getitem__ when applying the map.
+    """
+
+    def __init__(self, N):
+        self._matrix = N
+        self._nrows = N.nrows()
+        self._ncols = N.ncols()
+        self._flat = tuple(N.list())
+
+        # A square root of -1 found among the entries, if any
+        self._unit = None
+
+        rows = [
+            self._flat[r * self._ncols : (r + 1) * self._ncols]
+            for r in range(self._nrows)
+        ]
+        plans = [self._compile_row(row) for row in rows]
+
+        if any(plan is None for plan in plans):
+            self._kind = "general"
+            self._plans = None
+        elif self._is_signed_permutation(plans):
+            self._kind = "signed_permutation"
+            self._plans = tuple(
+                (plus[0], True) if plus else (minus[0], False)
+                for plus, minus, _, _ in plans
+            )
+        else:
+            self._kind = "unit"
+            self._plans = tuple(plans)
+
+        if self._kind == "signed_permutation":
+            self._apply = self._apply_signed_permutation
+        elif self._kind == "unit":
+            self._apply = self._apply_unit
+        elif self._nrows == 4 and self._ncols == 4:
+            self._apply = self._apply_general_4x4
+        else:
+            self._apply = self._apply_general
+
+    def _is_signed_permutation(self, plans):
+        """
+        Whether the rows have a single entry ±1 each, in distinct columns of
+        a square matrix
+        """
+        if self._nrows != self._ncols:
+            return False
+        columns = set()
+        for plus, minus, plus_i, minus_i in plans:
+            if len(plus) + len(minus) != 1 or plus_i or minus_i:
+                return False
+            columns.update(plus + minus)
+        return len(columns) == self._nrows
+
+    def _compile_row(self, row):
+        """
+        Split the indices of a row according to the entry being 1, -1, i or
+        -i. Returns None if some entry is outside {0, ±1, ±i}.
+        """
+        plus, minus, plus_i, minus_i = [], [], [], []
+        for j, e in enumerate(row):
+            if e == 0:
+                continue
+            if e == 1:
+                plus.append(j)
+            elif e == -1:
+                minus.append(j)
+            elif e * e == -1:
+                if self._unit is None:
+                    self._unit = e
+                if e == self._unit:
+                    plus_i.append(j)
+                else:
+                    minus_i.append(j)
+            else:
+                return None
+        return tuple(plus), tuple(minus), tuple(plus_i), tuple(minus_i)
+
+    def matrix(self):
+        """
+        Return the matrix this map was compiled from
+        """
+        return self._matrix
+
+    def kind(self):
+        """
+        Return the detected structure of the matrix: "signed_permutation",
+        "unit" or "general"
+        """
+        return self._kind
+
+    def __repr__(self):
+        return f"Compiled {self._kind} linear map of size {self._nrows}x{self._ncols}"
+
+    def __call__(self, coords):
+        """
+        Apply the map to a tuple of coordinates and return a tuple
+        """
+        return self._apply(coords)
+
+    def _apply_signed_permutation(self, coords):
+        return tuple(coords[j] if positive else -coords[j] for j, positive in self._plans)
+
+    @staticmethod
+    def _signed_sum(coords, plus, minus):
+        """
+        Return sum(coords[plus]) - sum(coords[minus]) or None when both are
+        empty
+        """
+        s = None
+        for j in plus:
+            s = coords[j] if s is None else s + coords[j]
+        for j in minus:
+            s = -coords[j] if s is None else s - coords[j]
+        return s
+
+    def _apply_unit(self, coords):
+        image = []
+        for plus, minus, plus_i, minus_i in self._plans:
+            real = self._signed_sum(coords, plus, minus)
+            imag = self._signed_sum(coords, plus_i, minus_i)
+            if imag is not None:
+                imag = self._unit * imag
+                real = imag if real is None else real + imag
+            if real is None:
+                real = 0 * coords[0]
+            image.append(real)
+        return tuple(image)
+
+    def _apply_general_4x4(self, coords):
+        n00, n01, n02, n03, n10, n11, n12, n13, n20, n21, n22, n23, n30, n31, n32, n33 = self._flat
+        x, y, z, t = coords
+        X = n00 * x + n01 * y + n02 * z + n03 * t
+        Y = n10 * x + n11 * y + n12 * z + n13 * t
+        Z = n20 * x + n21 * y + n22 * z + n23 * t
+        T = n30 * x + n31 * y + n32 * z + n33 * t
+        return (X, Y, Z, T)
+
+    def _apply_general(self, coords):
+        flat, ncols = self._flat, self._ncols
+        return tuple(
+            sum(flat[r * ncols + j] * coords[j] for j in range(ncols))
+            for r in range(self._nrows)
+        )
+
@@ -0,0 +1,223 @@
+"""
+File backed stores of theta points, biextension elements or field elements
+(e.g. pairings) for batches which do not fit in memory as Sage objects.
+
+A store is a file in the format of utilities.serialization: a header with
+the field and the structure, a count, then fixed width records. It is read
+through a memory map, so only the records which are accessed are read from
+disk, and decoded on demand:
+
+    with PointStore.create("points.bin", theta) as out:
+        out.extend(points)
+
+    with PointStore("points.bin") as store:
+        for batch in store.batches(1024):
+            ...
+
+The stores are iterables and the writers have an append method, so they can
+be passed directly to the batch APIs, e.g. FusedMorphism.images(store,
+out=writer), ThetaIsogeny.images or Biextension.tate_pairings.
+"""
+
+import mmap
+import os
+import struct
+
+from utilities.serialization import (
+    BIEXTENSIONS,
+    ELEMENTS,
+    POINTS,
+    decode_header,
+    encode_header,
+    read_kind,
+    record_elements,
+    record_length,
+    records_from_elements,
+)
+
+# ============================================= #
+#   Reading                                     #
+# ============================================= #
+
+
+class PointStore:
+    """
+    A read only memory mapped store of records, decoded on demand. The
+    records are points of `theta()`, biextension elements over it, or
+    elements of `field()`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._data = memoryview(self._mmap)
+
+        self.kind = read_kind(self._data)
+        if self.kind not in (POINTS, BIEXTENSIONS, ELEMENTS):
+            raise ValueError(f"{path} is not a store of records")
+        self._codec, self._theta, offset = decode_header(self._data, self.kind)
+        (self._count,) = struct.unpack_from(">I", self._data, offset)
+        self._offset = offset + 4
+
+        self._record_length = record_length(self.kind, self._theta)
+        self.record_size = self._record_length * self._codec.element_size
+        if len(self._data) < self._offset + self._count * self.record_size:
+            raise ValueError(f"{path} is truncated")
+
+    @classmethod
+    def create(cls, path, theta=None, kind=POINTS, field=None):
+        """
+        A writer of a new store, see PointStoreWriter
+        """
+        return PointStoreWriter(path, theta=theta, kind=kind, field=field)
+
+    def __repr__(self):
+        return f"Store of {len(self)} records at {self.path}"
+
+    def theta(self):
+        """
+        The structure of the records, None for a store of field elements
+        """
+        return self._theta
+
+    def field(self):
+        return self._codec.field
+
+    def __len__(self):
+        return self._count
+
+    def read(self, start=0, stop=None):
+        """
+        Decode the records start, ..., stop - 1
+        """
+        stop = self._count if stop is None else min(stop, self._count)
+        if start >= stop:
+            return []
+        elements = self._codec.decode_elements(
+            self._data,
+            self._offset + start * self.record_size,
+            (stop - start) * self._record_length,
+        )
+        return records_from_elements(self.kind, self._theta, elements)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self._count)
+            if step != 1:
+                return self.read(start, stop)[::step]
+            return self.read(start, stop)
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError("Record index out of range")
+        return self.read(i, i + 1)[0]
+
+    def batches(self, size=1024, start=0, stop=None):
+        """
+        Yield the records in lists of at most size records
+        """
+        stop = self._count if stop is None else min(stop, self._count)
+        for i in range(start, stop, size):
+            yield self.read(i, min(i + size, stop))
+
+    def __iter__(self):
+        for batch in self.batches():
+            yield from batch
+
+    def close(self):
+        self._data.release()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+# ============================================= #
+#   Writing                                     #
+# ============================================= #
+
+
+class PointStoreWriter:
+    """
+    Append records to a new store: points of theta (kind POINTS),
+    biextension elements over theta (BIEXTENSIONS) or elements of field
+    (ELEMENTS). The records are buffered, and the count in the header is
+    written when the writer is closed.
+    """
+
+    def __init__(self, path, theta=None, kind=POINTS, field=None, buffer_size=1024):
+        if kind not in (POINTS, BIEXTENSIONS, ELEMENTS):
+            raise ValueError(f"Cannot store records of kind {kind}")
+        if kind == ELEMENTS and field is None:
+            raise ValueError("A store of field elements needs a field")
+        if kind != ELEMENTS and theta is None:
+            raise ValueError("A store of points needs a structure")
+
+        self.path = path
+        self.kind = kind
+        self.buffer_size = buffer_size
+        self._theta = theta
+        self._codec, header = encode_header(kind, theta, field)
+        self._count_offset = len(header)
+        self._count = 0
+        self._buffer = []
+
+        self._file = open(path, "wb")
+        self._file.write(header + struct.pack(">I", 0))
+
+    def __repr__(self):
+        return f"Writer of {len(self)} records to {self.path}"
+
+    def __len__(self):
+        return self._count + len(self._buffer)
+
+    def append(self, x):
+        if self.kind != ELEMENTS:
+            theta = x.parent()
+            if theta is not self._theta and theta.coords() != self._theta.coords():
+                raise ValueError("The record is not over the structure of the store")
+        self._buffer.append(x)
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def extend(self, records):
+        for x in records:
+            self.append(x)
+
+    def flush(self):
+        kind = self.kind
+        self._file.write(
+            self._codec.encode_elements(
+                c for x in self._buffer for c in record_elements(kind, x)
+            )
+        )
+        self._count += len(self._buffer)
+        self._buffer = []
+
+    def close(self):
+        """
+        Write the buffered records and the count, returns the count
+        """
+        if self._file.closed:
+            return self._count
+        self.flush()
+        self._file.seek(self._count_offset)
+        self._file.write(struct.pack(">I", self._count))
+        self._file.close()
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close()
+        # do not leave a store with a partial payload behind
+        if exc_type is not None:
+            os.remove(self.path)
+        return False
@@ -0,0 +1,427 @@
+"""
+Compact binary format for theta structures, theta points and biextension
+elements, to send work to other processes and to store results.
+
+Pickling elements of finite fields pickles their parent along with them,
+which is slow and bulky (hundreds of bytes per element of GF(p^2)). In this
+format the field is described once in a header and the elements follow as
+fixed width big-endian coefficients, so a batch of points costs exactly
+`count * point_size` bytes after the header.
+
+Layout (integers are big-endian):
+
+    magic       4 bytes, b"THTA"
+    version     u8
+    kind        u8, STRUCTURE, POINTS, BIEXTENSIONS or ELEMENTS
+    field       width w = byte length of p (u16), p (w bytes), degree d (u8),
+                length of the name of the generator (u8) and the name,
+                then the d non leading coefficients of the (monic) modulus
+    structure   class tag (u8), then the coordinates of the null point; the
+                tag is 0 and there is no null point for ELEMENTS
+    count       u32, except for STRUCTURE
+    payload     count records, a point is its coordinates, a biextension
+                element the four points (0, P, Q, P + Q) and ELEMENTS are
+                single field elements (e.g. pairings)
+
+An element of the field is the d * w bytes of its coefficients, from the
+constant one. Decoded structures are interned, see
+theta_structures.interning, so that decoding many batches over the same
+structure shares its precomputations.
+"""
+
+import struct
+
+from sage.misc.lazy_import import lazy_import
+
+lazy_import("sage.all", ["GF", "ZZ"])
+
+from biextensions.biextension import Biextension
+from theta_structures.dimension_one import AffineThetaLine, ThetaLine
+from theta_structures.dimension_two import AffineThetaStructure, ThetaStructure
+
+MAGIC = b"THTA"
+VERSION = 1
+
+# Kinds of payload
+STRUCTURE = 0
+POINTS = 1
+BIEXTENSIONS = 2
+ELEMENTS = 3
+
+# Structures are decoded as the first of these classes in their MRO, so
+# e.g. a ProductThetaStructure is decoded as a ThetaStructure
+STRUCTURE_TAGS = {
+    1: ThetaStructure,
+    2: AffineThetaStructure,
+    3: ThetaLine,
+    4: AffineThetaLine,
+}
+_TAG_OF_CLASS = {cls: tag for tag, cls in STRUCTURE_TAGS.items()}
+
+# ============================================= #
+#   Field elements                              #
+# ============================================= #
+
+
+class FieldCodec:
+    """
+    Encoding of the elements of a finite field GF(p^d) as d fixed width
+    big-endian coefficients
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self.p = ZZ(field.characteristic())
+        self.degree = field.degree()
+        self.width = (self.p.nbits() + 7) // 8
+        self.element_size = self.degree * self.width
+
+    def __repr__(self):
+        return f"Codec of {self.field} with {self.element_size} bytes per element"
+
+    def _coefficients(self, x):
+        # coordinates are not always elements of the field, e.g. the
+        # integer 1 in some null points
+        F = self.field
+        try:
+            if x.parent() is not F:
+                x = F(x)
+        except AttributeError:
+            x = F(x)
+        if self.degree == 1:
+            return (int(x),)
+        return [int(c) for c in x.list()]
+
+    def encode(self, x):
+        """
+        The bytes of an element of the field
+        """
+        w = self.width
+        return b"".join(c.to_bytes(w, "big") for c in self._coefficients(x))
+
+    def encode_elements(self, elements):
+        w = self.width
+        return b"".join(
+            c.to_bytes(w, "big") for x in elements for c in self._coefficients(x)
+        )
+
+    def decode_elements(self, data, offset=0, count=1):
+        """
+        The count elements of the field starting at data[offset]
+        """
+        F, w, d = self.field, self.width, self.degree
+        end = offset + count * self.element_size
+        if end > len(data):
+            raise ValueError("Truncated data")
+        ints = [int.from_bytes(data[i : i + w], "big") for i in range(offset, end, w)]
+        if d == 1:
+            return [F(c) for c in ints]
+        return [F(ints[i : i + d]) for i in range(0, len(ints), d)]
+
+    def header(self):
+        """
+        The description of the field: p, its degree, the name of the
+        generator and the modulus
+        """
+        name = self.field.variable_name().encode() if self.degree > 1 else b""
+        modulus = self.field.modulus().list()[:-1] if self.degree > 1 else []
+        w = self.width
+        return b"".join(
+            [
+                struct.pack(">H", w),
+                int(self.p).to_bytes(w, "big"),
+                struct.pack(">BB", self.degree, len(name)),
+                name,
+                b"".join(int(c).to_bytes(w, "big") for c in modulus),
+            ]
+        )
+
+    @staticmethod
+    def from_header(data, offset=0):
+        """
+        The (shared) codec described by the header at data[offset], and the
+        offset of the end of the header
+        """
+        (w,) = struct.unpack_from(">H", data, offset)
+        offset += 2
+        p = ZZ(int.from_bytes(data[offset : offset + w], "big"))
+        offset += w
+        d, name_length = struct.unpack_from(">BB", data, offset)
+        offset += 2
+        name = bytes(data[offset : offset + name_length]).decode()
+        offset += name_length
+        if d == 1:
+            return field_codec(GF(p)), offset
+        modulus = [int.from_bytes(data[i : i + w], "big") for i in range(offset, offset + d * w, w)]
+        offset += d * w
+        return field_codec(GF(p**d, name=name, modulus=modulus + [1])), offset
+
+
+_CODECS = {}
+
+
+def field_codec(field):
+    """
+    The (shared) codec of a field
+    """
+    try:
+        return _CODECS[field]
+    except KeyError:
+        codec = _CODECS[field] = FieldCodec(field)
+        return codec
+
+
+# ============================================= #
+#   Headers                                     #
+# ============================================= #
+
+
+def _structure_tag(theta):
+    for cls in type(theta).__mro__:
+        if cls in _TAG_OF_CLASS:
+            return _TAG_OF_CLASS[cls]
+    raise TypeError(f"Cannot encode a structure of type {type(theta).__name__}")
+
+
+def encode_header(kind, theta=None, field=None):
+    """
+    The header of a payload of the given kind over theta, with the codec of
+    the base ring of theta. Payloads of ELEMENTS have no structure and are
+    over the given field.
+    """
+    if theta is not None:
+        field = theta.base_ring()
+    codec = field_codec(field)
+    if theta is None:
+        structure = struct.pack(">B", 0)
+    else:
+        structure = struct.pack(">B", _structure_tag(theta)) + codec.encode_elements(
+            theta.coords()
+        )
+    return codec, b"".join(
+        [MAGIC, struct.pack(">BB", VERSION, kind), codec.header(), structure]
+    )
+
+
+def decode_header(data, kind):
+    """
+    Read a header of the given kind, returns the codec, the (interned)
+    structure, or None for ELEMENTS, and the offset of the end of the header
+    """
+    if bytes(data[:4]) != MAGIC:
+        raise ValueError("Not a serialized theta object")
+    version, found = struct.unpack_from(">BB", data, 4)
+    if version != VERSION:
+        raise ValueError(f"Unsupported version {version}")
+    if kind is not None and found != kind:
+        raise ValueError(f"Expected a payload of kind {kind}, got {found}")
+
+    codec, offset = FieldCodec.from_header(data, 6)
+    (tag,) = struct.unpack_from(">B", data, offset)
+    offset += 1
+    if tag == 0:
+        return codec, None, offset
+    if tag not in STRUCTURE_TAGS:
+        raise ValueError(f"Unknown structure tag {tag}")
+    cls = STRUCTURE_TAGS[tag]
+    dimension = 2 if issubclass(cls, ThetaLine) else 4
+    null_point = tuple(codec.decode_elements(data, offset, dimension))
+    offset += dimension * codec.element_size
+    return codec, cls.interned(null_point), offset
+
+
+def read_kind(data):
+    """
+    The kind of the payload of data
+    """
+    if bytes(data[:4]) != MAGIC:
+        raise ValueError("Not a serialized theta object")
+    return data[5]
+
+
+def point_size(theta):
+    """
+    The number of bytes of a point of theta
+    """
+    return len(theta.coords()) * field_codec(theta.base_ring()).element_size
+
+
+# ============================================= #
+#   Records                                     #
+# ============================================= #
+
+
+def record_length(kind, theta):
+    """
+    The number of field elements of a record of the given kind: the
+    coordinates of a point, of the four points (0, P, Q, P + Q) of a
+    biextension element, or a single element
+    """
+    if kind == ELEMENTS:
+        return 1
+    n = len(theta.coords())
+    return 4 * n if kind == BIEXTENSIONS else n
+
+
+def record_elements(kind, x):
+    """
+    The field elements of the record x
+    """
+    if kind == ELEMENTS:
+        return (x,)
+    if kind == POINTS:
+        return x.coords()
+    return tuple(c for T in (x.zero(), x.P(), x.Q(), x.PQ()) for c in T.coords())
+
+
+def records_from_elements(kind, theta, elements):
+    """
+    The records given by a flat list of field elements. The lift of zero
+    of biextension elements is only set when it is not the null point of
+    the structure.
+    """
+    if kind == ELEMENTS:
+        return list(elements)
+
+    point = theta._point
+    n = len(theta.coords())
+    if kind == POINTS:
+        return [point(theta, tuple(elements[i : i + n])) for i in range(0, len(elements), n)]
+
+    null_coords = theta.coords()
+    records = []
+    for i in range(0, len(elements), 4 * n):
+        zero, P, Q, PQ = (tuple(elements[j : j + n]) for j in range(i, i + 4 * n, n))
+        zero = None if zero == null_coords else point(theta, zero)
+        records.append(
+            Biextension(point(theta, P), point(theta, Q), point(theta, PQ), zero=zero)
+        )
+    return records
+
+
+def encode_records(kind, records, theta=None, field=None):
+    """
+    Encode a batch of records of the given kind over the same structure
+    theta (or field, for ELEMENTS), which must be given when there are no
+    records
+    """
+    records = list(records)
+    if theta is None and kind != ELEMENTS:
+        theta = records[0].parent()
+    if field is None and kind == ELEMENTS:
+        field = records[0].parent()
+    codec, header = encode_header(kind, theta, field)
+    return b"".join(
+        [
+            header,
+            struct.pack(">I", len(records)),
+            codec.encode_elements(c for x in records for c in record_elements(kind, x)),
+        ]
+    )
+
+
+def decode_records(data, kind):
+    """
+    Decode a batch of records of the given kind, returns their structure
+    (or field, for ELEMENTS) and the records
+    """
+    codec, theta, offset = decode_header(data, kind)
+    size = record_length(kind, theta)
+    (count,) = struct.unpack_from(">I", data, offset)
+    offset += 4
+    if len(data) != offset + count * size * codec.element_size:
+        raise ValueError("The payload does not match the count of records")
+    elements = codec.decode_elements(data, offset, count * size)
+    return theta or codec.field, records_from_elements(kind, theta, elements)
+
+
+# ============================================= #
+#   Structures, points, biextensions            #
+# ============================================= #
+
+
+def encode_structure(theta):
+    return encode_header(STRUCTURE, theta)[1]
+
+
+def decode_structure(data):
+    return decode_header(data, STRUCTURE)[1]
+
+
+def encode_points(points, theta=None):
+    """
+    Encode a batch of points of the same structure theta (which must be
+    given when there are no points)
+    """
+    return encode_records(POINTS, points, theta=theta)
+
+
+def decode_points(data):
+    """
+    Decode a batch of points, returns their structure and the points
+    """
+    return decode_records(data, POINTS)
+
+
+def encode_biextensions(elements, theta=None):
+    """
+    Encode a batch of biextension elements [0~, P~; Q~, P+Q~] over the same
+    structure theta (which must be given when there are no elements)
+    """
+    return encode_records(BIEXTENSIONS, elements, theta=theta)
+
+
+def decode_biextensions(data):
+    """
+    Decode a batch of biextension elements, returns their structure and the
+    elements
+    """
+    return decode_records(data, BIEXTENSIONS)
+
+
+def encode_field_elements(values, field=None):
+    """
+    Encode a batch of elements of field (which must be given when there are
+    no values), e.g. pairings
+    """
+    return encode_records(ELEMENTS, values, field=field)
+
+
+def decode_field_elements(data):
+    """
+    Decode a batch of field elements, returns the field and the elements
+    """
+    return decode_records(data, ELEMENTS)
+
+
+# ============================================= #
+#   Pickling                                    #
+# ============================================= #
+
+
+def _unpickle_point(theta, data):
+    codec = field_codec(theta.base_ring())
+    coords = codec.decode_elements(data, 0, len(data) // codec.element_size)
+    return theta._point(theta, tuple(coords))
+
+
+def reduce_structure(theta, protocol):
+    """
+    __reduce_ex__ of the structures: the structures of STRUCTURE_TAGS are
+    pickled in the compact format, subclasses carrying more data (e.g.
+    ProductThetaStructure) with the default protocol
+    """
+    if type(theta) not in _TAG_OF_CLASS:
+        return object.__reduce_ex__(theta, protocol)
+    return decode_structure, (encode_structure(theta),)
+
+
+def reduce_point(P, protocol):
+    """
+    __reduce_ex__ of the points: the structure is pickled once per pickle,
+    and the coordinates as bytes
+    """
+    theta = P.parent()
+    if type(theta) not in _TAG_OF_CLASS:
+        return object.__reduce_ex__(P, protocol)
+    return _unpickle_point, (theta, field_codec(theta.base_ring()).encode_elements(P.coords()))
@@ -3,12 +3,14 @@ Helper functions for the supersingular elliptic curve computations in FESTA
 """
 
 # Sage Imports
-from sage.all import ZZ
+from sage.misc.lazy_import import lazy_import
+
+lazy_import("sage.all", "ZZ")
 
 # Local imports
 from utilities.order import has_order_D
 from utilities.discrete_log import weil_pairing_pari
-from utilities.fast_sqrt import sqrt_Fp2
+from utilities.fast_sqrt import sqrt_Fp2_or_none
 
 # =========================================== #
 #   Extract coefficent from Montgomery curve  #
@@ -46,8 +48,8 @@ def random_point(E):
     for _ in range(1000):
         x = F.random_element()
         y2 = x * (x**2 + A * x + 1)
-        if y2.is_square():
-            y = sqrt_Fp2(y2)
+        y = sqrt_Fp2_or_none(y2)
+        if y is not None:
             return E(x, y)
 
     raise ValueError(
@@ -79,8 +81,8 @@ def generate_point(E, x_start=0):
     # for infinite loops
     for _ in range(1000):
         y2 = x * (x**2 + A * x + 1)
-        if y2.is_square():
-            y = sqrt_Fp2(y2)
+        y = sqrt_Fp2_or_none(y2)
+        if y is not None:
             yield E(x, y)
         x += one
 
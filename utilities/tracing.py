@@ -0,0 +1,146 @@
+"""
+Opt-in timing of the stages of isogeny chains and pairings.
+
+The code of the isogenies and of the biextensions wraps its stages in
+`with stage(name):`. When tracing is disabled (the default) stage returns a
+shared no-op context manager, which only costs a context variable lookup.
+Within `with tracing() as tracer:` the wall time and number of calls of each
+stage are accumulated in tracer, and optionally passed to a callback
+callback(name, elapsed) at the end of every stage, e.g. to export them to a
+metrics system.
+
+The stages are:
+
+- isogeny chains: "doubling" (walk of the strategy), "codomain" (each
+  (2, 2)-isogeny and its codomain), "push" (images of the kernel points),
+  "split" (splitting isomorphism and elliptic curves of the codomain) and
+  "image" (evaluation of points)
+- pairings: "ladder", "translation" (even pairings), "ratio" and
+  "final_exponentiation"
+
+Stages may be nested, e.g. the ladders of a Weil pairing, and the time of a
+stage includes the time of the stages it contains.
+
+The tracer is stored in a context variable, so tracing in a thread or an
+asyncio task does not record the stages of the others.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_TRACER = ContextVar("theta_tracer", default=None)
+
+
+class _NullStage:
+    """
+    The stage returned when tracing is disabled
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("_tracer", "_name", "_start")
+
+    def __init__(self, tracer, name):
+        self._tracer = tracer
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._tracer.record(self._name, time.perf_counter() - self._start)
+        return False
+
+
+class Tracer:
+    """
+    Accumulates the wall time and the number of calls of each stage
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self._calls = {}
+        self._times = {}
+
+    def __repr__(self):
+        return f"Tracer with stages {list(self._calls)}"
+
+    def record(self, name, elapsed):
+        self._calls[name] = self._calls.get(name, 0) + 1
+        self._times[name] = self._times.get(name, 0.0) + elapsed
+        if self.callback is not None:
+            self.callback(name, elapsed)
+
+    def calls(self, name):
+        return self._calls.get(name, 0)
+
+    def time(self, name):
+        return self._times.get(name, 0.0)
+
+    def stats(self):
+        """
+        A dictionary name -> {"calls": ..., "time": ...}, time in seconds
+        """
+        return {
+            name: {"calls": self._calls[name], "time": self._times[name]}
+            for name in self._calls
+        }
+
+    def reset(self):
+        self._calls.clear()
+        self._times.clear()
+
+    def report(self):
+        """
+        The stages as a table, sorted by decreasing time
+        """
+        lines = []
+        for name in sorted(self._times, key=self._times.get, reverse=True):
+            t, n = self._times[name], self._calls[name]
+            lines.append(f"{name:24} {n:8} calls {1000 * t:12.3f}ms")
+        return "\n".join(lines)
+
+
+def stage(name):
+    """
+    Context manager timing the stage `name` when tracing is enabled
+    """
+    tracer = _TRACER.get()
+    if tracer is None:
+        return _NULL_STAGE
+    return _Stage(tracer, name)
+
+
+def current_tracer():
+    """
+    The tracer of the current context, or None when tracing is disabled
+    """
+    return _TRACER.get()
+
+
+@contextmanager
+def tracing(callback=None, tracer=None):
+    """
+    Enable tracing within the block, recording in tracer (a new Tracer with
+    the given callback by default), which is returned by __enter__
+    """
+    if tracer is None:
+        tracer = Tracer(callback=callback)
+    token = _TRACER.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _TRACER.reset(token)
@@ -1,4 +1,7 @@
-from sage.all import proof, cached_method, GF
+from sage.misc.cachefunc import cached_method
+from sage.misc.lazy_import import lazy_import
+
+lazy_import("sage.all", ["proof", "GF"])
 
 # ========================== #
 #     Speed up SageMath!     #
@@ -7,13 +10,19 @@ from sage.all import proof, cached_method, GF
 
 def speed_up_sagemath():
     """
-    First we set proof.all(False) for general speed ups which
-    keeping everything correct (enough)
+    Importing this package does not load SageMath: the modules only
+    register lazy imports, which load sage.all the first time a Sage
+    object is used. This is the explicit warm-up hook, to be called once
+    before timing-sensitive work.
+
+    First we load SageMath and set proof.all(False) for general speed
+    ups which keeping everything correct (enough)
 
     Then, we apply a monkey patch to cache the vector_space which
     helps with the performance of polynomial computations
     """
-    # Skips strong primality checks and other slow things
+    # Skips strong primality checks and other slow things, this
+    # resolves the lazy imports
     proof.all(False)
 
     # Cache vector spaces to improve performance